@@ -0,0 +1,21 @@
+"""Shared fixtures for the performance benchmarks.
+
+Run with ``pytest benchmarks --benchmark-autosave`` to store the results as
+JSON under ``.benchmarks/`` and compare against a previous run with
+``--benchmark-compare``.
+"""
+
+from unittest.mock import patch
+
+import pytest
+from pysll import Constellation
+
+from cloudcompchem.server import create_app
+
+
+@pytest.fixture(scope="session")
+def http_client():
+    with patch("pysll.Constellation.me", return_value=None):
+        app = create_app(constellation=Constellation())
+        app.config["TESTING"] = True
+        yield app.test_client()
@@ -0,0 +1,12 @@
+"""Molecule payloads used across the benchmarks."""
+
+from __future__ import annotations
+
+# shared with the load generator
+from cloudcompchem.loadtest import WATER, water_cluster
+
+__all__ = ["WATER", "energy_request", "water_cluster"]
+
+
+def energy_request(molecule: dict, basis_set: str = "sto-3g", functional: str = "pbe,pbe") -> dict:
+    return {"config": {"functional": functional, "basis_set": basis_set}, "molecule": molecule}
@@ -0,0 +1,440 @@
+from dataclasses import replace
+from itertools import repeat
+
+import numpy as np
+import pytest
+from molecules import energy_request, water_cluster
+from pyscf.dft import RKS
+
+from cloudcompchem.batching import MicroBatcher
+from cloudcompchem.dft import calculate_energy, calculate_gradients
+from cloudcompchem.fragment import calculate_fragment_energy
+from cloudcompchem.models import (
+    DFTOptRequest,
+    EnergyRequest,
+    GradientRequest,
+    Molecule,
+    ReactionPathRequest,
+    SessionStepRequest,
+    ThermoRequest,
+)
+from cloudcompchem.neb import reaction_path
+from cloudcompchem.opt import run_dft_opt
+from cloudcompchem.properties import PROPERTIES
+from cloudcompchem.scaling import basis_functions
+from cloudcompchem.sessions import SessionStore
+from cloudcompchem.thermochemistry import calculate_thermo
+from cloudcompchem.utils import M
+
+SIZES = [1, 2, 4]
+BASIS_SETS = ["sto-3g", "6-31g*", "ccpvdz"]
+
+
+@pytest.mark.parametrize("basis_set", BASIS_SETS)
+@pytest.mark.parametrize("n_waters", SIZES)
+def test_build_mole(benchmark, n_waters, basis_set):
+    molecule = EnergyRequest.from_dict(energy_request(water_cluster(n_waters))).molecule
+    benchmark(M, atom=molecule.to_pyscf(), basis=basis_set, charge=0, spin=0)
+
+
+@pytest.mark.parametrize("basis_set", BASIS_SETS)
+@pytest.mark.parametrize("n_waters", SIZES)
+def test_calculate_energy(benchmark, n_waters, basis_set):
+    request = EnergyRequest.from_dict(energy_request(water_cluster(n_waters), basis_set=basis_set))
+    result = benchmark.pedantic(calculate_energy, args=(request,), rounds=3, warmup_rounds=1)
+    assert result.converged
+
+
+@pytest.mark.parametrize(
+    "atoms, spin_multiplicity",
+    [
+        pytest.param([("O", (0, 0, 0)), ("H", (0, 0, 0.97))], 2, id="UKS-OH"),
+        pytest.param([("O", (0, 0, 0)), ("H", (0, 0, 0.97)), ("H", (0, 0.94, -0.24))], 1, id="RKS-H2O"),
+        pytest.param([("O", (0, 0, 0)), ("H", (0, 0, 0.97)), ("H", (0, 0.94, -0.24))], 3, id="UKS-H2O-triplet"),
+    ],
+)
+def test_rks_vs_uks(benchmark, atoms, spin_multiplicity):
+    molecule = {
+        "atoms": [{"symbol": s, "position": list(p)} for s, p in atoms],
+        "charge": 0,
+        "spin_multiplicity": spin_multiplicity,
+    }
+    request = EnergyRequest.from_dict(energy_request(molecule, basis_set="ccpvdz"))
+    benchmark.pedantic(calculate_energy, args=(request,), rounds=3, warmup_rounds=1)
+
+
+@pytest.mark.parametrize("preopt", [False, True], ids=["direct", "staged"])
+@pytest.mark.parametrize("solver", ["geomeTRIC", "berny"])
+def test_run_dft_opt(benchmark, solver, preopt):
+    molecule = {
+        "atoms": [
+            {"symbol": "O", "position": [0, 0, 0]},
+            {"symbol": "H", "position": [0, 1, 0]},
+            {"symbol": "H", "position": [0, 0, 1]},
+        ],
+        "charge": 0,
+        "spin_multiplicity": 1,
+    }
+
+    def setup():
+        payload = energy_request(molecule, basis_set="6-31g") | {"solver": solver, "preopt": preopt}
+        request = DFTOptRequest.from_dict(payload)
+        return (request,), {}
+
+    result = benchmark.pedantic(run_dft_opt, setup=setup, rounds=2)
+    assert result.converged
+    benchmark.extra_info["steps"] = {stage.name: stage.steps for stage in result.stages}
+
+
+BENZENE = [
+    ("C", (0.0, 1.397, 0.0)),
+    ("C", (1.2098, 0.6985, 0.0)),
+    ("C", (1.2098, -0.6985, 0.0)),
+    ("C", (0.0, -1.397, 0.0)),
+    ("C", (-1.2098, -0.6985, 0.0)),
+    ("C", (-1.2098, 0.6985, 0.0)),
+    ("H", (0.0, 2.481, 0.0)),
+    ("H", (2.1486, 1.2405, 0.0)),
+    ("H", (2.1486, -1.2405, 0.0)),
+    ("H", (0.0, -2.481, 0.0)),
+    ("H", (-2.1486, -1.2405, 0.0)),
+    ("H", (-2.1486, 1.2405, 0.0)),
+]
+
+
+@pytest.mark.parametrize("symmetry", [True, False], ids=["D2h", "C1"])
+def test_symmetric_molecule(benchmark, symmetry):
+    molecule = {"atoms": [{"symbol": s, "position": list(p)} for s, p in BENZENE], "charge": 0, "spin_multiplicity": 1}
+    request = EnergyRequest.from_dict(energy_request(molecule, basis_set="6-31g"))
+    request.config.symmetry = symmetry
+    benchmark.pedantic(calculate_energy, args=(request,), rounds=3, warmup_rounds=1)
+
+
+@pytest.fixture(scope="module")
+def converged_cluster():
+    molecule = EnergyRequest.from_dict(energy_request(water_cluster(4))).molecule
+    return RKS(M(atom=molecule.to_pyscf(), basis="ccpvdz"), xc="pbe,pbe").run()
+
+
+@pytest.mark.parametrize("name", ["pyscf_mulliken", *PROPERTIES])
+def test_properties(benchmark, converged_cluster, name):
+    """Cost of each property on top of a converged SCF (4 waters,
+    cc-pVDZ), against pyscf's own Mulliken analysis."""
+    fn = (lambda calc: calc.mulliken_pop(verbose=0)) if name == "pyscf_mulliken" else PROPERTIES[name]
+    benchmark.pedantic(fn, args=(converged_cluster,), rounds=5, warmup_rounds=1)
+
+
+@pytest.mark.parametrize("batched", [True, False], ids=["batched", "one-by-one"])
+def test_trajectory_gradients(benchmark, batched):
+    """Ten frames of a vibrating water dimer, in one warm started batch or
+    as independent requests."""
+    frames = []
+    for t in range(10):
+        molecule = water_cluster(2)
+        for atom in molecule["atoms"]:
+            atom["position"][2] += 0.01 * np.sin(t + atom["position"][1])
+        frames.append(molecule)
+
+    config = {"functional": "pbe,pbe", "basis_set": "6-31g"}
+
+    def run():
+        if batched:
+            return calculate_gradients(GradientRequest.from_dict({"config": config, "molecules": frames}))
+        for frame in frames:
+            calculate_gradients(GradientRequest.from_dict({"config": config, "molecule": frame}))
+
+    benchmark.pedantic(run, rounds=2)
+
+
+@pytest.mark.parametrize("mode", ["session", "fresh"])
+def test_md_step(benchmark, mode):
+    """Latency of one small MD step of a water dimer (6-31g): a session
+    step against a fresh single-geometry gradient request."""
+    request = GradientRequest.from_dict(
+        {"config": {"functional": "pbe,pbe", "basis_set": "6-31g"}, "molecule": water_cluster(2)}
+    )
+    positions = request.molecules[0].positions
+    rng = np.random.default_rng(0)
+
+    if mode == "session":
+        store = SessionStore()
+        session_id = store.create(None, request).session_id
+
+        def step():
+            moved = positions + rng.normal(scale=0.005, size=positions.shape)
+            return store.evaluate(session_id, None, SessionStepRequest(positions=moved))
+
+    else:
+        symbols = [atom.symbol for atom in request.molecules[0].atoms]
+
+        def step():
+            moved = positions + rng.normal(scale=0.005, size=positions.shape)
+            molecule = Molecule.from_positions(symbols, moved.tolist(), charge=0, spin_multiplicity=1)
+            return calculate_gradients(replace(request, molecules=[molecule]))
+
+    benchmark.pedantic(step, rounds=5, warmup_rounds=1)
+
+
+@pytest.fixture(scope="module")
+def batcher():
+    batcher = MicroBatcher()
+    yield batcher
+    batcher.close()
+
+
+@pytest.mark.parametrize("mode", ["inline", "batched"])
+def test_small_job_throughput(benchmark, mode, request):
+    """Throughput (jobs/sec, in extra_info) of 32 single water molecules in
+    sto-3g, one after the other in this process against micro-batched over
+    the warm worker pool."""
+    rng = np.random.default_rng(0)
+    jobs = []
+    for _ in range(32):
+        molecule = water_cluster(1)
+        for atom in molecule["atoms"]:
+            atom["position"] = (np.array(atom["position"]) + rng.normal(scale=0.02, size=3)).tolist()
+        jobs.append(EnergyRequest.from_dict(energy_request(molecule)))
+
+    if mode == "inline":
+
+        def run():
+            return [calculate_energy(job) for job in jobs]
+
+    else:
+        pool = request.getfixturevalue("batcher")
+
+        def run():
+            return [future.result() for future in [pool.submit(job) for job in jobs]]
+
+    results = benchmark.pedantic(run, rounds=3, warmup_rounds=1)
+    assert all(result.converged for result in results)
+    benchmark.extra_info["jobs_per_second"] = len(jobs) / benchmark.stats.stats.mean
+
+
+# closed and open shell molecules, including a transition metal oxide that is hard to converge from minao
+GUESS_MOLECULES = {
+    "H2O": (water_cluster(1)["atoms"], 1),
+    "OH": ([{"symbol": "O", "position": [0, 0, 0]}, {"symbol": "H", "position": [0, 0, 0.97]}], 2),
+    "O2": ([{"symbol": "O", "position": [0, 0, 0]}, {"symbol": "O", "position": [0, 0, 1.21]}], 3),
+    "FeO": ([{"symbol": "Fe", "position": [0, 0, 0]}, {"symbol": "O", "position": [0, 0, 1.62]}], 5),
+}
+
+
+def _guess_requests(init_guess: str) -> list[EnergyRequest]:
+    requests = []
+    for atoms, spin_multiplicity in GUESS_MOLECULES.values():
+        molecule = {"atoms": atoms, "charge": 0, "spin_multiplicity": spin_multiplicity}
+        payload = energy_request(molecule, basis_set="def2-svp") | {"fields": ["energy"]}
+        payload["config"]["init_guess"] = init_guess
+        requests.append(EnergyRequest.from_dict(payload))
+    return requests
+
+
+@pytest.fixture(scope="module")
+def minao_cycles():
+    return [calculate_energy(request).scf_cycles for request in _guess_requests("minao")]
+
+
+@pytest.mark.parametrize("init_guess", ["atom", "huckel", "project"])
+def test_init_guess_cycles(benchmark, init_guess, minao_cycles):
+    """SCF cycles per initial guess strategy over GUESS_MOLECULES; the mean
+    cycles saved against minao are reported in extra_info."""
+    requests = _guess_requests(init_guess)
+    results = benchmark.pedantic(lambda: [calculate_energy(request) for request in requests], rounds=1)
+
+    cycles = [result.scf_cycles for result in results]
+    benchmark.extra_info["scf_cycles"] = dict(zip(GUESS_MOLECULES, cycles))
+    benchmark.extra_info["converged"] = sum(result.converged for result in results)
+    benchmark.extra_info["mean_cycles_saved"] = float(np.mean(np.subtract(minao_cycles, cycles)))
+
+
+# stretched geometries on which plain DIIS does not converge in 50 cycles
+UNCONVERGED_MOLECULES = {
+    "stretched H2O": [
+        {"symbol": "O", "position": [0, 0, 0]},
+        {"symbol": "H", "position": [0, 0, 2.6]},
+        {"symbol": "H", "position": [2.5, 0, -0.6]},
+    ],
+    "stretched O3": [
+        {"symbol": "O", "position": [0, 0, 0]},
+        {"symbol": "O", "position": [0, 1.1, 0.7]},
+        {"symbol": "O", "position": [0, -1.9, 0.9]},
+    ],
+}
+
+
+@pytest.mark.parametrize("mode", ["rescue", "resubmit"])
+def test_scf_rescue(benchmark, mode):
+    """Unconverged jobs rescued within the job, against resubmitting them
+    once without the rescue ladder; extra_info holds the converged results
+    and the SCF cycles spent on them."""
+    requests = []
+    for atoms in UNCONVERGED_MOLECULES.values():
+        payload = energy_request({"atoms": atoms, "charge": 0, "spin_multiplicity": 1}) | {"fields": ["energy"]}
+        payload["config"] |= {"basis_set": "6-31g", "scf_rescue": mode == "rescue"}
+        requests.append(EnergyRequest.from_dict(payload))
+    submissions = 1 if mode == "rescue" else 2
+
+    results = benchmark.pedantic(
+        lambda: [calculate_energy(request) for request in requests for _ in range(submissions)], rounds=1
+    )
+    benchmark.extra_info["converged"] = sum(result.converged for result in results[::submissions])
+    benchmark.extra_info["scf_cycles"] = sum(result.scf_cycles for result in results)
+    benchmark.extra_info["rescue_paths"] = [result.rescue_path for result in results]
+
+
+@pytest.mark.parametrize("mode", ["full", "fragmented"])
+def test_fragment_energy(benchmark, mode):
+    """A cluster of 12 waters in one calculation, against its two-body
+    expansion; the error of the expansion and the number of subsystem
+    calculations are reported in extra_info."""
+    payload = energy_request(water_cluster(12), basis_set="6-31g") | {"fields": ["energy"]}
+    if mode == "fragmented":
+        payload["fragmentation"] = {"order": 2}
+    request = EnergyRequest.from_dict(payload)
+    calculate = calculate_energy if mode == "full" else calculate_fragment_energy
+
+    result = benchmark.pedantic(calculate, args=(request,), rounds=1)
+    benchmark.extra_info["energy"] = result.energy
+    if result.fragmentation is not None:
+        benchmark.extra_info["calculations"] = result.fragmentation.calculations
+        del payload["fragmentation"]
+        benchmark.extra_info["error"] = result.energy - calculate_energy(EnergyRequest.from_dict(payload)).energy
+
+
+@pytest.fixture(scope="module")
+def water_relaxation():
+    payload = energy_request(water_cluster(1)) | {"solver": "geomeTRIC", "fields": ["energy", "hessian"]}
+    return run_dft_opt(DFTOptRequest.from_dict(payload))
+
+
+@pytest.mark.parametrize("grid", [1, 100, 1000])
+def test_thermo_grid(benchmark, water_relaxation, grid):
+    """Thermochemistry of water over grid x grid temperatures and
+    pressures, from the Hessian of an optimization."""
+    request = ThermoRequest(
+        molecule=water_relaxation.molecule,
+        energy=water_relaxation.energy,
+        hessian=water_relaxation.hessian,
+        temperatures=np.linspace(100, 2000, grid),
+        pressures=np.geomspace(1e3, 1e7, grid),
+    )
+    result = benchmark(calculate_thermo, request)
+    benchmark.extra_info["grid_points"] = len(result.temperatures) * len(result.pressures)
+
+
+def _ammonia(z: float) -> dict:
+    atoms = [[0, 0, 0], [0.94, 0, z], [-0.47, 0.814, z], [-0.47, -0.814, z]]
+    return {
+        "atoms": [{"symbol": s, "position": p} for s, p in zip("NHHH", atoms)],
+        "charge": 0,
+        "spin_multiplicity": 1,
+    }
+
+
+@pytest.mark.parametrize("mode", ["cold", "warm", "parallel"])
+def test_reaction_path(benchmark, mode):
+    """The umbrella inversion of ammonia with 5 images: every SCF from the
+    initial guess, warm started from the previous iteration, and warm
+    started with the images of each iteration spread over 2 worker
+    processes. extra_info holds the iterations and SCF cycles."""
+    request = ReactionPathRequest.from_dict(
+        {
+            # without polarization functions ammonia is all but planar
+            "config": {"functional": "pbe,pbe", "basis_set": "6-31g*"},
+            "reactant": _ammonia(-0.38),
+            "product": _ammonia(0.38),
+            "images": 5,
+        }
+    )
+    batcher = MicroBatcher(workers=2)
+    if mode == "parallel":
+        # start the workers outside of the timing
+        batcher.map(abs, [1, 2])
+        map_images = batcher.map
+    elif mode == "cold":
+
+        def map_images(fn, configs, molecules, densities):
+            return map(fn, configs, molecules, repeat(None))
+
+    else:
+        map_images = map
+
+    try:
+        result = benchmark.pedantic(lambda: list(reaction_path(request, map_images))[-1], rounds=1)
+    finally:
+        batcher.close()
+    benchmark.extra_info["converged"] = result.converged
+    benchmark.extra_info["iterations"] = result.iterations
+    benchmark.extra_info["scf_cycles"] = result.scf_cycles
+    benchmark.extra_info["barrier"] = result.barrier
+
+
+TS_SEARCHES = {
+    "every-step": {"recalc_hessian": 1},
+    "every-3": {"recalc_hessian": 3},
+    "initial": {},
+    "preopt": {},
+}
+
+
+@pytest.mark.parametrize("mode", TS_SEARCHES)
+def test_transition_state(benchmark, mode):
+    """The planar transition state of the ammonia inversion, recalculating
+    the analytic Hessian every step, every 3 steps or never after the
+    initial one, and starting from the Hessian of a HF/STO-3G search.
+    extra_info holds the steps and the Hessians calculated."""
+    payload = {
+        "config": {"functional": "pbe,pbe", "basis_set": "6-31g*"},
+        "molecule": _ammonia(0.1),
+        "solver": "geomeTRIC",
+        "fields": ["energy", "hessian"],
+        "transition_state": TS_SEARCHES[mode],
+    }
+    if mode == "preopt":
+        payload["preopt"] = {"functional": "hf", "basis_set": "sto-3g"}
+    request = DFTOptRequest.from_dict(payload)
+    result = benchmark.pedantic(run_dft_opt, args=(request,), rounds=1)
+    benchmark.extra_info["verified"] = result.transition_state.verified
+    benchmark.extra_info["steps"] = [stage.steps for stage in result.stages]
+    benchmark.extra_info["hessians"] = result.transition_state.hessians
+
+
+HEAVY_ELEMENT_COMPLEXES = {
+    "HgCl2": {
+        "atoms": [
+            {"symbol": "Hg", "position": [0, 0, 0]},
+            {"symbol": "Cl", "position": [2.25, 0, 0]},
+            {"symbol": "Cl", "position": [-2.25, 0, 0]},
+        ],
+        "charge": 0,
+        "spin_multiplicity": 1,
+    },
+    "PdCl4": {
+        "atoms": [
+            {"symbol": "Pd", "position": [0, 0, 0]},
+            {"symbol": "Cl", "position": [2.33, 0, 0]},
+            {"symbol": "Cl", "position": [-2.33, 0, 0]},
+            {"symbol": "Cl", "position": [0, 2.33, 0]},
+            {"symbol": "Cl", "position": [0, -2.33, 0]},
+        ],
+        "charge": -2,
+        "spin_multiplicity": 1,
+    },
+}
+
+
+@pytest.mark.parametrize("ecp", ["none", "auto"], ids=["all-electron", "ecp"])
+@pytest.mark.parametrize("name", HEAVY_ELEMENT_COMPLEXES)
+def test_heavy_element_ecp(benchmark, name, ecp):
+    """Heavy-element complexes in the all-electron DZP-DKH basis set,
+    against def2-SVP with the def2 ECP on the metal; extra_info holds the
+    basis functions and SCF cycles."""
+    payload = energy_request(HEAVY_ELEMENT_COMPLEXES[name], basis_set="dzp-dkh") | {"fields": ["energy"]}
+    payload["config"]["ecp"] = ecp
+    request = EnergyRequest.from_dict(payload)
+
+    result = benchmark.pedantic(calculate_energy, args=(request,), rounds=1)
+    benchmark.extra_info["basis_functions"] = basis_functions("dzp-dkh", request.molecule, ecp)
+    benchmark.extra_info["scf_cycles"] = result.scf_cycles
+    benchmark.extra_info["ecp"] = {symbol: assignment.ecp for symbol, assignment in (result.ecp or {}).items()}
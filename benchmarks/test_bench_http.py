@@ -0,0 +1,20 @@
+import pytest
+from molecules import energy_request, water_cluster
+
+HEADERS = {"Authorization": "Bearer benchmark"}
+
+
+def test_health_check_throughput(benchmark, http_client):
+    benchmark(http_client.get, "/health-check")
+
+
+@pytest.mark.parametrize("n_waters", [1, 2])
+def test_energy_endpoint(benchmark, http_client, n_waters):
+    """End to end /energy round trip against a stubbed Constellation."""
+    payload = energy_request(water_cluster(n_waters))
+
+    def post():
+        response = http_client.post("/energy", json=payload, headers=HEADERS)
+        assert response.status_code == 200
+
+    benchmark.pedantic(post, rounds=5, warmup_rounds=1)
@@ -0,0 +1,157 @@
+import json
+import tracemalloc
+from dataclasses import asdict, replace
+
+import numpy as np
+import pytest
+from molecules import energy_request, water_cluster
+from pyscf import gto
+
+from cloudcompchem import compression, export
+from cloudcompchem.capabilities import capabilities
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.ingest import mapped_lines, read_xyz
+from cloudcompchem.models import Atom, EnergyRequest, IngestResult, Orbital
+
+
+@pytest.mark.parametrize("n_waters", [1, 10, 100, 1000])
+def test_parse_energy_request(benchmark, n_waters):
+    benchmark(EnergyRequest.from_dict, energy_request(water_cluster(n_waters)))
+
+
+@pytest.mark.parametrize(
+    "config",
+    [{}, {"basis_set": "6-31g"}, {"functional": "b3lpy"}],
+    ids=["valid", "element-not-in-basis", "unknown-functional"],
+)
+def test_capability_check(benchmark, config):
+    """Parse a 100 atom request (with iodine) against the capability
+    index, which rejects the bad ones before they reach a worker."""
+    request = energy_request(water_cluster(33))
+    request["molecule"]["atoms"].append({"symbol": "I", "position": [0.0, 0.0, -5.0]})
+    request["molecule"]["charge"] = -1
+    request["config"] |= config
+    capabilities()
+
+    def parse():
+        try:
+            return EnergyRequest.from_dict(request)
+        except DFTRequestValidationException as err:
+            return err
+
+    result = benchmark(parse)
+    assert isinstance(result, EnergyRequest) == (config == {})
+
+
+def _per_atom_path(body: bytes) -> list:
+    """Body to pyscf atoms the way requests were parsed before the fast
+    path: one ``Atom(**a)`` per atom and pyscf's string input."""
+    d = json.loads(body)
+    atoms = [Atom(**a) for a in d["molecule"]["atoms"]]
+    return gto.format_atom("; ".join(str(a) for a in atoms))
+
+
+def _fast_path(body: bytes) -> list:
+    return gto.format_atom(EnergyRequest.from_dict(json.loads(body)).molecule.to_pyscf())
+
+
+@pytest.mark.parametrize("path", [_per_atom_path, _fast_path], ids=["per-atom", "fast"])
+def test_parse_10k_atom_body(benchmark, path):
+    """Raw request body to the atom list pyscf builds the molecule from."""
+    body = json.dumps(energy_request(water_cluster(3334))).encode()
+    atoms = benchmark(path, body)
+    assert len(atoms) == 10002
+
+
+@pytest.fixture(scope="module")
+def conformer_file(tmp_path_factory):
+    """A multi-XYZ file of 20k water trimers (about 3 MB)."""
+    path = tmp_path_factory.mktemp("ingest") / "conformers.xyz"
+    rng = np.random.default_rng(0)
+    atoms = water_cluster(3)["atoms"]
+    with open(path, "w") as handle:
+        for i in range(20_000):
+            handle.write(f"{len(atoms)}\nconformer {i}\n")
+            for atom, noise in zip(atoms, rng.normal(scale=0.05, size=(len(atoms), 3))):
+                x, y, z = np.add(atom["position"], noise)
+                handle.write(f"{atom['symbol']} {x:.6f} {y:.6f} {z:.6f}\n")
+    return path
+
+
+def test_read_multi_xyz(benchmark, conformer_file):
+    """Stream a structure file through validation, without holding it in
+    memory."""
+
+    def read():
+        with mapped_lines(conformer_file) as lines:
+            return sum(record.molecule is not None for record in read_xyz(lines))
+
+    assert benchmark(read) == 20_000
+    benchmark.extra_info["records_per_second"] = 20_000 / benchmark.stats.stats.mean
+    tracemalloc.start()
+    read()
+    benchmark.extra_info["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+
+@pytest.fixture(scope="module")
+def exported_results(tmp_path_factory):
+    """20k water trimer results, as JSON lines and as Parquet."""
+    directory = tmp_path_factory.mktemp("export")
+    molecule = EnergyRequest.from_dict(energy_request(water_cluster(3))).molecule
+    response = calculate_energy(EnergyRequest.from_dict(energy_request(water_cluster(3))))
+    rng = np.random.default_rng(0)
+    results = []
+    for i in range(20_000):
+        # conformers differ a little in every number
+        orbitals = [Orbital(o.energy + rng.normal(scale=1e-3), o.occupancy) for o in response.orbitals or []]
+        varied = replace(response, energy=response.energy + rng.normal(scale=1e-3), orbitals=orbitals)
+        results.append(IngestResult(i, f"conformer {i}", result=varied, molecule=molecule))
+    with open(directory / "results.jsonl", "w") as handle:
+        for result in results:
+            handle.write(json.dumps(result.to_dict()) + "\n")
+    for _ in export.write(export.record_batches(results), directory / "results.parquet", "parquet"):
+        pass
+    return directory
+
+
+@pytest.mark.parametrize("format", ["jsonl", "parquet"])
+def test_load_results(benchmark, exported_results, format):
+    """Load the energies and orbital energies of 20k results for analysis."""
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    def load_json():
+        with open(exported_results / "results.jsonl") as handle:
+            rows = [json.loads(line)["result"] for line in handle]
+        return [row["energy"] for row in rows], [[o["energy"] for o in row["orbitals"]] for row in rows]
+
+    def load_parquet():
+        table = pq.read_table(exported_results / "results.parquet", columns=["energy", "orbital_energies"])
+        return table["energy"].to_numpy(), table["orbital_energies"].combine_chunks().flatten().to_numpy()
+
+    energies, _ = benchmark(load_json if format == "jsonl" else load_parquet)
+    assert len(energies) == 20_000
+    benchmark.extra_info["bytes"] = (exported_results / f"results.{format}").stat().st_size
+
+
+@pytest.mark.parametrize("n_waters", [1, 10, 100, 1000])
+def test_molecule_to_pyscf_string(benchmark, n_waters):
+    request = EnergyRequest.from_dict(energy_request(water_cluster(n_waters)))
+    benchmark(str, request.molecule)
+
+
+@pytest.mark.parametrize("basis_set", ["sto-3g", "ccpvdz"])
+def test_serialize_energy_response(benchmark, basis_set):
+    response = calculate_energy(EnergyRequest.from_dict(energy_request(water_cluster(2), basis_set=basis_set)))
+    benchmark(lambda: json.dumps(asdict(response)))
+
+
+@pytest.mark.parametrize("encoding", compression.supported_encodings())
+def test_compress_hessian_response(benchmark, encoding):
+    """A 100 atom optimization response is dominated by its 300x300
+    Hessian."""
+    hessian = np.random.default_rng(0).normal(size=(300, 300))
+    body = json.dumps({"hessian": hessian.tolist()}).encode()
+    compressed = benchmark(compression.compress, body, encoding)
+    benchmark.extra_info["ratio"] = len(body) / len(compressed)
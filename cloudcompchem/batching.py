@@ -0,0 +1,178 @@
+"""Micro-batching of small energy calculations.
+
+For a molecule of a few atoms in a small basis the SCF is over in a
+fraction of a second, so the fixed cost of a request (dispatching the
+job, importing and setting up pyscf, parsing the basis set) is as large
+as the calculation itself. A ``MicroBatcher`` collects the small energy
+requests that arrive within a short window and runs them back to back in
+a pool of warm worker processes, one single-threaded process per core,
+that keep pyscf and the parsed basis sets loaded between jobs. Every
+request still gets its own result.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Iterable
+
+from pyscf import lib
+
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.metrics import BATCH_SIZE, basis_label
+from cloudcompchem.models import EnergyRequest, SinglePointEnergyResponse
+
+logger = logging.getLogger("cloudcompchem.batching")
+
+# requests up to this many atoms in one of these basis sets (as normalized by
+# metrics.basis_label) are batched; everything else runs on its own
+SMALL_MAX_ATOMS = 10
+SMALL_BASIS_SETS = frozenset({"sto3g", "321g", "631g", "631g*", "631g**", "def2svp", "ccpvdz"})
+
+BATCH_WINDOW_SECONDS = 0.02
+MAX_BATCH_SIZE = 64
+
+
+def is_small(request: EnergyRequest) -> bool:
+    """Whether a request is cheap enough to be worth batching."""
+    return len(request.molecule.atoms) <= SMALL_MAX_ATOMS and basis_label(request.config.basis_set) in SMALL_BASIS_SETS
+
+
+def default_workers(web_workers: int = 1) -> int:
+    """Batch worker processes per web worker: the cores shared out between
+    the ``web_workers`` processes that each run a batcher."""
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+def run_batch(requests: list[EnergyRequest]) -> list[SinglePointEnergyResponse | Exception]:
+    """Run energy calculations back to back, returning the response or the
+    exception of each request in order."""
+    results: list[SinglePointEnergyResponse | Exception] = []
+    for request in requests:
+        try:
+            results.append(calculate_energy(request))
+        except Exception as err:
+            results.append(err)
+    return results
+
+
+def _init_worker():
+    # the pool already spreads the jobs over the cores
+    lib.num_threads(1)
+
+
+class MicroBatcher:
+    """Collects small energy requests for ``window`` seconds (or until
+    ``max_batch`` are waiting) and splits each batch over ``workers``
+    processes.
+
+    The worker processes and the collecting thread are started on the
+    first request, so that a batcher created before gunicorn forks its
+    workers does not share them between workers.
+    """
+
+    def __init__(
+        self,
+        window: float = BATCH_WINDOW_SECONDS,
+        max_batch: int = MAX_BATCH_SIZE,
+        workers: int | None = None,
+    ):
+        self.window = window
+        self.max_batch = max_batch
+        self.workers = workers or default_workers()
+        self._queue: queue.SimpleQueue[tuple[EnergyRequest, Future] | None] = queue.SimpleQueue()
+        self._pool: ProcessPoolExecutor | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, request: EnergyRequest) -> Future:
+        """Queue a request; the future resolves to its
+        SinglePointEnergyResponse."""
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._start()
+            self._queue.put((request, future))
+        return future
+
+    def map(self, fn: Callable, *iterables: Iterable) -> list:
+        """Run ``fn`` over ``iterables`` on the worker processes, like
+        ``map`` but outside of the micro-batches, for jobs whose steps are
+        independent calculations (e.g. the images of a reaction path)."""
+        with self._lock:
+            if self._thread is None:
+                self._start()
+            pool = self._pool
+        return list(pool.map(fn, *iterables))  # pyright: ignore
+
+    def close(self):
+        """Run the requests already queued, then stop the collecting thread
+        and the worker processes."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._pool.shutdown()  # pyright: ignore
+            self._thread = self._pool = None
+
+    def _start(self):
+        # spawned workers: forking a process that runs request threads is not safe
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"), initializer=_init_worker)
+        self._thread = threading.Thread(target=self._collect, name="cloudcompchem-batcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Started micro-batching over {self.workers} worker processes")
+
+    def _collect(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, closing = [item], False
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self._dispatch(batch)
+            if closing:
+                return
+
+    def _dispatch(self, batch: list[tuple[EnergyRequest, Future]]):
+        batch = [(request, future) for request, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        BATCH_SIZE.observe(len(batch))
+
+        # interleaved chunks, one per worker, so that every worker gets a similar mix of molecule sizes
+        n_chunks = min(self.workers, len(batch))
+        for i in range(n_chunks):
+            chunk = batch[i::n_chunks]
+            job = self._pool.submit(run_batch, [request for request, _ in chunk])  # pyright: ignore
+            job.add_done_callback(lambda job, futures=[future for _, future in chunk]: _resolve(job, futures))
+
+
+def _resolve(job: Future, futures: list[Future]):
+    """Hand the results of a chunk to the futures of its requests."""
+    try:
+        results = job.result()
+    except Exception as err:
+        # the worker process died (e.g. out of memory): every request of the chunk failed
+        for future in futures:
+            future.set_exception(err)
+        return
+    for future, result in zip(futures, results, strict=True):
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
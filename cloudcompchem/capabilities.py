@@ -0,0 +1,142 @@
+"""What this installation can calculate: the elements each basis set covers
+and the functionals libxc parses.
+
+Unsupported combinations otherwise only surface deep inside a
+calculation, as a KeyError or RuntimeError after the job was queued and
+the molecule built. The index is built once per process
+(``capabilities()``, which the server calls at startup) and requests are
+checked against it while they are parsed, in microseconds.
+
+Basis sets and functionals outside the index are resolved on first use
+and remembered, so any name pyscf understands still works.
+"""
+
+from __future__ import annotations
+
+import functools
+import logging
+import time
+from dataclasses import dataclass
+from typing import Iterable
+
+from pyscf.dft import libxc
+
+from cloudcompchem.ecp import EcpMode, assign
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.utils import basis_name, load_element_basis
+
+logger = logging.getLogger("cloudcompchem.capabilities")
+
+# unindexed names remembered per process
+CACHE_SIZE = 256
+
+
+@dataclass(frozen=True)
+class Functional:
+    # non-local (VV10) correlation, for which pyscf has no Hessian and no unrestricted gradients
+    nlc: bool
+
+
+def functional_key(functional: str) -> str:
+    return functional.strip().upper()
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _parse_functional(key: str) -> Functional | str:
+    """The functional, or why libxc cannot parse it."""
+    if not key:
+        return "No exchange-correlation functional given."
+    try:
+        libxc.parse_xc(key)
+        return Functional(nlc=bool(libxc.is_nlc(key)))
+    except (KeyError, ValueError, NotImplementedError) as err:
+        return f"Unknown functional '{key.lower()}': {err.args[0] if err.args else err}"
+
+
+def _covers(basis_set: str, symbol: str) -> bool:
+    # through the parsed basis cache that building the molecule uses as well
+    try:
+        return bool(load_element_basis(basis_set, symbol))
+    except (KeyError, ValueError, RuntimeError, OSError):
+        return False
+
+
+class CapabilityIndex:
+    def __init__(self, basis_elements: dict[str, frozenset[str]], functionals: dict[str, Functional]):
+        self.basis_elements = basis_elements
+        self.functionals = functionals
+
+    @staticmethod
+    def build(basis_sets: Iterable[str], functionals: Iterable[str], elements: Iterable[str]) -> CapabilityIndex:
+        elements = list(elements)
+        basis_elements = {
+            basis_name(basis_set): frozenset(symbol for symbol in elements if _covers(basis_set, symbol))
+            for basis_set in basis_sets
+        }
+        parsed = {functional_key(name): _parse_functional(functional_key(name)) for name in functionals}
+        return CapabilityIndex(basis_elements, {key: f for key, f in parsed.items() if isinstance(f, Functional)})
+
+    def functional(self, functional: str) -> Functional:
+        key = functional_key(functional)
+        parsed = self.functionals.get(key) or _parse_functional(key)
+        if isinstance(parsed, str):
+            raise DFTRequestValidationException(parsed)
+        return parsed
+
+    def missing_elements(self, basis_set: str, symbols: Iterable[str], ecp: EcpMode = "none") -> list[str]:
+        """The elements among ``symbols`` that ``basis_set`` has no
+        functions for, leaving out those that get an ECP and their own
+        valence basis set in the ``ecp`` mode."""
+        symbols = set(symbols)
+        symbols -= assign(basis_set, symbols, ecp).keys()
+        covered = self.basis_elements.get(basis_name(basis_set))
+        if covered is not None:
+            return sorted(symbols - covered)
+        return sorted(symbol for symbol in symbols if not _covers(basis_set, symbol))
+
+    def check(
+        self,
+        functional: str,
+        basis_set: str,
+        symbols: Iterable[str],
+        unrestricted: bool,
+        gradient: bool = False,
+        hessian: bool = False,
+        ecp: EcpMode = "none",
+    ):
+        """Raise a DFTRequestValidationException unless the calculation
+        can run: the basis set (or in the ``ecp`` mode, the ECP basis set)
+        covers every element, the functional parses and pyscf has the
+        derivatives the calculation needs for it."""
+        if missing := self.missing_elements(basis_set, symbols, ecp):
+            hint = ""
+            if ecp == "none" and not self.missing_elements(basis_set, missing, "auto"):
+                hint = ' Set "ecp": "auto" to use effective core potentials for them.'
+            raise DFTRequestValidationException(
+                f"Basis set '{basis_set}' is unknown or has no functions for [{', '.join(missing)}].{hint}"
+            )
+        if self.functional(functional).nlc:
+            if hessian:
+                raise DFTRequestValidationException(
+                    f"Hessians are not available for the non-local functional '{functional}'."
+                )
+            if gradient and unrestricted:
+                raise DFTRequestValidationException(
+                    f"Gradients of open-shell molecules are not available for the non-local functional '{functional}'."
+                )
+
+
+@functools.cache
+def capabilities() -> CapabilityIndex:
+    """The capability index of this process, built on first use."""
+    # imported here since both import cloudcompchem.models, which checks requests against the index
+    from cloudcompchem.metrics import KNOWN_BASIS_SETS, KNOWN_FUNCTIONALS
+    from cloudcompchem.models import ATOMIC_NUMBERS
+
+    start = time.perf_counter()
+    index = CapabilityIndex.build(sorted(KNOWN_BASIS_SETS), sorted(KNOWN_FUNCTIONALS), ATOMIC_NUMBERS)
+    logger.info(
+        f"Indexed {len(index.basis_elements)} basis sets and {len(index.functionals)} functionals "
+        f"in {time.perf_counter() - start:.2f} s"
+    )
+    return index
@@ -1,23 +1,69 @@
 from __future__ import annotations
 
 import functools
+import json
 import logging
+from contextlib import contextmanager
 from dataclasses import asdict
+from typing import Callable, Iterator
 
+import numpy as np
 import requests
+import urllib3
 from pysll import Constellation
 
-from cloudcompchem.dft import calculate_energy
+from cloudcompchem import compression, export
+from cloudcompchem.dft import calculate_energy, calculate_gradients
 from cloudcompchem.exceptions import NotLoggedInException, ServerException
+from cloudcompchem.fragment import calculate_fragment_energy
+from cloudcompchem.ingest import (
+    calculate_energies,
+    detect_format,
+    ingest_result,
+    mapped_lines,
+    read_structures,
+)
 from cloudcompchem.models import (
+    DEFAULT_ENERGY_FIELDS,
+    DEFAULT_NEB_FMAX,
+    DEFAULT_NEB_IMAGES,
+    DEFAULT_NEB_MAX_ITERATIONS,
+    ENERGY_FIELDS,
+    PROPERTY_NAMES,
     EnergyRequest,
+    FragmentationConfig,
     FunctionalConfig,
+    GradientRequest,
+    GradientResponse,
+    GradientResult,
+    IngestResult,
     Molecule,
+    Property,
+    ReactionPathProgress,
+    ReactionPathRequest,
+    ReactionPathResponse,
+    ResponseField,
+    SessionResponse,
+    SessionStepRequest,
     SinglePointEnergyResponse,
+    StructureFormat,
+    StructureRelaxationResponse,
+    ThermoRequest,
+    ThermoResponse,
+    parse_fields,
 )
+from cloudcompchem.neb import reaction_path
+from cloudcompchem.sessions import SessionStore
+from cloudcompchem.thermochemistry import calculate_thermo
 
 logger = logging.getLogger(__file__)
 
+# upper bound for responses we decompress ourselves
+MAX_RESPONSE_BYTES = 2**30
+
+# chunk size of structure file uploads, in bytes
+UPLOAD_CHUNK_BYTES = 2**16
+
 
 # define a decorator requiring login for method
 def requires_login(fn):
@@ -38,18 +84,35 @@ def requires_login(fn):
 
 
 class Client:
-    def __init__(self, local: bool, constellation: Constellation = Constellation(), url: str = "http://localhost:5000"):
+    def __init__(
+        self,
+        local: bool,
+        constellation: Constellation = Constellation(),
+        url: str = "http://localhost:5000",
+        compress: bool = True,
+    ):
         self._auth_token = None
         self._url = url
         self._constellation = constellation
         self.local = local
+        # gzip request bodies above compression.COMPRESS_MIN_BYTES and ask for compressed responses
+        self.compress = compress
+        # sessions of local clients live in this process
+        self._local_sessions = SessionStore()
 
     def login(self, username: str, password: str):
         self._constellation.login(username=username, password=password)
         self._auth_token = self._constellation._auth_token
 
     @requires_login
-    def single_point_energy(self, molecule: Molecule, config: FunctionalConfig) -> SinglePointEnergyResponse:
+    def single_point_energy(
+        self,
+        molecule: Molecule,
+        config: FunctionalConfig,
+        fields: list[ResponseField] | None = None,
+        properties: list[Property] | None = None,
+        fragmentation: FragmentationConfig | None = None,
+    ) -> SinglePointEnergyResponse:
         """Calculate the energy of the given molecule. The calculator does not
         need to be installed locally since the calculation is offloaded to the
         API.
@@ -59,6 +122,13 @@ class Client:
         molecule (Molecule): The chemical that will have its energy calculated.
         calculator (Calculator): The electronic structure method (with parameters)
             that calculates the energy
+        fields (list[str]): The optional parts of the response to return ("orbitals",
+            "homo_lumo"); the total energy is always returned. Defaults to the orbitals.
+        properties (list[str]): Properties computed from the same SCF ("dipole",
+            "mulliken_charges", "lowdin_charges", "gradient").
+        fragmentation (FragmentationConfig): Expand the energy over fragments of the
+            molecule, for molecules too large for one calculation. Only the energy and
+            the "gradient" property are available then.
         Returns:
         --------
         EnergyCalculation: object that contains the results of the energy calculation
@@ -66,21 +136,341 @@ class Client:
         """
 
         # build the api request payload
-        req = EnergyRequest(molecule=molecule, config=config)
+        req = EnergyRequest(
+            molecule=molecule,
+            config=config,
+            fields=parse_fields(fields, ENERGY_FIELDS, ("energy",) if fragmentation else DEFAULT_ENERGY_FIELDS),
+            properties=parse_fields(properties, PROPERTY_NAMES, key="properties"),
+            fragmentation=fragmentation,
+        )
         if self.local is True:
-            return calculate_energy(req)
+            return calculate_energy(req) if fragmentation is None else calculate_fragment_energy(req)
         else:
             return self._calculate_energy_from_url(req)
 
+    @requires_login
+    def energy_and_gradient(self, molecules: Molecule | list[Molecule], config: FunctionalConfig) -> GradientResponse:
+        """Calculate energies and nuclear gradients for one or more
+        geometries of the same molecule.
+
+        Parameters:
+        -----------
+        molecules (Molecule | list[Molecule]): The geometries, e.g. successive frames of a
+            trajectory. Each SCF starts from the density of the previous geometry, so
+            ordering them along the trajectory makes the batch faster.
+        config (FunctionalConfig): The functional and basis set.
+        Returns:
+        --------
+        GradientResponse: the energy (Hartree), the gradient (Hartree/Bohr, the negative
+            of the forces) and the SCF cycles of every geometry, in order.
+        """
+        if isinstance(molecules, Molecule):
+            molecules = [molecules]
+        req = GradientRequest(config=config, molecules=molecules)
+        if self.local is True:
+            return calculate_gradients(req)
+        return GradientResponse.from_dict(self._post("/gradient", asdict(req)))
+
+    @requires_login
+    def thermochemistry(
+        self,
+        relaxation: StructureRelaxationResponse,
+        temperatures: list[float] | np.ndarray = (298.15,),
+        pressures: list[float] | np.ndarray = (101325.0,),
+    ) -> ThermoResponse:
+        """Thermochemistry of an optimized molecule over grids of
+        temperatures and pressures, without any new electronic structure
+        calculation.
+
+        Parameters:
+        -----------
+        relaxation (StructureRelaxationResponse): The result of ``/opt``, including its Hessian.
+        temperatures (list[float]): Temperatures in K.
+        pressures (list[float]): Pressures in Pa.
+        Returns:
+        --------
+        ThermoResponse: ZPE, internal energy, enthalpy and heat capacity per temperature,
+            entropy and Gibbs free energy per temperature and pressure.
+        """
+        # responses decoded from JSON hold the molecule as a dict
+        molecule = relaxation.molecule
+        payload = {
+            "molecule": asdict(molecule) if isinstance(molecule, Molecule) else molecule,
+            "energy": relaxation.energy,
+            "hessian": np.asarray(relaxation.hessian).tolist(),
+            "temperatures": np.asarray(temperatures, dtype=float).tolist(),
+            "pressures": np.asarray(pressures, dtype=float).tolist(),
+        }
+        if self.local is True:
+            return calculate_thermo(ThermoRequest.from_dict(payload))
+        return ThermoResponse.from_dict(self._post("/thermo", payload))
+
+    @requires_login
+    def reaction_path(
+        self,
+        reactant: Molecule,
+        product: Molecule,
+        config: FunctionalConfig,
+        images: int = DEFAULT_NEB_IMAGES,
+        climbing: bool = True,
+        fmax: float = DEFAULT_NEB_FMAX,
+        max_iterations: int = DEFAULT_NEB_MAX_ITERATIONS,
+        on_progress: Callable[[ReactionPathProgress], None] | None = None,
+    ) -> ReactionPathResponse:
+        """Find the minimum energy path between two optimized geometries of
+        the same molecule with the nudged elastic band method.
+
+        Parameters:
+        -----------
+        reactant, product (Molecule): The ends of the path, with the atoms in the same order.
+        config (FunctionalConfig): The functional and basis set.
+        images (int): Number of images between the reactant and the product.
+        climbing (bool): Let the highest image climb to the saddle point.
+        fmax (float): Convergence threshold on the largest force (Hartree/Bohr).
+        max_iterations (int): Iterations before giving up.
+        on_progress (callable): Called with the progress after every iteration.
+        Returns:
+        --------
+        ReactionPathResponse: the geometries and energies of the images, the barrier
+            (Hartree) and the index of the climbing image, the estimate of the saddle point.
+        """
+        req = ReactionPathRequest(
+            config=config,
+            reactant=reactant,
+            product=product,
+            images=images,
+            climbing=climbing,
+            fmax=fmax,
+            max_iterations=max_iterations,
+        )
+        if self.local is True:
+            items = reaction_path(req)
+        else:
+            items = (self._decode_reaction_path(line) for line in self._post_stream("/reaction-path", asdict(req)))
+        for item in items:
+            if isinstance(item, ReactionPathResponse):
+                return item
+            if on_progress is not None:
+                on_progress(item)
+        raise ServerException("The reaction path ended without a result.")
+
+    @requires_login
+    def energies_from_file(
+        self,
+        path: str,
+        config: FunctionalConfig,
+        format: StructureFormat | None = None,
+        charge: int = 0,
+        spin_multiplicity: int = 1,
+        fields: tuple[ResponseField, ...] = DEFAULT_ENERGY_FIELDS,
+    ) -> Iterator[IngestResult]:
+        """Compute the energy of every structure of a multi-XYZ or SDF file.
+
+        The file is uploaded as it is read and the results arrive while the
+        service works through it, so neither side holds the whole file.
+
+        Parameters:
+        -----------
+        path (str): The structure file.
+        config (FunctionalConfig): The functional and basis set.
+        format (str): "xyz" or "sdf", by default from the file extension.
+        charge, spin_multiplicity (int): Of XYZ records that do not set their own.
+        fields (tuple): The fields of each result, see `energy`.
+        Returns:
+        --------
+        Iterator[IngestResult]: one per record in file order, with its result or the reason it failed.
+        """
+        structure_format = format or detect_format(path)
+        fields = parse_fields(list(fields), ENERGY_FIELDS)
+        if self.local is True:
+            with mapped_lines(path) as lines:
+                structures = read_structures(lines, structure_format, charge, spin_multiplicity)
+                for record, result in calculate_energies(structures, config, fields=fields):
+                    yield ingest_result(record, result)
+            return
+
+        params = self._ingest_params(structure_format, config, charge, spin_multiplicity, fields)
+        with self._upload(path, "/ingest", params) as resp:
+            for raw in resp.iter_lines():
+                if not raw:
+                    continue
+                line = json.loads(raw)
+                if "error" in line and "index" not in line:
+                    raise ServerException(line["error"])
+                if "summary" not in line:
+                    yield IngestResult.from_dict(line)
+
+    @requires_login
+    def export_energies_from_file(
+        self,
+        path: str,
+        config: FunctionalConfig,
+        output: str,
+        format: StructureFormat | None = None,
+        charge: int = 0,
+        spin_multiplicity: int = 1,
+        fields: tuple[ResponseField, ...] = DEFAULT_ENERGY_FIELDS,
+    ) -> None:
+        """Like `energies_from_file`, but write the results as columns to a
+        Parquet (.parquet) or Arrow stream (.arrow) file for analytics; see
+        cloudcompchem.export for the columns. Needs pyarrow locally only to
+        read the file."""
+        structure_format = format or detect_format(path)
+        columnar = export.detect_format(output)
+        fields = parse_fields(list(fields), ENERGY_FIELDS)
+        if self.local is True:
+            with mapped_lines(path) as lines:
+                structures = read_structures(lines, structure_format, charge, spin_multiplicity)
+                outcomes = calculate_energies(structures, config, fields=fields)
+                results = (ingest_result(record, result, keep_molecule=True) for record, result in outcomes)
+                for _ in export.write(export.record_batches(results, config), output, columnar):
+                    pass
+            return
+
+        params = self._ingest_params(structure_format, config, charge, spin_multiplicity, fields)
+        with self._upload(path, "/ingest", params | {"output": columnar}) as resp, open(output, "wb") as handle:
+            for chunk in resp.iter_content(UPLOAD_CHUNK_BYTES):
+                handle.write(chunk)
+
+    @staticmethod
+    def _ingest_params(
+        structure_format: str, config: FunctionalConfig, charge: int, spin_multiplicity: int, fields: tuple
+    ) -> dict:
+        return {
+            "format": structure_format,
+            "functional": config.functional,
+            "basis_set": config.basis_set,
+            "ecp": config.ecp,
+            "charge": charge,
+            "spin_multiplicity": spin_multiplicity,
+            "fields": ",".join(fields),
+        }
+
+    @contextmanager
+    def _upload(self, path: str, url_path: str, params: dict) -> Iterator[requests.Response]:
+        """POST a file as it is read, gzip compressed unless compression is
+        off, and open the streamed response."""
+        headers = {"Authorization": "Bearer " + (self._auth_token or ""), "Content-Type": "text/plain"}
+        with open(path, "rb") as handle:
+            body: Iterator[bytes] = iter(lambda: handle.read(UPLOAD_CHUNK_BYTES), b"")
+            if self.compress:
+                body = compression.compress_chunks(body, "gzip")
+                headers["Content-Encoding"] = "gzip"
+            with requests.post(
+                url=self._url + url_path, data=body, headers=headers, params=params, stream=True
+            ) as resp:
+                if resp.status_code // 100 != 2:
+                    raise ServerException(resp.text)
+                yield resp
+
+    @staticmethod
+    def _decode_reaction_path(line: dict) -> ReactionPathProgress | ReactionPathResponse:
+        if "error" in line:
+            raise ServerException(line["error"])
+        if "result" in line:
+            return ReactionPathResponse.from_dict(line["result"])
+        return ReactionPathProgress(**line["progress"])
+
+    @requires_login
+    def open_session(self, molecule: Molecule, config: FunctionalConfig) -> Session:
+        """Start a session that keeps a live SCF for ``molecule`` between
+        steps, for MD and optimizer drivers.
+
+        The initial geometry is evaluated right away (``session.result``).
+        Use the session as a context manager, or call ``close()``, to free
+        it on the server.
+        """
+        req = GradientRequest(config=config, molecules=[molecule])
+        if self.local is True:
+            response = self._local_sessions.create(None, req)
+        else:
+            response = SessionResponse.from_dict(self._post("/sessions", asdict(req)))
+        return Session(self, response)
+
     def _calculate_energy_from_url(self, req: EnergyRequest) -> SinglePointEnergyResponse:
         # serialize the request into a dict and send the request
         req_dict = asdict(req)
+        e_resp = self._post("/energy", req_dict)
+        return SinglePointEnergyResponse.from_dict(e_resp)
+
+    def _delete(self, path: str) -> dict:
         headers = {"Authorization": "Bearer " + (self._auth_token or "")}
-        resp = requests.post(url=self._url + "/energy", json=req_dict, headers=headers)
+        resp = requests.delete(url=self._url + path, headers=headers)
+        if resp.status_code // 100 != 2:
+            raise ServerException(resp.text)
+        return resp.json()
+
+    def _post(self, path: str, payload: dict) -> dict:
+        """Send ``payload`` as JSON, compressing it (and asking for a
+        compressed response) when enabled.
+
+        Request bodies are always gzipped since every server can read
+        gzip, while zstd needs the optional ``zstandard`` package.
+        """
+        headers, body = self._json_body(payload)
+        resp = requests.post(url=self._url + path, data=body, headers=headers)
         # check if the status code is 2XX, if it's not error out early
         if resp.status_code // 100 != 2:
             raise ServerException(resp.text)
 
-        # else we populate the energy calculation object with response
-        e_resp = resp.json()
-        return SinglePointEnergyResponse.from_dict(e_resp)
+        # urllib3 transparently decodes gzip (and zstd, when it supports it)
+        encoding = resp.headers.get("Content-Encoding", "identity")
+        if encoding in compression.supported_encodings() and encoding not in urllib3.util.request.ACCEPT_ENCODING:
+            return json.loads(compression.decompress(resp.content, encoding, MAX_RESPONSE_BYTES))
+        return resp.json()
+
+    def _post_stream(self, path: str, payload: dict) -> Iterator[dict]:
+        """Send ``payload`` like ``_post`` and decode the response as it
+        streams in, one JSON object per line."""
+        headers, body = self._json_body(payload)
+        with requests.post(url=self._url + path, data=body, headers=headers, stream=True) as resp:
+            if resp.status_code // 100 != 2:
+                raise ServerException(resp.text)
+            for line in resp.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def _json_body(self, payload: dict) -> tuple[dict, bytes]:
+        """The headers and body of a JSON request."""
+        headers = {"Authorization": "Bearer " + (self._auth_token or ""), "Content-Type": "application/json"}
+        body = json.dumps(payload).encode()
+        if self.compress:
+            headers["Accept-Encoding"] = ", ".join(compression.supported_encodings())
+            if len(body) >= compression.COMPRESS_MIN_BYTES:
+                body = compression.compress(body, "gzip")
+                headers["Content-Encoding"] = "gzip"
+        return headers, body
+
+
+class Session:
+    """Client handle of a calculation session."""
+
+    def __init__(self, client: Client, response: SessionResponse):
+        self._client = client
+        self.id = response.session_id
+        self.result = response.result
+
+    def __enter__(self) -> Session:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def evaluate(self, positions: np.ndarray | list, gradient: bool = True) -> GradientResult:
+        """Move the atoms to ``positions`` (Angstrom, in the order of the
+        session's molecule) and return the energy and, unless disabled,
+        the gradient."""
+        step = SessionStepRequest(positions=np.asarray(positions, dtype=float), gradient=gradient)
+        if self._client.local is True:
+            response = self._client._local_sessions.evaluate(self.id, None, step)
+        else:
+            payload = {"positions": step.positions.tolist(), "gradient": gradient}
+            response = SessionResponse.from_dict(self._client._post(f"/sessions/{self.id}/evaluate", payload))
+        self.result = response.result
+        return response.result  # pyright: ignore
+
+    def close(self):
+        if self._client.local is True:
+            self._client._local_sessions.close(self.id, None)
+        else:
+            self._client._delete(f"/sessions/{self.id}")
@@ -0,0 +1,93 @@
+"""Content-Encoding support for request and response bodies.
+
+gzip is always available. zstd is used when the optional ``zstandard``
+package is installed; it compresses JSON about as well as gzip at a
+fraction of the CPU time.
+"""
+
+from __future__ import annotations
+
+import gzip
+import io
+import zlib
+from typing import BinaryIO, Iterable, Iterator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# responses smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def supported_encodings() -> tuple[str, ...]:
+    """The content encodings this installation can produce and read, in
+    order of preference."""
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, wbits=31)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unsupported content encoding '{encoding}'.")
+
+
+def compress_chunks(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Compress a body while it is produced, for uploads too large to hold
+    in memory."""
+    if encoding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, wbits=31)
+    elif encoding == "zstd" and zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    else:
+        raise ValueError(f"Unsupported content encoding '{encoding}'.")
+    for chunk in chunks:
+        if output := compressor.compress(chunk):
+            yield output
+    yield compressor.flush()
+
+
+def decompress(data: bytes, encoding: str, max_size: int) -> bytes:
+    """Decompress ``data``, raising an OverflowError as soon as the output
+    exceeds ``max_size`` bytes so that small compressed bodies cannot
+    expand past the request size limit."""
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            output = decompressor.decompress(data, max_size + 1)
+        except zlib.error as err:
+            raise ValueError("Invalid gzip data.") from err
+        if len(output) > max_size or decompressor.unconsumed_tail:
+            raise OverflowError(f"Decompressed body exceeds {max_size} bytes.")
+        return output
+    if encoding == "zstd" and zstandard is not None:
+        try:
+            chunks, size = [], 0
+            with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+                while size <= max_size and (chunk := reader.read(max_size + 1 - size)):
+                    chunks.append(chunk)
+                    size += len(chunk)
+        except zstandard.ZstdError as err:
+            raise ValueError("Invalid zstd data.") from err
+        output = b"".join(chunks)
+        if len(output) > max_size:
+            raise OverflowError(f"Decompressed body exceeds {max_size} bytes.")
+        return output
+    raise ValueError(f"Unsupported content encoding '{encoding}'.")
+
+
+def decompressing_reader(stream: BinaryIO, encoding: str) -> BinaryIO:
+    """A file object reading ``stream`` decompressed, for bodies that are
+    processed as they arrive rather than as a whole."""
+    if encoding == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")  # pyright: ignore
+    if encoding == "zstd" and zstandard is not None:
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream))  # pyright: ignore
+    raise ValueError(f"Unsupported content encoding '{encoding}'.")
@@ -1,19 +1,82 @@
+import copy
+import io
+import json
 import logging
 from dataclasses import asdict
 from http import HTTPStatus
+from typing import Callable, Iterator, TypeVar
 
-from flask import jsonify, make_response
+from flask import Response, g, jsonify, make_response
 from flask import request as global_request
+from flask import stream_with_context
 from pysll import Constellation
+from redis import Redis
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from cloudcompchem.dft import calculate_energy
+from cloudcompchem import compression, export
+from cloudcompchem.batching import MicroBatcher, is_small
+from cloudcompchem.dft import calculate_energy, calculate_gradients
 from cloudcompchem.exceptions import (
+    ControllerException,
     DFTRequestValidationException,
     MoleculeSpinAndChargeViolationError,
     NotLoggedInException,
+    RequestTooLargeException,
+    ServiceDrainingException,
+    UnsupportedContentEncodingException,
+    UnsupportedOutputFormatException,
 )
-from cloudcompchem.models import DFTOptRequest, EnergyRequest
+from cloudcompchem.fragment import calculate_fragment_energy
+from cloudcompchem.ingest import (
+    calculate_energies,
+    ingest_result,
+    read_structures,
+    run_inline,
+)
+from cloudcompchem.metrics import (
+    AUTH_SECONDS,
+    REQUEST_PARSE_SECONDS,
+    SERIALIZATION_SECONDS,
+    timed,
+)
+from cloudcompchem.models import (
+    DFTOptRequest,
+    EnergyRequest,
+    GradientRequest,
+    IngestRequest,
+    IngestResult,
+    ReactionPathRequest,
+    ReactionPathResponse,
+    SessionStepRequest,
+    SinglePointEnergyResponse,
+    StructureRelaxationResponse,
+    ThermoRequest,
+)
+from cloudcompchem.neb import reaction_path
 from cloudcompchem.opt import run_dft_opt
+from cloudcompchem.profiling import PROFILE_MODES, ProfileMode, profiled
+from cloudcompchem.scaling import (
+    QUEUES,
+    Workload,
+    predict_core_seconds,
+    scaling_signals,
+)
+from cloudcompchem.sessions import SessionStore
+from cloudcompchem.singleflight import SingleFlight, request_key
+from cloudcompchem.thermochemistry import calculate_thermo
+from cloudcompchem.utils import jsonable
+
+# default request body size limit, in bytes (a 10k atom molecule is about 2 MiB of JSON)
+MAX_BODY_BYTES = 16 * 2**20
+
+# read buffer of streamed request bodies (structure file uploads), in bytes
+BODY_BUFFER_BYTES = 2**16
+
+# default time running calculations get to finish on shutdown, in seconds
+SHUTDOWN_TIMEOUT = 10
+
+Req = TypeVar("Req")
+Resp = TypeVar("Resp")
 
 
 class DFTController:
@@ -24,7 +87,22 @@ class DFTController:
     models.
     """
 
-    def __init__(self, logger: logging.Logger, constellation: Constellation):
+    def __init__(
+        self,
+        logger: logging.Logger,
+        constellation: Constellation,
+        profile_dir: str = "profiles",
+        profile_admins: frozenset[str] = frozenset(),
+        profile_mode: ProfileMode | None = None,
+        max_body_bytes: int = MAX_BODY_BYTES,
+        sessions: SessionStore | None = None,
+        batcher: MicroBatcher | None = None,
+        single_flight: SingleFlight | None = None,
+        workload: Workload | None = None,
+        redis: Redis | None = None,
+        queues: tuple[str, ...] = QUEUES,
+        shutdown_timeout: float = SHUTDOWN_TIMEOUT,
+    ):
 
         # The logger that should be used
         self._logger = logger
@@ -32,12 +110,34 @@ class DFTController:
         # The constellation wrapper descibes how the auth service connects to constellation
         self._constellation = constellation
 
-        # Keep track of any in progress training requests
-        self._in_progress_dft_threads = []
+        # Keep track of the calculations in progress, for the scaling signals and draining
+        self._workload = workload if workload is not None else Workload()
+
+        # shutdown timeout - in seconds.  By default give all the running calculations
+        # 10 seconds to finish before killing them on shutdown.
+        self._shutdown_timeout = shutdown_timeout
+
+        # Celery queues (in the broker's Redis) reported in the scaling signals
+        self._redis = redis
+        self._queues = queues
+
+        # Profiling: artifacts are written under `profile_dir`. Admins (by constellation ID) may
+        # request a profile per call with `?profile=<mode>`; `profile_mode` profiles every call.
+        self._profile_dir = profile_dir
+        self._profile_admins = profile_admins
+        self._profile_mode = profile_mode
+
+        # Requests with larger bodies are rejected before authenticating or reading them
+        self._max_body_bytes = max_body_bytes
+
+        # Live calculation sessions of this worker process
+        self._sessions = sessions if sessions is not None else SessionStore()
+
+        # Small energy requests are run in micro-batches when a batcher is configured
+        self._batcher = batcher
 
-        # shutdown timeout - in seconds.  By default give all the worker threads
-        # 10 seconds before killing them on shutdown.
-        self._shutdown_timeout = 10
+        # Identical in-flight energy and optimization requests share one calculation
+        self._single_flight = single_flight
 
     """
     You must implement the two functions below to have a functional simulation
@@ -47,10 +147,43 @@ class DFTController:
         """This is used to test if the service is healthy and running.
 
         Generally there should be no reason to update this function.
+        A draining worker reports itself unavailable so that load
+        balancers stop sending it requests.
         """
 
+        if self._workload.draining:
+            return jsonify({"message": "Draining"}), HTTPStatus.SERVICE_UNAVAILABLE
         return jsonify({"message": "OK"})
 
+    def scaling(self):
+        """Signals for an autoscaler: queue depths, the predicted
+        core-seconds of the running calculations, the age of the oldest
+        job and the utilization of every worker."""
+
+        # the worker serving the signals counts itself, even before its first calculation
+        self._workload.publish()
+        signals = scaling_signals(self._redis, self._queues)
+        signals["draining"] = self._workload.draining
+        return jsonify(signals)
+
+    def publish_workload(self):
+        """Publish the slots of this worker process in the scaling
+        signals."""
+
+        self._workload.publish()
+
+    def shutdown(self):
+        """Stop accepting calculations and give the running ones up to the
+        shutdown timeout to finish."""
+
+        self._logger.info(f"Draining {len(self._workload)} running calculation(s)")
+        if not self._workload.drain(self._shutdown_timeout):
+            self._logger.warning(
+                f"{len(self._workload)} calculation(s) still running after {self._shutdown_timeout} seconds"
+            )
+        if self._batcher is not None:
+            self._batcher.close()
+
     def simulate_energy(self):
         """This is called when a simulation is requested.
 
@@ -59,50 +192,8 @@ class DFTController:
         """
 
         self._logger.info("Received request to simulate a molecule!")
-
-        # Parse the request
-        try:
-            dft_input = self._parse_dft_request(global_request)
-        except MoleculeSpinAndChargeViolationError as err:
-            return (str(err), HTTPStatus.BAD_REQUEST)
-        except DFTRequestValidationException as err:
-            self._logger.error(f"Validation error: {err.message} Returning")
-            return (err.message, err.status_code)
-        except NotLoggedInException as err:
-            self._logger.error("Not logged in! Returning")
-            return (err.message, err.status_code)
-        except Exception as err:
-            self._logger.error(f"Unhandled exception: {err}")
-            return (
-                "Error encountered while unpacking request JSON, please inspect for errors and try again.",
-                HTTPStatus.INTERNAL_SERVER_ERROR,
-            )
-
-        # Download the needed information about each object - this will also make
-        # sure the request is properly formatted and contains information we have
-        # permission to see
-        self._logger.info(f"Received request to run DFT using: {dft_input}.")
-
-        # Trigger the simulation - we can do each one in parallel
-        # NOTE: this is not actually parallel in python since python has a GIL
-        # for this process, but we can handle additional IO requests
-        self._logger.info("Triggering dft simulation request")
-
-        try:
-            energy_dict = calculate_energy(dft_input)
-        except (RuntimeError, KeyError) as err:
-            message = f"Runtime error encountered during DFT calculation due to misconfigured inputs: {err}"
-            self._logger.warning(message)
-            return message, HTTPStatus.BAD_REQUEST
-        except AssertionError:
-            message = "Found a runtime exception likely due to an invalid charge specification."
-            self._logger.warning(message)
-            return message, HTTPStatus.BAD_REQUEST
-        except Exception as err:
-            self._logger.error(f"Unhandled exception of type ({type(err)}): {err}.")
-            return f"Unhandled exception: {err}.", HTTPStatus.INTERNAL_SERVER_ERROR
-
-        return make_response(asdict(energy_dict), HTTPStatus.OK)
+        energy = self._coalesced("energy", self._energy, SinglePointEnergyResponse.from_dict)
+        return self._calculate("energy", EnergyRequest.from_dict, energy)
 
     def geom_opt(self):
         """This is called when a geometry optimization job is requested.
@@ -112,24 +203,206 @@ class DFTController:
         """
 
         self._logger.info("Received request to optimize a molecule!")
+        opt = self._coalesced("opt", run_dft_opt, StructureRelaxationResponse.from_dict)
+        return self._calculate("opt", DFTOptRequest.from_dict, opt)
 
-        # Parse the request
+    def gradient(self):
+        """This is called when energies and nuclear gradients are requested
+        for one or more geometries."""
+
+        self._logger.info("Received request for nuclear gradients!")
+        return self._calculate("gradient", GradientRequest.from_dict, calculate_gradients)
+
+    def thermochemistry(self):
+        """This is called when the thermochemistry of an optimized molecule
+        is requested from its Hessian, over grids of temperatures and
+        pressures."""
+
+        return self._calculate("thermo", ThermoRequest.from_dict, calculate_thermo)
+
+    def reaction_path(self):
+        """This is called when a reaction path (nudged elastic band) is
+        requested.
+
+        The response streams while the band relaxes, as JSON lines: the
+        progress of every iteration, then the result (or an error).
+        """
+
+        self._logger.info("Received request for a reaction path!")
         try:
-            dft_input = self._parse_opt_request(global_request)
-        except MoleculeSpinAndChargeViolationError as err:
-            return (str(err), HTTPStatus.BAD_REQUEST)
-        except DFTRequestValidationException as err:
-            self._logger.error(f"Validation error: {err.message} Returning")
-            return (err.message, err.status_code)
-        except NotLoggedInException as err:
-            self._logger.error("Not logged in! Returning")
+            dft_input = self._parse_request(global_request, "reaction_path", ReactionPathRequest.from_dict)
+        except Exception as err:
+            return self._parse_error(err)
+        if self._workload.draining:
+            return "This worker is shutting down, please retry.", HTTPStatus.SERVICE_UNAVAILABLE, {"Retry-After": "1"}
+
+        # the images of every iteration run in parallel on the batcher's worker processes
+        map_images = map if self._batcher is None else self._batcher.map
+
+        def lines() -> Iterator[str]:
+            try:
+                with self._workload.track("reaction_path", predict_core_seconds(dft_input)):
+                    for item in reaction_path(dft_input, map_images):
+                        key = "result" if isinstance(item, ReactionPathResponse) else "progress"
+                        yield json.dumps({key: item.to_dict()}) + "\n"
+            except ControllerException as err:
+                self._logger.warning(f"{err.message} Returning")
+                yield json.dumps({"error": err.message}) + "\n"
+            except Exception as err:
+                self._logger.error(f"Unhandled exception of type ({type(err)}): {err}.")
+                yield json.dumps({"error": f"Unhandled exception: {err}."}) + "\n"
+
+        return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+    def ingest(self):
+        """This is called when a multi-XYZ or SDF file of structures is
+        uploaded for their energies.
+
+        The body is the file itself, gzip (or zstd) compressed or not, and
+        is parsed while it arrives. The response streams as JSON lines: the
+        outcome of every record in file order, then a summary. With
+        ``output=arrow`` or ``output=parquet`` it streams the same outcomes
+        as columns instead.
+        """
+
+        self._logger.info("Received a structure file to ingest!")
+        try:
+            self._check_body_size(global_request)
+            self._authenticate(global_request, "ingest")
+            dft_input = IngestRequest.from_dict(global_request.args.to_dict())
+            if dft_input.output != "jsonl" and not export.available():
+                raise UnsupportedOutputFormatException(
+                    f"'{dft_input.output}' output needs the optional pyarrow package, which is not installed."
+                )
+            body = self._body_stream(global_request)
+        except Exception as err:
+            return self._parse_error(err)
+        if self._workload.draining:
+            return "This worker is shutting down, please retry.", HTTPStatus.SERVICE_UNAVAILABLE, {"Retry-After": "1"}
+
+        batcher = self._batcher
+
+        def submit(request: EnergyRequest):
+            return batcher.submit(request) if batcher is not None and is_small(request) else run_inline(request)
+
+        columnar = dft_input.output != "jsonl"
+        counts = {"records": 0, "failed": 0}
+
+        def results() -> Iterator[IngestResult]:
+            # the cost is unknown until the whole file is read
+            with self._workload.track("ingest", predict_core_seconds(dft_input)):
+                structures = read_structures(body, dft_input.format, dft_input.charge, dft_input.spin_multiplicity)
+                window = 1 if batcher is None else batcher.max_batch
+                outcomes = calculate_energies(structures, dft_input.config, submit, window, dft_input.fields)
+                for record, result in outcomes:
+                    outcome = ingest_result(record, result, keep_molecule=columnar)
+                    counts["records"] += 1
+                    counts["failed"] += outcome.error is not None
+                    yield outcome
+
+        def lines() -> Iterator[str]:
+            try:
+                for outcome in results():
+                    yield json.dumps(outcome.to_dict(), default=jsonable) + "\n"
+                yield json.dumps({"summary": counts}) + "\n"
+            except RequestEntityTooLarge:
+                self._logger.warning("Structure file exceeds the body size limit. Returning")
+                yield json.dumps({"error": f"Request body exceeds the limit of {self._max_body_bytes} bytes."}) + "\n"
+            except ControllerException as err:
+                self._logger.warning(f"{err.message} Returning")
+                yield json.dumps({"error": err.message}) + "\n"
+            except Exception as err:
+                self._logger.error(f"Unhandled exception of type ({type(err)}): {err}.")
+                yield json.dumps({"error": f"Unhandled exception: {err}."}) + "\n"
+
+        def columns() -> Iterator[bytes]:
+            try:
+                yield from export.stream(results(), dft_input.output, dft_input.config)  # pyright: ignore
+            except Exception as err:
+                # there is no room for an error in the format, so the client finds the file cut short
+                self._logger.error(f"Ingestion failed after {counts['records']} records: {err}. Returning")
+
+        if columnar:
+            return Response(stream_with_context(columns()), mimetype=export.MEDIA_TYPES[dft_input.output])
+        return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+    def create_session(self):
+        """Start a session holding a live SCF for a molecule and evaluate
+        its initial geometry."""
+
+        self._logger.info("Received request to create a session!")
+        return self._calculate(
+            "session_create", GradientRequest.from_dict, lambda req: self._sessions.create(self._user_id(), req)
+        )
+
+    def evaluate_session(self, session_id: str):
+        """Move the atoms of a session and evaluate the energy (and
+        gradient) from the previous density."""
+
+        return self._calculate(
+            "session_evaluate",
+            SessionStepRequest.from_dict,
+            lambda step: self._sessions.evaluate(session_id, self._user_id(), step),
+        )
+
+    def close_session(self, session_id: str):
+        """Close a session and free its SCF."""
+
+        try:
+            self._authenticate(global_request, "session_close")
+            response = self._sessions.close(session_id, self._user_id())
+        except ControllerException as err:
+            self._logger.error(f"{err.message} Returning")
             return (err.message, err.status_code)
+        return make_response(response.to_dict(), HTTPStatus.OK)
+
+    def _coalesced(
+        self, endpoint: str, fn: Callable[[Req], Resp], decode: Callable[[dict], Resp]
+    ) -> Callable[[Req], Resp]:
+        """Wrap ``fn`` so that identical in-flight requests share one
+        calculation. Profiled calls always run their own."""
+
+        def run(dft_input: Req) -> Resp:
+            if self._single_flight is None or g.get("profile_mode") is not None:
+                return fn(dft_input)
+            return self._single_flight.run(request_key(endpoint, dft_input), lambda: fn(dft_input), decode)
+
+        return run
+
+    def _energy(self, dft_input: EnergyRequest):
+        # profiled calls always run here, where the profiler can see them
+        is_profiled = g.get("profile_mode") is not None
+        if dft_input.fragmentation is not None:
+            if is_profiled or self._batcher is None:
+                return calculate_fragment_energy(dft_input)
+            return calculate_fragment_energy(dft_input, self._fragment, workers=self._batcher.max_batch)
+        if self._batcher is not None and is_small(dft_input) and not is_profiled:
+            return self._batcher.submit(dft_input).result()
+        return calculate_energy(dft_input)
+
+    def _fragment(self, dft_input: EnergyRequest) -> SinglePointEnergyResponse:
+        """Calculate a subsystem of a fragmented request on the batcher's
+        workers, sharing it with identical subsystems of concurrent
+        requests."""
+        assert self._batcher is not None
+        batcher = self._batcher
+        if self._single_flight is None:
+            return batcher.submit(dft_input).result()
+        return self._single_flight.run(
+            request_key("energy", dft_input),
+            lambda: batcher.submit(dft_input).result(),
+            SinglePointEnergyResponse.from_dict,
+        )
+
+    def _calculate(self, endpoint: str, parse: Callable[[dict], Req], fn: Callable[[Req], Resp]):
+        """Parse the request, run the calculation and serialize its
+        result."""
+
+        # Parse the request
+        try:
+            dft_input = self._parse_request(global_request, endpoint, parse)
         except Exception as err:
-            self._logger.error(f"Unhandled exception: {err}")
-            return (
-                "Error encountered while unpacking request JSON, please inspect for errors and try again.",
-                HTTPStatus.INTERNAL_SERVER_ERROR,
-            )
+            return self._parse_error(err)
 
         # Download the needed information about each object - this will also make
         # sure the request is properly formatted and contains information we have
@@ -142,7 +415,14 @@ class DFTController:
         self._logger.info("Triggering dft simulation request")
 
         try:
-            structure_dict = run_dft_opt(dft_input)
+            with self._workload.track(endpoint, predict_core_seconds(dft_input)):
+                result, profile_id = self._run_calculation(fn, dft_input)
+        except ServiceDrainingException as err:
+            self._logger.warning(f"{err.message} Returning")
+            return err.message, err.status_code, {"Retry-After": "1"}
+        except ControllerException as err:
+            self._logger.warning(f"{err.message} Returning")
+            return (err.message, err.status_code)
         except (RuntimeError, KeyError) as err:
             message = f"Runtime error encountered during DFT calculation due to misconfigured inputs: {err}"
             self._logger.warning(message)
@@ -155,64 +435,162 @@ class DFTController:
             self._logger.error(f"Unhandled exception of type ({type(err)}): {err}.")
             return f"Unhandled exception: {err}.", HTTPStatus.INTERNAL_SERVER_ERROR
 
-        return make_response(asdict(structure_dict), HTTPStatus.OK)
+        with timed(SERIALIZATION_SECONDS, endpoint=endpoint):
+            response = make_response(result.to_dict(), HTTPStatus.OK)  # pyright: ignore
+        if profile_id is not None:
+            response.headers["X-Profile-Id"] = profile_id
+        return response
 
-    def _parse_dft_request(self, request) -> EnergyRequest:
-        """Parse the simulation request into the auth token, the protocols to
+    def _parse_error(self, err: Exception):
+        """The response to a request that could not be parsed."""
+        if isinstance(err, MoleculeSpinAndChargeViolationError):
+            return (str(err), HTTPStatus.BAD_REQUEST)
+        if isinstance(err, DFTRequestValidationException):
+            self._logger.error(f"Validation error: {err.message} Returning")
+            return (err.message, err.status_code)
+        if isinstance(err, NotLoggedInException):
+            self._logger.error("Not logged in! Returning")
+            return (err.message, err.status_code)
+        if isinstance(err, ControllerException):
+            self._logger.error(f"{err.message} Returning")
+            return (err.message, err.status_code)
+        self._logger.error(f"Unhandled exception: {err}")
+        return (
+            "Error encountered while unpacking request JSON, please inspect for errors and try again.",
+            HTTPStatus.INTERNAL_SERVER_ERROR,
+        )
+
+    def _run_calculation(self, fn: Callable[[Req], Resp], dft_input: Req) -> tuple[Resp, str | None]:
+        """Run the calculation, under the profiler if one was requested.
+
+        Unprofiled calls go straight to `fn`.
+        """
+        mode = g.get("profile_mode")
+        if mode is None:
+            return fn(dft_input), None
+
+        with profiled(mode, self._profile_dir) as profile:
+            result = fn(dft_input)
+        profile.attach_result(asdict(result))  # pyright: ignore
+        self._logger.info(f"Stored {mode} profile {profile.id} in {profile.directory}")
+        return result, profile.id
+
+    def _requested_profile_mode(self, request) -> ProfileMode | None:
+        mode = request.args.get("profile")
+        if mode is None:
+            return self._profile_mode
+        if mode not in PROFILE_MODES:
+            raise DFTRequestValidationException(f"Profile mode must be one of {', '.join(PROFILE_MODES)}.")
+
+        if self._user_id() not in self._profile_admins:
+            self._logger.warning("Ignoring profile request from a non-admin user.")
+            return self._profile_mode
+        return mode
+
+    def _parse_request(self, request, endpoint: str, parse: Callable[[dict], Req]) -> Req:
+        """Parse the request into the auth token, the protocols to
         simulation, and the model to use.
 
         Generally there should be no reason to update this function.
         """
         # TODO: move this to a require_login decorator. this function should take request.json, not request.
-        token = self._retrieve_auth_token_from_request(request)
-        self._logger.info("Got token from request! Attempting to validate token...")
-        self._constellation._auth_token = token
-        try:
-            _ = self._constellation.me()
-        except Exception:
-            raise NotLoggedInException("No authentication from login was provided!") from None
-        self._logger.info("Token validated!")
+        self._check_body_size(request)
+        self._authenticate(request, endpoint)
+        g.profile_mode = self._requested_profile_mode(request)
 
         # unpack the request into a struct
-        req_info = request.json
-        self._logger.info("Attempting to unmarshal the request payload to internal struct...")
-        self._logger.debug(f"req info = {req_info}")
-        if req_info is None:
-            raise DFTRequestValidationException("No JSON body found, please include one to run a calculation.")
+        with timed(REQUEST_PARSE_SECONDS, endpoint=endpoint):
+            req_info = self._read_json_body(request)
+            self._logger.info("Attempting to unmarshal the request payload to internal struct...")
+            # lazy formatting: large payloads are only rendered when debug logging is on
+            self._logger.debug("req info = %s", req_info)
+            if req_info is None:
+                raise DFTRequestValidationException("No JSON body found, please include one to run a calculation.")
 
-        dft_input = EnergyRequest.from_dict(req_info)
+            dft_input = parse(req_info)
 
         self._logger.info("Request constructed!")
 
         return dft_input
 
-    def _parse_opt_request(self, request) -> DFTOptRequest:
-        """Parse the geometry optimization request into the auth token, the
-        protocols to simulation, and the model to use.
-
-        Generally there should be no reason to update this function.
-        """
+    def _authenticate(self, request, endpoint: str):
         token = self._retrieve_auth_token_from_request(request)
         self._logger.info("Got token from request! Attempting to validate token...")
-        self._constellation._auth_token = token
+        # the client holds the token, so every request gets its own: requests run on several threads
+        constellation = copy.copy(self._constellation)
+        constellation._auth_token = token
         try:
-            _ = self._constellation.me()
+            with timed(AUTH_SECONDS, endpoint=endpoint):
+                g.user = constellation.me()
         except Exception:
             raise NotLoggedInException("No authentication from login was provided!") from None
         self._logger.info("Token validated!")
 
-        # unpack the request into a struct
-        req_info = request.json
-        self._logger.info("Attempting to unmarshal the request payload to internal struct...")
-        self._logger.debug(f"req info = {req_info}")
-        if req_info is None:
-            raise DFTRequestValidationException("No JSON body found, please include one to run a calculation.")
-
-        dft_input = DFTOptRequest.from_dict(req_info)
-
-        self._logger.info("Request constructed!")
+    def _user_id(self) -> str | None:
+        """The constellation ID of the authenticated user."""
+        user = g.get("user") or {}
+        user_id = user.get("ID", user.get("Id"))
+        return None if user_id is None else str(user_id)
+
+    def _check_body_size(self, request, size: int | None = None):
+        size = request.content_length if size is None else size
+        if size is not None and size > self._max_body_bytes:
+            raise RequestTooLargeException(f"Request body exceeds the limit of {self._max_body_bytes} bytes.")
+
+    def _read_json_body(self, request) -> dict | None:
+        """Read and decode the JSON body.
+
+        The body is read into memory once, bypassing Flask's cache of
+        the raw bytes. gzip (and, with ``zstandard`` installed, zstd)
+        compressed bodies are accepted and decompressed into a second
+        buffer before decoding; the size limit applies to both the
+        compressed and the decompressed body. Returns None for requests
+        without a JSON body.
+        """
+        if not request.is_json:
+            return None
+        try:
+            body = request.get_data(cache=False)
+        except RequestEntityTooLarge:
+            # bodies sent without a content length are only cut off while reading
+            body = None
+        self._check_body_size(request, self._max_body_bytes + 1 if body is None else len(body))
+
+        encoding = (request.content_encoding or "identity").lower()
+        if encoding != "identity":
+            if encoding not in compression.supported_encodings():
+                raise UnsupportedContentEncodingException(
+                    f"Content encoding '{encoding}' is not supported, use one of "
+                    f"{', '.join(compression.supported_encodings())}."
+                )
+            try:
+                body = compression.decompress(body, encoding, self._max_body_bytes)  # pyright: ignore
+            except OverflowError:
+                self._check_body_size(request, self._max_body_bytes + 1)
+            except ValueError as err:
+                raise DFTRequestValidationException(str(err)) from None
 
-        return dft_input
+        try:
+            return json.loads(body)  # pyright: ignore
+        except ValueError:
+            raise DFTRequestValidationException("The request body is not valid JSON.") from None
+
+    def _body_stream(self, request):
+        """The raw request body as a file object, decompressed while it is
+        read."""
+        stream = request.stream
+        if isinstance(stream, io.RawIOBase):
+            # werkzeug's stream reads lines byte by byte
+            stream = io.BufferedReader(stream, BODY_BUFFER_BYTES)
+        encoding = (request.content_encoding or "identity").lower()
+        if encoding == "identity":
+            return stream
+        if encoding not in compression.supported_encodings():
+            raise UnsupportedContentEncodingException(
+                f"Content encoding '{encoding}' is not supported, use one of "
+                f"{', '.join(compression.supported_encodings())}."
+            )
+        return compression.decompressing_reader(stream, encoding)
 
     def _retrieve_auth_token_from_request(self, request):
         auth_header = request.headers.get("Authorization")
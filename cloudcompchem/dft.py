@@ -5,8 +5,28 @@ import logging
 import numpy as np
 from pyscf.dft import RKS, UKS
 
-from cloudcompchem.models import EnergyRequest, Orbital, SinglePointEnergyResponse
-from cloudcompchem.utils import M
+from cloudcompchem.ecp import assign
+from cloudcompchem.guess import prepare_guess, record_guess
+from cloudcompchem.metrics import (
+    GRADIENT_STEP_SECONDS,
+    MOL_BUILD_SECONDS,
+    SCF_CYCLES,
+    SCF_SECONDS,
+    SCFCycleCounter,
+    config_labels,
+    timed,
+)
+from cloudcompchem.models import (
+    EnergyRequest,
+    GradientRequest,
+    GradientResponse,
+    GradientResult,
+    Orbital,
+    SinglePointEnergyResponse,
+)
+from cloudcompchem.properties import compute_properties
+from cloudcompchem.rescue import rescue_scf
+from cloudcompchem.utils import M, frontier_orbitals, point_group
 
 logger = logging.getLogger("cloudcompchem.dft")
 
@@ -14,38 +34,120 @@ logger = logging.getLogger("cloudcompchem.dft")
 def calculate_energy(dft_input: EnergyRequest) -> SinglePointEnergyResponse:
     """Method to run a dft calculation on the initial request payload."""
     logger.info("Starting dft calculation!")
+    labels = config_labels(dft_input.config, dft_input.molecule)
 
     # Hopefully your model is more sophisticated!
     # build the input structure with gto
     # spin in pyscf is 2S not 2S+1
     s = dft_input.molecule.spin_multiplicity - 1
-    mole = M(
-        atom=str(dft_input.molecule),
-        basis=dft_input.config.basis_set,
-        charge=dft_input.molecule.charge,
-        spin=s,
-    )
+    with timed(MOL_BUILD_SECONDS, **labels):
+        mole = M(
+            atom=dft_input.molecule.to_pyscf(),
+            basis=dft_input.config.basis_set,
+            charge=dft_input.molecule.charge,
+            spin=s,
+            symmetry=dft_input.config.symmetry,
+            symmetry_tolerance=dft_input.config.symmetry_tolerance,
+            ecp=dft_input.config.ecp,
+        )
 
     # run the dft calculation for the given functional
     fn = UKS if dft_input.molecule.spin_multiplicity > 1 else RKS
     calc = fn(mole)
     calc.xc = dft_input.config.functional
-    _ = calc.kernel()
+    calc.callback = cycles = SCFCycleCounter()
+    guess = prepare_guess(calc, dft_input.config, dft_input.molecule)
+    with timed(SCF_SECONDS, **labels, converged="false") as scf_labels:
+        # projected guesses come as orbitals
+        _ = calc.kernel(dm0=None if calc.mo_coeff is None else calc.make_rdm1())
+        # the guess is judged on the first SCF only
+        record_guess(guess, cycles.cycles, bool(calc.converged))
+        rescue_path = None
+        if not calc.converged and dft_input.config.scf_rescue:
+            logger.warning("SCF did not converge, trying to rescue it")
+            calc, rescue_path = rescue_scf(calc)
+        scf_labels["converged"] = str(bool(calc.converged)).lower()
+    SCF_CYCLES.labels(**labels).observe(cycles.cycles)
 
-    logger.info("Finished dft calculation!")
+    logger.info(f"Finished dft calculation in {cycles.cycles} SCF cycles!")
 
-    assert isinstance(calc.mo_energy, np.ndarray)
-    assert isinstance(calc.mo_occ, np.ndarray)
+    assert calc.mo_energy is not None and calc.mo_occ is not None
+    # unrestricted calculations hold the energies of each spin (a tuple when symmetry adapted)
+    mo_energy, mo_occ = np.asarray(calc.mo_energy), np.asarray(calc.mo_occ)
 
-    return SinglePointEnergyResponse(
+    response = SinglePointEnergyResponse(
         energy=calc.e_tot,
         converged=calc.converged,
-        orbitals=[
-            Orbital(energy=energy, occupancy=occ)
-            for energy, occ in zip(
-                calc.mo_energy,
-                calc.mo_occ,
-                strict=True,
-            )
-        ],
+        point_group=point_group(mole),
+        init_guess=guess.strategy,
+        scf_cycles=cycles.cycles,
+        rescue_path=rescue_path,
+        ecp=assign(dft_input.config.basis_set, mole.elements, dft_input.config.ecp) or None,
     )
+    if "orbitals" in dft_input.fields:
+        response.orbitals = orbital_list(mo_energy, mo_occ)
+    if "homo_lumo" in dft_input.fields:
+        response.homo, response.lumo = frontier_orbitals(mo_energy, mo_occ)
+    # properties come from the converged density, without another SCF
+    for name, value in compute_properties(calc, dft_input.properties).items():
+        setattr(response, name, value)
+    return response
+
+
+def orbital_list(mo_energy: np.ndarray, mo_occ: np.ndarray) -> list[Orbital]:
+    """The orbitals of a calculation; for an unrestricted one, the alpha
+    orbitals followed by the beta orbitals."""
+    return [
+        Orbital(energy=float(energy), occupancy=float(occ))
+        for energy, occ in zip(np.ravel(mo_energy), np.ravel(mo_occ), strict=True)
+    ]
+
+
+def calculate_gradients(dft_input: GradientRequest) -> GradientResponse:
+    """Energies and nuclear gradients for a sequence of geometries.
+
+    The geometries are evaluated in order by one gradient scanner, so
+    every SCF after the first starts from the density of the previous
+    geometry. Symmetry is never applied here: symmetrizing would move the
+    atoms away from the geometries that were asked for.
+    """
+    logger.info(f"Starting gradient calculation for {len(dft_input.molecules)} geometries!")
+    first = dft_input.molecules[0]
+    labels = config_labels(dft_input.config, first)
+
+    with timed(MOL_BUILD_SECONDS, **labels):
+        mole = M(
+            atom=first.to_pyscf(),
+            basis=dft_input.config.basis_set,
+            charge=first.charge,
+            # spin in pyscf is 2S not 2S+1
+            spin=first.spin_multiplicity - 1,
+            ecp=dft_input.config.ecp,
+        )
+
+    fn = UKS if first.spin_multiplicity > 1 else RKS
+    calc = fn(mole)
+    calc.xc = dft_input.config.functional
+    calc.callback = cycles = SCFCycleCounter()
+    guess = prepare_guess(calc, dft_input.config, first)
+    scanner = calc.nuc_grad_method().as_scanner()
+
+    results = []
+    for molecule in dft_input.molecules:
+        cycles_before = cycles.cycles
+        with timed(GRADIENT_STEP_SECONDS, **labels):
+            energy, gradient = scanner(molecule.to_pyscf())
+        SCF_CYCLES.labels(**labels).observe(cycles.cycles - cycles_before)
+        results.append(
+            GradientResult(
+                energy=float(energy),
+                converged=bool(scanner.converged),
+                gradient=gradient.tolist(),
+                scf_cycles=cycles.cycles - cycles_before,
+            )
+        )
+        if len(results) == 1:
+            record_guess(guess, results[0].scf_cycles, results[0].converged)
+
+    logger.info(f"Finished gradient calculation in {cycles.cycles} SCF cycles!")
+    return GradientResponse(results=results)
@@ -0,0 +1,87 @@
+"""Effective core potentials (ECPs) for the elements past krypton.
+
+All-electron calculations on 4d/5d metals, lanthanides and actinides are
+slow: most of their basis functions describe core electrons that take no
+part in chemistry, and few all-electron basis sets cover them at all
+(cc-pVDZ stops at krypton). The def2 valence basis sets of these elements
+are made to be used with an ECP, without one pyscf treats them
+all-electron in a basis set that cannot describe the core.
+
+With ``"ecp": "auto"`` in the config, every element from rubidium on gets
+an ECP in place of its core electrons and the valence basis set made for
+that ECP:
+
+- the def2 basis set of the requested quality with the def2 ECP (the
+  requested basis itself when it is a def2 basis set, def2-SVP for double
+  zeta, def2-TZVP for triple zeta and def2-QZVP for quadruple zeta basis
+  sets), or
+- CRENBL with its ECP for the elements the def2 basis sets do not cover,
+  the lanthanides Ce-Lu and everything from francium on.
+
+Lighter elements keep the requested basis set, all-electron. The
+responses record what each heavy element got.
+"""
+
+from __future__ import annotations
+
+import functools
+from dataclasses import dataclass
+from typing import Iterable, Literal, get_args
+
+from pyscf import gto
+
+EcpMode = Literal["none", "auto"]
+ECP_MODES: tuple[EcpMode, ...] = get_args(EcpMode)
+
+# rubidium, the first element the def2 basis sets use an ECP for
+FIRST_ECP_ELEMENT = 37
+
+# for the elements without a def2 ECP
+FALLBACK_BASIS = "crenbl"
+
+
+@dataclass(frozen=True)
+class EcpAssignment:
+    basis_set: str
+    # named after the basis set it comes with, as pyscf loads it
+    ecp: str
+    # electrons the ECP replaces
+    core_electrons: int
+
+
+def valence_basis(basis_set: str) -> str:
+    """The def2 basis set matching ``basis_set`` in quality."""
+    # imported here since cloudcompchem.utils builds molecules with the ECPs of this module
+    from cloudcompchem.utils import basis_name
+
+    key = basis_name(basis_set)
+    if key.startswith("def2"):
+        return basis_set
+    if "qz" in key:
+        return "def2-qzvp"
+    if "tz" in key or key.startswith("6311"):
+        return "def2-tzvp"
+    return "def2-svp"
+
+
+@functools.lru_cache(maxsize=1024)
+def _assign(valence: str, symbol: str) -> EcpAssignment | None:
+    if gto.charge(symbol) < FIRST_ECP_ELEMENT:
+        return None
+    for basis_set in (valence, FALLBACK_BASIS):
+        try:
+            ecp = gto.basis.load_ecp(basis_set, symbol)
+            if ecp and gto.basis.load(basis_set, symbol):
+                return EcpAssignment(basis_set=basis_set, ecp=basis_set, core_electrons=ecp[0])
+        except (KeyError, ValueError, RuntimeError, OSError):
+            continue
+    return None
+
+
+def assign(basis_set: str, symbols: Iterable[str], mode: EcpMode = "auto") -> dict[str, EcpAssignment]:
+    """The ECP and valence basis set of each element among ``symbols``
+    that gets one in ``mode`` (none with ``"none"``)."""
+    if mode == "none":
+        return {}
+    valence = valence_basis(basis_set)
+    return {symbol: assignment for symbol in sorted(set(symbols)) if (assignment := _assign(valence, symbol))}
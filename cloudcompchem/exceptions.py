@@ -49,3 +49,42 @@ class DFTRequestValidationException(ControllerException):
 
     def __init__(self, message: str):
         super().__init__(message, HTTPStatus.BAD_REQUEST)
+
+
+class RequestTooLargeException(ControllerException):
+    """Thrown when the request body exceeds the configured size limit."""
+
+    def __init__(self, message: str):
+        super().__init__(message, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+
+class UnsupportedContentEncodingException(ControllerException):
+    """Thrown when the request body uses a content encoding the server
+    cannot decode."""
+
+    def __init__(self, message: str):
+        super().__init__(message, HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
+
+
+class UnsupportedOutputFormatException(ControllerException):
+    """Thrown when a response format is requested whose optional
+    dependency is not installed."""
+
+    def __init__(self, message: str):
+        super().__init__(message, HTTPStatus.NOT_ACCEPTABLE)
+
+
+class SessionNotFoundException(ControllerException):
+    """Thrown when a session does not exist (any more) in this worker or
+    belongs to someone else."""
+
+    def __init__(self, message: str):
+        super().__init__(message, HTTPStatus.NOT_FOUND)
+
+
+class ServiceDrainingException(ControllerException):
+    """Thrown when a calculation is requested from a worker that is
+    shutting down."""
+
+    def __init__(self, message: str):
+        super().__init__(message, HTTPStatus.SERVICE_UNAVAILABLE)
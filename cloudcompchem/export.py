@@ -0,0 +1,266 @@
+"""Columnar export of results, as Apache Arrow IPC streams or Parquet files.
+
+Analytics tools (pandas, Spark, DuckDB) load columnar files orders of
+magnitude faster than one JSON document per job. Every result becomes a
+row: the scalars of the response (energy, convergence, point group, ...)
+and of its molecule (formula, charge, spin multiplicity) are columns, and
+the orbital energies and coordinates are list columns. Rows are written in
+record batches (Parquet row groups) of ``batch_size`` rows, so memory
+stays bounded however many results there are.
+
+pyarrow is an optional dependency (the ``arrow`` extra); ``available``
+tells whether it is installed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+from collections import Counter
+from typing import IO, Iterable, Iterator, Literal, get_args
+
+from cloudcompchem.models import (
+    FunctionalConfig,
+    IngestResult,
+    Molecule,
+    SinglePointEnergyResponse,
+    StructureRelaxationResponse,
+)
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger("cloudcompchem.export")
+
+ColumnarFormat = Literal["arrow", "parquet"]
+COLUMNAR_FORMATS: tuple[ColumnarFormat, ...] = get_args(ColumnarFormat)
+
+MEDIA_TYPES: dict[ColumnarFormat, str] = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+EXTENSIONS: dict[str, ColumnarFormat] = {".arrow": "arrow", ".arrows": "arrow", ".parquet": "parquet", ".pq": "parquet"}
+
+# rows per record batch (Parquet row group)
+DEFAULT_BATCH_SIZE = 4096
+
+Result = SinglePointEnergyResponse | StructureRelaxationResponse
+
+
+def available() -> bool:
+    return pyarrow is not None
+
+
+def schema() -> pyarrow.Schema:
+    """The columns of exported results; all but ``index`` and ``title``
+    are null where they do not apply."""
+    assert pyarrow is not None
+    string = pyarrow.string()
+    return pyarrow.schema(
+        [
+            ("index", pyarrow.int64()),
+            ("title", string),
+            ("functional", pyarrow.dictionary(pyarrow.int32(), string)),
+            ("basis_set", pyarrow.dictionary(pyarrow.int32(), string)),
+            ("formula", string),
+            ("charge", pyarrow.int32()),
+            ("spin_multiplicity", pyarrow.int32()),
+            ("symbols", pyarrow.list_(string)),
+            # Angstrom
+            ("coordinates", pyarrow.list_(pyarrow.list_(pyarrow.float64(), 3))),
+            # Hartree
+            ("energy", pyarrow.float64()),
+            ("converged", pyarrow.bool_()),
+            ("point_group", string),
+            ("homo", pyarrow.float64()),
+            ("lumo", pyarrow.float64()),
+            ("orbital_energies", pyarrow.list_(pyarrow.float64())),
+            ("orbital_occupancies", pyarrow.list_(pyarrow.float64())),
+            ("init_guess", string),
+            ("scf_cycles", pyarrow.int32()),
+            ("error", string),
+        ]
+    )
+
+
+def hill_formula(molecule: Molecule) -> str:
+    """The molecular formula in Hill order: carbon, hydrogen, then the other
+    elements alphabetically (all alphabetically without carbon)."""
+    counts = Counter(atom.symbol for atom in molecule.atoms)
+    first = ["C", "H"] if "C" in counts else []
+    order = first + sorted(symbol for symbol in counts if symbol not in first)
+    return "".join(symbol + (str(counts[symbol]) if counts[symbol] > 1 else "") for symbol in order)
+
+
+def row(result: IngestResult, config: FunctionalConfig | None = None) -> dict:
+    """The columns of one result. A relaxation's molecule is its optimized
+    geometry."""
+    response: Result | None = result.result
+    molecule = result.molecule
+    if isinstance(response, StructureRelaxationResponse):
+        molecule = response.molecule
+        if not isinstance(molecule, Molecule):
+            # as read back from JSON
+            molecule = Molecule.from_dict(molecule)
+    orbitals = None if response is None else response.orbitals
+    return {
+        "index": result.index,
+        "title": result.title,
+        "functional": None if config is None else config.functional,
+        "basis_set": None if config is None else config.basis_set,
+        "formula": None if molecule is None else hill_formula(molecule),
+        "charge": None if molecule is None else molecule.charge,
+        "spin_multiplicity": None if molecule is None else molecule.spin_multiplicity,
+        "symbols": None if molecule is None else [atom.symbol for atom in molecule.atoms],
+        "coordinates": None if molecule is None else molecule.positions.tolist(),
+        "energy": None if response is None else response.energy,
+        "converged": None if response is None else bool(response.converged),
+        "point_group": None if response is None else response.point_group,
+        "homo": None if response is None else response.homo,
+        "lumo": None if response is None else response.lumo,
+        "orbital_energies": None if orbitals is None else [orbital.energy for orbital in orbitals],
+        "orbital_occupancies": None if orbitals is None else [orbital.occupancy for orbital in orbitals],
+        "init_guess": getattr(response, "init_guess", None),
+        "scf_cycles": getattr(response, "scf_cycles", None),
+        "error": result.error,
+    }
+
+
+def record_batches(
+    results: Iterable[IngestResult], config: FunctionalConfig | None = None, batch_size: int = DEFAULT_BATCH_SIZE
+) -> Iterator[pyarrow.RecordBatch]:
+    """The results as record batches of up to ``batch_size`` rows."""
+    assert pyarrow is not None
+    table_schema = schema()
+    rows: list[dict] = []
+    for result in results:
+        rows.append(row(result, config))
+        if len(rows) == batch_size:
+            yield pyarrow.RecordBatch.from_pylist(rows, table_schema)
+            rows = []
+    if rows:
+        yield pyarrow.RecordBatch.from_pylist(rows, table_schema)
+
+
+class _ChunkSink:
+    """A write-only file collecting what the writers write, so that it can
+    be sent on while the export goes on."""
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def write(
+    batches: Iterable[pyarrow.RecordBatch], sink: str | os.PathLike | IO[bytes], format: ColumnarFormat
+) -> Iterator[None]:
+    """Write record batches to ``sink``, yielding after each one."""
+    assert pyarrow is not None
+    table_schema = schema()
+    if format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(sink, table_schema, compression="zstd")
+    else:
+        writer = pyarrow.ipc.new_stream(sink, table_schema)
+    with writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield
+
+
+def stream(
+    results: Iterable[IngestResult],
+    format: ColumnarFormat,
+    config: FunctionalConfig | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[bytes]:
+    """The bytes of an Arrow stream or Parquet file of the results, as each
+    batch is written, for streamed responses."""
+    assert pyarrow is not None
+    sink = _ChunkSink()
+    for _ in write(record_batches(results, config, batch_size), pyarrow.PythonFile(sink, mode="w"), format):
+        if chunk := sink.take():
+            yield chunk
+    # the writer closes with the stream's end marker or the Parquet footer
+    if chunk := sink.take():
+        yield chunk
+
+
+def read_results(lines: Iterable[str]) -> Iterator[IngestResult]:
+    """Results from JSON lines of ``cloudcompchem ingest`` or of `/energy`
+    and `/opt` responses, one per line."""
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        d = json.loads(line)
+        if "summary" in d:
+            continue
+        if "index" in d:
+            yield IngestResult.from_dict(d)
+        elif "molecule" in d:
+            yield IngestResult(index, "", result=StructureRelaxationResponse.from_dict(d))  # pyright: ignore
+        else:
+            yield IngestResult(index, "", result=SinglePointEnergyResponse.from_dict(d))
+
+
+def detect_format(filename: str) -> ColumnarFormat:
+    """The columnar format of a file, from its extension."""
+    extension = os.path.splitext(filename)[1].lower()
+    try:
+        return EXTENSIONS[extension]
+    except KeyError:
+        raise ValueError(f"Unknown columnar file extension '{extension}', use one of {', '.join(EXTENSIONS)}.")
+
+
+def export(args: argparse.Namespace):
+    """Convert JSON lines of results to an Arrow stream or Parquet file."""
+    if not available():
+        raise SystemExit("Columnar export needs pyarrow, install cloudcompchem[arrow].")
+    format = args.format or detect_format(args.output)
+    config = None if args.functional is None else FunctionalConfig(functional=args.functional, basis_set=args.basis)
+    rows = 0
+
+    def counted(results: Iterable[IngestResult]) -> Iterator[IngestResult]:
+        nonlocal rows
+        for result in results:
+            rows += 1
+            yield result
+
+    with open(args.filename) as handle:
+        for _ in write(record_batches(counted(read_results(handle)), config, args.batch_size), args.output, format):
+            pass
+    logger.info(f"Exported {rows} results to {args.output}")
+
+
+def setup_parser(parser: argparse.ArgumentParser):
+    parser.add_argument("filename", help="JSON lines of `ingest` results or of /energy or /opt responses")
+    parser.add_argument("--output", required=True, help="the .parquet or .arrow file to write")
+    parser.add_argument("--format", choices=COLUMNAR_FORMATS, default=None, help="default: from the output extension")
+    parser.add_argument("--functional", default=None, help="the functional the results were calculated with")
+    parser.add_argument("--basis", default=None, help="the basis set the results were calculated with")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="rows per row group")
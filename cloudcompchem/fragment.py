@@ -0,0 +1,283 @@
+"""Energies of large molecules by a many-body expansion over fragments.
+
+The molecule is split into fragments: every molecule of a cluster is a
+fragment of its own, and molecules larger than ``max_fragment_atoms``
+are cut at carbon-carbon single bonds into pieces of about that size,
+each cut bond being capped with a hydrogen atom on both sides. The
+energy is then expanded in fragments, pairs and (at order 3) triples of
+fragments closer than the cutoff:
+
+    E = sum_i E_i + sum_ij (E_ij - E_i - E_j) + ...
+
+which is a linear combination of the energies of the subsystems, and so
+is the gradient. The subsystems are independent calculations; they run
+in parallel, and subsystems identical up to a translation (e.g. the
+molecules of a regular cluster) are calculated once.
+"""
+
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from itertools import combinations
+from typing import Callable
+
+import numpy as np
+from pyscf.data.radii import BOHR, COVALENT
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.models import (
+    EnergyRequest,
+    FragmentationResult,
+    Molecule,
+    SinglePointEnergyResponse,
+)
+from cloudcompchem.singleflight import request_key
+
+logger = logging.getLogger("cloudcompchem.fragment")
+
+# atoms closer than this multiple of the sum of their covalent radii are bonded
+BOND_TOLERANCE = 1.2
+# only carbon-carbon bonds longer than this (single bonds, in Angstrom) are cut
+MIN_CUT_BOND_LENGTH = 1.45
+# positions are rounded to this many decimals (Angstrom) when looking for identical subsystems
+KEY_DECIMALS = 6
+
+
+@dataclass
+class Cap:
+    """A hydrogen replacing the atom ``cut`` bonded to ``kept``, placed on
+    the bond at ``ratio`` of its length from ``kept``."""
+
+    kept: int
+    cut: int
+    ratio: float
+
+
+@dataclass
+class Subsystem:
+    """A fragment, pair or triple of fragments and its coefficient in the
+    expansion."""
+
+    fragments: tuple[int, ...]
+    coefficient: int
+    # indices of the atoms in the molecule, followed by the caps
+    atoms: list[int]
+    caps: list[Cap]
+    request: EnergyRequest
+
+
+def _radii(molecule: Molecule) -> np.ndarray:
+    """Covalent radii of the atoms, in Angstrom."""
+    return COVALENT[molecule.numbers] * BOHR
+
+
+def bonds(molecule: Molecule) -> np.ndarray:
+    """The (n_bonds, 2) array of bonded atom pairs, judged by distance."""
+    positions, radii = molecule.positions, _radii(molecule)
+    if len(positions) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = cKDTree(positions).query_pairs(BOND_TOLERANCE * 2 * radii.max(), output_type="ndarray")
+    lengths = np.linalg.norm(positions[pairs[:, 0]] - positions[pairs[:, 1]], axis=1)
+    return pairs[lengths < BOND_TOLERANCE * (radii[pairs[:, 0]] + radii[pairs[:, 1]])]
+
+
+def _components(n_atoms: int, edges: np.ndarray) -> np.ndarray:
+    graph = coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n_atoms, n_atoms))
+    return connected_components(graph, directed=False)[1]
+
+
+def find_fragments(molecule: Molecule, max_atoms: int) -> list[list[int]]:
+    """Split the molecule into fragments, as lists of atom indices.
+
+    Every connected molecule up to ``max_atoms`` atoms is a fragment.
+    Larger ones are split into units that cannot be cut (everything but
+    C-C single bonds holds together), which are then gathered breadth
+    first into fragments of up to ``max_atoms`` atoms.
+    """
+    n_atoms = len(molecule.atoms)
+    edges = bonds(molecule)
+    lengths = np.linalg.norm(molecule.positions[edges[:, 0]] - molecule.positions[edges[:, 1]], axis=1)
+    carbon = molecule.numbers == 6
+    cuttable = carbon[edges[:, 0]] & carbon[edges[:, 1]] & (lengths > MIN_CUT_BOND_LENGTH)
+
+    molecules, units = _components(n_atoms, edges), _components(n_atoms, edges[~cuttable])
+    unit_atoms: dict[int, list[int]] = {}
+    for atom, unit in enumerate(units):
+        unit_atoms.setdefault(unit, []).append(atom)
+    neighbours: dict[int, set[int]] = {unit: set() for unit in unit_atoms}
+    for a, b in edges[cuttable]:
+        neighbours[units[a]].add(units[b])
+        neighbours[units[b]].add(units[a])
+
+    molecule_sizes = np.bincount(molecules)
+    fragments: list[list[int]] = []
+    assigned: set[int] = set()
+    # units are visited in the order of their first atom, so fragments follow the input order
+    for start in unit_atoms:
+        if start in assigned:
+            continue
+        limit = max_atoms if molecule_sizes[molecules[unit_atoms[start][0]]] > max_atoms else n_atoms
+        fragment, queue, size = [], [start], len(unit_atoms[start])
+        assigned.add(start)
+        while queue:
+            unit = queue.pop(0)
+            fragment.extend(unit_atoms[unit])
+            for neighbour in sorted(neighbours[unit] - assigned):
+                if size + len(unit_atoms[neighbour]) <= limit:
+                    assigned.add(neighbour)
+                    queue.append(neighbour)
+                    size += len(unit_atoms[neighbour])
+        fragments.append(sorted(fragment))
+    return fragments
+
+
+def expansion(molecule: Molecule, fragments: list[list[int]], order: int, cutoff: float) -> dict[tuple[int, ...], int]:
+    """The subsystems of the many-body expansion and their coefficients.
+
+    Pairs are included when their fragments have atoms closer than
+    ``cutoff``, triples when all three of their pairs are. A subsystem S
+    enters with the coefficient sum over the included U containing S of
+    (-1)^(|U| - |S|); subsystems with a zero coefficient are left out.
+    """
+    close: set[tuple[int, int]] = set()
+    if order > 1 and len(fragments) > 1:
+        owner = np.empty(len(molecule.atoms), dtype=np.int64)
+        for i, atoms in enumerate(fragments):
+            owner[atoms] = i
+        pairs = cKDTree(molecule.positions).query_pairs(cutoff, output_type="ndarray")
+        i, j = owner[pairs[:, 0]], owner[pairs[:, 1]]
+        close = {(min(a, b), max(a, b)) for a, b in zip(i.tolist(), j.tolist()) if a != b}
+
+    included: list[tuple[int, ...]] = [(i,) for i in range(len(fragments))] + sorted(close)
+    if order > 2:
+        partners: dict[int, set[int]] = {}
+        for a, b in close:
+            partners.setdefault(a, set()).add(b)
+        included += [(a, b, c) for a, b in sorted(close) for c in sorted(partners.get(b, set())) if (a, c) in close]
+
+    coefficients = dict.fromkeys(included, 0)
+    for superset in included:
+        for size in range(1, len(superset) + 1):
+            for subset in combinations(superset, size):
+                coefficients[subset] += (-1) ** (len(superset) - size)
+    return {subsystem: c for subsystem, c in coefficients.items() if c}
+
+
+def _cap(molecule: Molecule, atoms: list[int], edges: np.ndarray) -> list[Cap]:
+    """Hydrogen caps for the bonds between ``atoms`` and the rest of the
+    molecule."""
+    inside = np.zeros(len(molecule.atoms), dtype=bool)
+    inside[atoms] = True
+    radii, hydrogen = _radii(molecule), COVALENT[1] * BOHR
+    caps = []
+    for a, b in edges[inside[edges[:, 0]] != inside[edges[:, 1]]].tolist():
+        kept, cut = (a, b) if inside[a] else (b, a)
+        caps.append(Cap(kept, cut, (radii[kept] + hydrogen) / (radii[kept] + radii[cut])))
+    return caps
+
+
+def plan(request: EnergyRequest) -> tuple[list[list[int]], list[Subsystem]]:
+    """The fragments and subsystems of a fragmented request, with the
+    energy request of each subsystem.
+
+    Subsystems are calculated without symmetry, which would move their
+    atoms, and translated to start at the origin so that identical ones
+    have identical requests.
+    """
+    config = request.fragmentation
+    assert config is not None
+    molecule = request.molecule
+    fragments = find_fragments(molecule, config.max_fragment_atoms)
+    edges = bonds(molecule)
+
+    subsystems = []
+    for members, coefficient in expansion(molecule, fragments, config.order, config.cutoff).items():
+        atoms = sorted(atom for i in members for atom in fragments[i])
+        caps = _cap(molecule, atoms, edges)
+        positions = molecule.positions
+        cap_positions = [positions[c.kept] + c.ratio * (positions[c.cut] - positions[c.kept]) for c in caps]
+        coordinates = np.concatenate([positions[atoms], np.reshape(cap_positions, (-1, 3))])
+        coordinates = np.round(coordinates - coordinates[0], KEY_DECIMALS) + 0.0
+
+        symbols = [molecule.atoms[i].symbol for i in atoms] + ["H"] * len(caps)
+        electrons = int(molecule.numbers[atoms].sum()) + len(caps)
+        fragment = Molecule.from_dict(
+            {
+                "atoms": [{"symbol": s, "position": p} for s, p in zip(symbols, coordinates.tolist())],
+                "charge": 0,
+                "spin_multiplicity": 1 + electrons % 2,
+            }
+        )
+        subsystems.append(
+            Subsystem(
+                fragments=members,
+                coefficient=coefficient,
+                atoms=atoms,
+                caps=caps,
+                request=EnergyRequest(
+                    config=replace(request.config, symmetry=False),
+                    molecule=fragment,
+                    fields=("energy",),
+                    properties=request.properties,
+                ),
+            )
+        )
+    return fragments, subsystems
+
+
+def calculate_fragment_energy(
+    request: EnergyRequest,
+    run: Callable[[EnergyRequest], SinglePointEnergyResponse] = calculate_energy,
+    workers: int = 1,
+) -> SinglePointEnergyResponse:
+    """Energy (and gradient) of a request by its many-body expansion.
+
+    ``run`` calculates a subsystem; with ``workers`` > 1 that many
+    subsystems are handed to it at once, from threads.
+    """
+    fragments, subsystems = plan(request)
+
+    unique: dict[str, EnergyRequest] = {}
+    keys = []
+    for subsystem in subsystems:
+        key = request_key("energy", subsystem.request)
+        unique.setdefault(key, subsystem.request)
+        keys.append(key)
+    logger.info(
+        f"Expanding the energy over {len(fragments)} fragments in {len(subsystems)} subsystems, "
+        f"{len(unique)} of them distinct"
+    )
+
+    if workers > 1 and len(unique) > 1:
+        with ThreadPoolExecutor(min(workers, len(unique)), thread_name_prefix="cloudcompchem-fragment") as pool:
+            results = dict(zip(unique, pool.map(run, unique.values())))
+    else:
+        results = {key: run(subsystem_request) for key, subsystem_request in unique.items()}
+
+    energy = 0.0
+    gradient = np.zeros((len(request.molecule.atoms), 3)) if "gradient" in request.properties else None
+    for subsystem, key in zip(subsystems, keys):
+        result = results[key]
+        energy += subsystem.coefficient * result.energy
+        if gradient is not None:
+            rows = subsystem.coefficient * np.asarray(result.gradient)
+            gradient[subsystem.atoms] += rows[: len(subsystem.atoms)]
+            # a cap moves with both atoms of the bond it replaces
+            for cap, row in zip(subsystem.caps, rows[len(subsystem.atoms) :]):
+                gradient[cap.kept] += (1 - cap.ratio) * row
+                gradient[cap.cut] += cap.ratio * row
+
+    return SinglePointEnergyResponse(
+        energy=energy,
+        converged=all(result.converged for result in results.values()),
+        scf_cycles=sum(result.scf_cycles or 0 for result in results.values()),
+        gradient=None if gradient is None else gradient.tolist(),
+        fragmentation=FragmentationResult(
+            fragments=len(fragments), subsystems=len(subsystems), calculations=len(unique)
+        ),
+    )
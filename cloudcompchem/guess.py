@@ -0,0 +1,144 @@
+"""Initial guesses for the SCF.
+
+A request picks the strategy with ``config.init_guess``: one of pyscf's
+``minao`` (the default), ``atom`` (superposition of atomic densities) and
+``huckel``, ``project`` to start from the orbitals of a converged
+minimal-basis calculation, or ``auto``.
+
+``auto`` learns from past runs. Molecules are grouped by element set,
+spin multiplicity and size, and every group tries each strategy a few
+times before settling on the one that has needed the fewest SCF cycles.
+The statistics are kept per process.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+from pyscf.scf.addons import project_mo_nr2nr
+from pyscf.scf.hf import SCF
+
+from cloudcompchem.metrics import INIT_GUESS_CYCLES, SCFCycleCounter, size_bucket
+from cloudcompchem.models import INIT_GUESSES, FunctionalConfig, InitGuess, Molecule
+
+logger = logging.getLogger("cloudcompchem.guess")
+
+# the strategies ``auto`` chooses from, the first one being its choice for groups it has not seen
+STRATEGIES: tuple[InitGuess, ...] = tuple(guess for guess in INIT_GUESSES if guess != "auto")
+MINIMAL_BASIS = "sto-3g"
+# runs of every strategy for a group before ``auto`` only picks the best one
+MIN_RUNS = 3
+# an SCF cycle in the minimal basis costs a fraction of one in the target basis
+MINIMAL_BASIS_CYCLE_COST = 0.25
+# cost of a run that did not converge, on top of its cycles
+UNCONVERGED_PENALTY = 50
+
+
+@dataclass
+class GuessChoice:
+    strategy: InitGuess
+    group: str
+    # cycles spent on the guess itself (the minimal-basis SCF of ``project``)
+    guess_cycles: int = 0
+
+
+class GuessStatistics:
+    """SCF cycles needed with each strategy, per group of molecules."""
+
+    def __init__(self, min_runs: int = MIN_RUNS):
+        self.min_runs = min_runs
+        # group -> strategy -> [runs, total cost]
+        self._runs: dict[str, dict[str, list[float]]] = defaultdict(lambda: defaultdict(lambda: [0, 0.0]))
+        self._lock = threading.Lock()
+
+    def choose(self, group: str) -> InitGuess:
+        """The least tried strategy until all have ``min_runs`` runs, then
+        the one with the lowest mean cost."""
+        with self._lock:
+            runs = self._runs[group]
+            untried = [s for s in STRATEGIES if runs[s][0] < self.min_runs]
+            if untried:
+                return min(untried, key=lambda s: runs[s][0])
+            return min(STRATEGIES, key=lambda s: runs[s][1] / runs[s][0])
+
+    def record(self, choice: GuessChoice, cycles: int, converged: bool):
+        cost = cycles + MINIMAL_BASIS_CYCLE_COST * choice.guess_cycles + (0 if converged else UNCONVERGED_PENALTY)
+        with self._lock:
+            runs = self._runs[choice.group][choice.strategy]
+            runs[0] += 1
+            runs[1] += cost
+
+    def summary(self) -> dict[str, dict[str, dict[str, float]]]:
+        """Runs and mean cost of every strategy tried, per group."""
+        with self._lock:
+            return {
+                group: {s: {"runs": n, "mean_cost": total / n} for s, (n, total) in runs.items() if n}
+                for group, runs in self._runs.items()
+            }
+
+
+STATISTICS = GuessStatistics()
+
+
+def molecule_group(molecule: Molecule) -> str:
+    """The group a molecule is compared with for ``auto``: its elements,
+    spin multiplicity and size."""
+    elements = ",".join(sorted({atom.symbol for atom in molecule.atoms}))
+    return f"{elements}|{molecule.spin_multiplicity}|{size_bucket(len(molecule.atoms))}"
+
+
+def prepare_guess(calc: SCF, config: FunctionalConfig, molecule: Molecule) -> GuessChoice:
+    """Set up the initial guess of ``calc``.
+
+    pyscf's own strategies are set as ``calc.init_guess``; ``project``
+    sets projected orbitals as ``calc.mo_coeff``, which the gradient
+    scanners start from and ``calc.make_rdm1()`` turns into a density
+    for ``calc.kernel``.
+    """
+    group = molecule_group(molecule)
+    strategy = STATISTICS.choose(group) if config.init_guess == "auto" else config.init_guess
+    choice = GuessChoice(strategy, group)
+
+    if strategy == "project":
+        try:
+            choice.guess_cycles = _project_minimal_basis(calc)
+            return choice
+        except (RuntimeError, KeyError) as err:
+            # e.g. elements the minimal basis does not cover
+            logger.warning(f"Unable to start from a {MINIMAL_BASIS} calculation, using minao: {err}")
+            # the failure counts against ``project`` as a run that did not converge, or ``auto``
+            # would keep trying it for this group
+            STATISTICS.record(GuessChoice("project", group), 0, converged=False)
+            choice.strategy = strategy = "minao"
+
+    calc.init_guess = strategy
+    return choice
+
+
+def record_guess(choice: GuessChoice, cycles: int, converged: bool):
+    """Learn from the first SCF started from ``choice``."""
+    INIT_GUESS_CYCLES.labels(init_guess=choice.strategy).observe(cycles)
+    STATISTICS.record(choice, cycles, converged)
+
+
+def _project_minimal_basis(calc: SCF) -> int:
+    """Converge ``calc`` in the minimal basis and project the orbitals onto
+    its basis. Returns the cycles of the minimal-basis SCF."""
+    small_mol = calc.mol.copy()
+    small_mol.basis = MINIMAL_BASIS
+    small_mol.build(dump_input=False, parse_arg=False)
+
+    small = calc.__class__(small_mol)
+    small.xc = calc.xc
+    small.conv_tol = 1e-6
+    small.callback = cycles = SCFCycleCounter()
+    small.kernel()
+
+    # unrestricted orbitals come back as one array per spin
+    calc.mo_coeff = np.asarray(project_mo_nr2nr(small_mol, small.mo_coeff, calc.mol))
+    calc.mo_occ = small.mo_occ
+    return cycles.cycles
@@ -0,0 +1,377 @@
+"""Streaming readers for multi-structure XYZ and SDF files.
+
+Files with millions of structures are parsed one record at a time from an
+iterable of byte lines, a memory-mapped file (``mapped_lines``) or the
+body of an upload, so the whole file is never held in memory. Every
+record is validated like a molecule sent as JSON: known elements, finite
+coordinates and the charge and spin parity rules of ``Molecule``. A bad
+record becomes a ``Record`` holding the error, and reading goes on with
+the next record wherever the format allows it.
+
+``calculate_energies`` feeds the records to a calculation pipeline (the
+micro-batcher's worker processes, or inline), keeping a bounded number
+of calculations in flight and the results in file order.
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, replace
+from typing import IO, Callable, ContextManager, Iterable, Iterator
+
+import numpy as np
+
+from cloudcompchem import export
+from cloudcompchem.batching import MicroBatcher
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.ecp import ECP_MODES
+from cloudcompchem.exceptions import (
+    ControllerException,
+    DFTRequestValidationException,
+    MoleculeSpinAndChargeViolationError,
+)
+from cloudcompchem.models import (
+    ATOMIC_NUMBERS,
+    DEFAULT_ENERGY_FIELDS,
+    ENERGY_FIELDS,
+    STRUCTURE_FORMATS,
+    EnergyRequest,
+    FunctionalConfig,
+    IngestResult,
+    Molecule,
+    ResponseField,
+    SinglePointEnergyResponse,
+    StructureFormat,
+    check_supported,
+)
+from cloudcompchem.utils import jsonable
+
+logger = logging.getLogger("cloudcompchem.ingest")
+
+EXTENSIONS: dict[str, StructureFormat] = {".xyz": "xyz", ".sdf": "sdf", ".sd": "sdf", ".mol": "sdf"}
+
+SYMBOLS = list(ATOMIC_NUMBERS)
+
+# key=value pairs on the comment line of an (extended) XYZ record
+XYZ_PROPERTY = re.compile(r"(\w+)=(\S+)")
+XYZ_MULTIPLICITY_KEYS = ("multiplicity", "spin_multiplicity", "mult")
+
+# unpaired electrons of the molfile radical values (singlet, doublet, triplet)
+SDF_UNPAIRED = {0: 0, 1: 0, 2: 1, 3: 2}
+
+# errors of a single record, which do not stop the reader
+RECORD_ERRORS = (ValueError, IndexError, ControllerException, MoleculeSpinAndChargeViolationError)
+
+
+@dataclass
+class Record:
+    # position in the file, from 0
+    index: int
+    # the comment line of an XYZ record or the name line of a molfile
+    title: str
+    molecule: Molecule | None = None
+    error: str | None = None
+
+
+@contextmanager
+def mapped_lines(path: str | os.PathLike) -> Iterator[Iterator[bytes]]:
+    """The lines of a file, read through a memory map so that the operating
+    system pages the file in and out instead of the process reading it."""
+    with open(path, "rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            # empty files cannot be mapped
+            yield iter(())
+            return
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield iter(mapped.readline, b"")
+
+
+def detect_format(filename: str) -> StructureFormat:
+    """The structure format of a file, from its extension."""
+    extension = os.path.splitext(filename)[1].lower()
+    try:
+        return EXTENSIONS[extension]
+    except KeyError:
+        raise ValueError(f"Unknown structure file extension '{extension}', use one of {', '.join(EXTENSIONS)}.")
+
+
+def read_structures(
+    lines: Iterable[bytes], format: StructureFormat, charge: int = 0, spin_multiplicity: int = 1
+) -> Iterator[Record]:
+    """Records of a structure file; ``charge`` and ``spin_multiplicity``
+    are the defaults of XYZ records."""
+    if format == "xyz":
+        return read_xyz(lines, charge, spin_multiplicity)
+    return read_sdf(lines)
+
+
+def read_xyz(lines: Iterable[bytes], charge: int = 0, spin_multiplicity: int = 1) -> Iterator[Record]:
+    """Records of a (multi-)XYZ file.
+
+    Each record is the number of atoms, a comment line and one ``symbol x
+    y z`` line (Angstrom) per atom; further columns are ignored. The
+    comment line may set ``charge=`` and ``multiplicity=`` as in extended
+    XYZ, otherwise ``charge`` and ``spin_multiplicity`` apply. A record
+    with a bad atom line is skipped, but reading stops at a bad atom
+    count since the following records cannot be found any more.
+    """
+    lines = iter(lines)
+    for index in itertools.count():
+        header = next(lines, None)
+        while header is not None and not header.strip():
+            header = next(lines, None)
+        if header is None:
+            return
+        try:
+            n_atoms = int(header)
+        except ValueError:
+            yield Record(index, "", error=f"Expected the number of atoms, found {header.strip()[:40]!r}.")
+            return
+        title = next(lines, b"").decode(errors="replace").strip()
+        atom_lines = list(itertools.islice(lines, n_atoms))
+        if len(atom_lines) < n_atoms:
+            yield Record(index, title, error=f"The file ends after {len(atom_lines)} of {n_atoms} atoms.")
+            return
+
+        try:
+            properties = dict(XYZ_PROPERTY.findall(title))
+            record_charge = int(properties.get("charge", charge))
+            multiplicity = next((properties[key] for key in XYZ_MULTIPLICITY_KEYS if key in properties), None)
+            rows = [line.split() for line in atom_lines]
+            molecule = Molecule.from_positions(
+                [_symbol(row[0]) for row in rows],
+                [[float(x) for x in row[1:4]] for row in rows],
+                charge=record_charge,
+                spin_multiplicity=spin_multiplicity if multiplicity is None else int(multiplicity),
+            )
+        except RECORD_ERRORS as err:
+            yield Record(index, title, error=_message(err))
+            continue
+        yield Record(index, title, molecule)
+
+
+def read_sdf(lines: Iterable[bytes]) -> Iterator[Record]:
+    """Records of an SD file of V2000 molfiles, separated by ``$$$$``.
+
+    The charge and spin multiplicity come from the atom block or, when
+    present, the ``M  CHG`` and ``M  RAD`` properties. Hydrogens must be
+    explicit (as in 3D structures). A bad record is skipped up to the
+    next ``$$$$``.
+    """
+    lines = iter(lines)
+    for index in itertools.count():
+        block = list(itertools.takewhile(lambda line: not line.startswith(b"$$$$"), lines))
+        if not any(line.strip() for line in block):
+            # nothing but blank lines after the last record
+            return
+        title = block[0].decode(errors="replace").strip()
+        try:
+            molecule = _molfile(block)
+        except RECORD_ERRORS as err:
+            yield Record(index, title, error=_message(err))
+            continue
+        yield Record(index, title, molecule)
+
+
+def _molfile(block: list[bytes]) -> Molecule:
+    if len(block) < 4:
+        raise ValueError("The molfile header is incomplete.")
+    counts = block[3]
+    if b"V3000" in counts:
+        raise ValueError("V3000 molfiles are not supported.")
+    n_atoms, n_bonds = int(counts[0:3]), int(counts[3:6])
+    atom_block = block[4 : 4 + n_atoms]
+    if len(atom_block) < n_atoms:
+        raise ValueError(f"The atom block ends after {len(atom_block)} of {n_atoms} atoms.")
+
+    rows = [line.split() for line in atom_block]
+    charges = np.zeros(n_atoms, dtype=int)
+    unpaired = np.zeros(n_atoms, dtype=int)
+    for i, row in enumerate(rows):
+        # 1 to 7 are +3 to -3, except for 4, a doublet radical
+        code = int(row[5]) if len(row) > 5 else 0
+        if code == 4:
+            unpaired[i] = 1
+        elif code:
+            charges[i] = 4 - code
+
+    properties_seen = False
+    for line in block[4 + n_atoms + n_bonds :]:
+        if line.startswith(b"M  END"):
+            break
+        if line.startswith((b"M  CHG", b"M  RAD")):
+            if not properties_seen:
+                # the properties block supersedes all charges and radicals of the atom block
+                charges[:], unpaired[:] = 0, 0
+                properties_seen = True
+            values = line[6:].split()
+            for atom, value in zip(values[1::2], values[2::2]):
+                if line.startswith(b"M  CHG"):
+                    charges[int(atom) - 1] = int(value)
+                elif int(value) in SDF_UNPAIRED:
+                    unpaired[int(atom) - 1] = SDF_UNPAIRED[int(value)]
+                else:
+                    raise ValueError(
+                        f"Unknown radical value {int(value)}, use one of {', '.join(map(str, SDF_UNPAIRED))}."
+                    )
+
+    return Molecule.from_positions(
+        [_symbol(row[3]) for row in rows],
+        [[float(x) for x in row[:3]] for row in rows],
+        charge=int(charges.sum()),
+        spin_multiplicity=1 + int(unpaired.sum()),
+    )
+
+
+def _symbol(token: bytes) -> str:
+    """An element symbol in the capitalization of ``AtomSymbol``, also
+    from an atomic number."""
+    symbol = token.decode(errors="replace")
+    if symbol.isdigit():
+        number = int(symbol)
+        if not 0 < number <= len(SYMBOLS):
+            raise ValueError(f"Unknown atomic number {number}.")
+        return SYMBOLS[number - 1]
+    return symbol.capitalize()
+
+
+def _message(err: Exception) -> str:
+    return err.message if isinstance(err, ControllerException) else str(err)
+
+
+def run_inline(request: EnergyRequest) -> Future:
+    """Calculate right away, for pipelines without worker processes."""
+    future: Future = Future()
+    try:
+        future.set_result(calculate_energy(request))
+    except Exception as err:
+        future.set_exception(err)
+    return future
+
+
+def calculate_energies(
+    records: Iterable[Record],
+    config: FunctionalConfig,
+    submit: Callable[[EnergyRequest], Future] = run_inline,
+    window: int = 1,
+    fields: tuple[ResponseField, ...] = DEFAULT_ENERGY_FIELDS,
+) -> Iterator[tuple[Record, SinglePointEnergyResponse | Exception | None]]:
+    """The energy of every valid record (None for invalid ones), in file
+    order.
+
+    Up to ``window`` records are submitted ahead of the one waited for,
+    so that parallel workers stay busy while the records held in memory
+    stay bounded.
+    """
+    pending: deque[tuple[Record, Future | None]] = deque()
+    for record in records:
+        future = None
+        if record.molecule is not None:
+            try:
+                check_supported(config, [record.molecule])
+            except DFTRequestValidationException as err:
+                record = replace(record, molecule=None, error=err.message)
+        if record.molecule is not None:
+            future = submit(EnergyRequest(config=config, molecule=record.molecule, fields=fields))
+        pending.append((record, future))
+        if len(pending) >= window:
+            yield _outcome(*pending.popleft())
+    while pending:
+        yield _outcome(*pending.popleft())
+
+
+def _outcome(record: Record, future: Future | None) -> tuple[Record, SinglePointEnergyResponse | Exception | None]:
+    if future is None:
+        return record, None
+    error = future.exception()
+    return record, future.result() if error is None else error
+
+
+def ingest_result(
+    record: Record, result: SinglePointEnergyResponse | Exception | None = None, keep_molecule: bool = False
+) -> IngestResult:
+    """The outcome of a record: its molecule when no calculation was run,
+    else its result (along with the molecule if ``keep_molecule``), or the
+    error of either."""
+    if record.error is not None:
+        return IngestResult(record.index, record.title, error=record.error)
+    if isinstance(result, Exception):
+        return IngestResult(record.index, record.title, error=_message(result))
+    if result is not None:
+        molecule = record.molecule if keep_molecule else None
+        return IngestResult(record.index, record.title, result=result, molecule=molecule)
+    return IngestResult(record.index, record.title, molecule=record.molecule)
+
+
+def ingest(args: argparse.Namespace):
+    """Read a structure file and write one JSON line per record: its
+    energy or, with ``--validate-only``, its molecule as the service
+    takes it. An ``--output`` ending in .parquet or .arrow is written as
+    columns instead (see cloudcompchem.export). The file is memory-mapped
+    and the records are calculated on ``--workers`` processes, in batches
+    as the service does."""
+    structure_format = args.format or detect_format(args.filename)
+    columnar = None if args.output is None else export.EXTENSIONS.get(os.path.splitext(args.output)[1].lower())
+    if columnar is not None and not export.available():
+        raise SystemExit("Columnar output needs pyarrow, install cloudcompchem[arrow].")
+    config = FunctionalConfig(functional=args.functional, basis_set=args.basis, ecp=args.ecp)
+    batcher = None if args.validate_only or args.workers < 2 else MicroBatcher(workers=args.workers)
+    counts = {"records": 0, "failed": 0}
+
+    def counted(results: Iterable[IngestResult]) -> Iterator[IngestResult]:
+        for result in results:
+            counts["records"] += 1
+            counts["failed"] += result.error is not None
+            yield result
+
+    try:
+        with mapped_lines(args.filename) as lines:
+            structures = read_structures(lines, structure_format, args.charge, args.multiplicity)
+            if args.validate_only:
+                outcomes: Iterable = ((record, None) for record in structures)
+            elif batcher is None:
+                outcomes = calculate_energies(structures, config, fields=tuple(args.fields))
+            else:
+                outcomes = calculate_energies(structures, config, batcher.submit, batcher.max_batch, tuple(args.fields))
+            results = counted(ingest_result(record, result, columnar is not None) for record, result in outcomes)
+            if columnar is not None:
+                for _ in export.write(export.record_batches(results, config), args.output, columnar):
+                    pass
+            else:
+                with _output(args.output) as output:
+                    for result in results:
+                        output.write(json.dumps(result.to_dict(), default=jsonable) + "\n")
+    finally:
+        if batcher is not None:
+            batcher.close()
+    logger.info(f"Ingested {counts['records']} records of {args.filename}, {counts['failed']} failed")
+
+
+def _output(path: str | None) -> ContextManager[IO[str]]:
+    return nullcontext(sys.stdout) if path is None else open(path, "w")
+
+
+def setup_parser(parser: argparse.ArgumentParser):
+    parser.add_argument("filename", help="a multi-XYZ or SD file")
+    parser.add_argument("--format", choices=STRUCTURE_FORMATS, default=None, help="default: from the file extension")
+    parser.add_argument("--functional", default="pbe,pbe")
+    parser.add_argument("--basis", default="sto-3g")
+    parser.add_argument("--ecp", choices=ECP_MODES, default="none", help="effective core potentials for heavy elements")
+    parser.add_argument("--charge", type=int, default=0, help="of XYZ records that do not set their own")
+    parser.add_argument("--multiplicity", type=int, default=1, help="of XYZ records that do not set their own")
+    parser.add_argument("--fields", nargs="+", choices=sorted(ENERGY_FIELDS), default=list(DEFAULT_ENERGY_FIELDS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="calculation processes")
+    parser.add_argument(
+        "--output", default=None, help="JSON lines, .parquet or .arrow file to write, default: standard output"
+    )
+    parser.add_argument("--validate-only", action="store_true", help="only parse and validate the records")
@@ -0,0 +1,236 @@
+"""A small load generator for the web service.
+
+It starts the service under gunicorn with a stubbed Constellation (every
+token is accepted) and an in-memory Celery broker standing in for Redis,
+drives ``/energy`` with a configurable mix of request sizes and
+concurrency, and reports throughput, latency percentiles and error rates.
+Passing several worker/thread/concurrency values sweeps over all their
+combinations.
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import requests
+from pysll import Constellation
+
+logger = logging.getLogger("cloudcompchem.loadtest")
+
+# one water molecule, in Angstrom
+WATER = (
+    ("O", (0.0, 0.0, 0.1173)),
+    ("H", (0.0, 0.7572, -0.4692)),
+    ("H", (0.0, -0.7572, -0.4692)),
+)
+
+# request size name -> number of water molecules
+REQUEST_SIZES = {"small": 1, "medium": 2, "large": 4}
+
+
+class StubConstellation(Constellation):
+    """Constellation stand-in that accepts any token without a network
+    round-trip."""
+
+    def __init__(self):
+        super().__init__(auth_token="")
+
+    def me(self):
+        return {"ID": "id:loadtest"}
+
+
+@dataclass
+class LoadTestResult:
+    workers: int | None
+    threads: int | None
+    concurrency: int
+    requests: int
+    errors: int
+    duration: float
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+
+def water_cluster(n: int, spacing: float = 3.0) -> dict:
+    """A molecule payload with ``n`` water molecules on a cubic grid."""
+    side = int(np.ceil(n ** (1 / 3)))
+    offsets = itertools.islice(itertools.product(range(side), repeat=3), n)
+    atoms = [
+        {"symbol": symbol, "position": [x + spacing * i, y + spacing * j, z + spacing * k]}
+        for i, j, k in offsets
+        for symbol, (x, y, z) in WATER
+    ]
+    return {"atoms": atoms, "charge": 0, "spin_multiplicity": 1}
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parse a request mix such as ``small=3,large=1`` into weights."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in REQUEST_SIZES:
+            raise ValueError(f"Unknown request size '{name}', expected one of {', '.join(REQUEST_SIZES)}.")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def run_load(
+    url: str, payloads: dict[str, dict], mix: dict[str, float], concurrency: int, duration: float
+) -> tuple[list[float], int, float]:
+    """Hammer ``url``/energy from ``concurrency`` threads for ``duration``
+    seconds.
+
+    Returns the latencies of all requests, the number of failed ones and
+    the wall time until the last request finished.
+    """
+    names, weights = list(mix), list(mix.values())
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def worker(seed: int):
+        nonlocal errors
+        rng = random.Random(seed)
+        session = requests.Session()
+        headers = {"Authorization": "Bearer loadtest"}
+        while time.perf_counter() < deadline:
+            payload = payloads[rng.choices(names, weights)[0]]
+            sent = time.perf_counter()
+            try:
+                ok = session.post(url + "/energy", json=payload, headers=headers).status_code // 100 == 2
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - sent
+            with lock:
+                latencies.append(elapsed)
+                errors += not ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, seed) for seed in range(concurrency)]:
+            future.result()
+
+    return latencies, errors, time.perf_counter() - start
+
+
+def summarize(
+    latencies: list[float], errors: int, duration: float, concurrency: int, workers: int | None, threads: int | None
+) -> LoadTestResult:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (float("nan"),) * 3
+    return LoadTestResult(
+        workers=workers,
+        threads=threads,
+        concurrency=concurrency,
+        requests=len(latencies),
+        errors=errors,
+        duration=duration,
+        throughput=len(latencies) / duration,
+        p50=float(p50),
+        p95=float(p95),
+        p99=float(p99),
+    )
+
+
+def _serve_stub(bind: str, workers: int, threads: int):
+    # in-memory broker and result backend stand in for redis
+    os.environ["FLASK_CELERY__broker_url"] = "memory://"
+    os.environ["FLASK_CELERY__result_backend"] = "cache+memory://"
+
+    from cloudcompchem.server import FlaskApp, create_app
+
+    FlaskApp(
+        create_app(constellation=StubConstellation(), web_workers=workers),
+        {"bind": bind, "workers": workers, "threads": threads, "loglevel": "WARNING", "timeout": 300},
+    ).run()
+
+
+def _wait_until_healthy(url: str, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url + "/health-check", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Service at {url} did not become healthy within {timeout} seconds.")
+
+
+def loadtest(args: argparse.Namespace):
+    mix = parse_mix(args.mix)
+    payloads = {
+        name: {"config": {"functional": args.functional, "basis_set": args.basis}, "molecule": water_cluster(n)}
+        for name, n in REQUEST_SIZES.items()
+    }
+
+    results = []
+    if args.url:
+        for concurrency in args.concurrency:
+            latencies, errors, elapsed = run_load(args.url, payloads, mix, concurrency, args.duration)
+            results.append(summarize(latencies, errors, elapsed, concurrency, None, None))
+    else:
+        url = f"http://{args.bind}"
+        context = multiprocessing.get_context("spawn")
+        for workers, threads in itertools.product(args.workers, args.threads):
+            server = context.Process(target=_serve_stub, args=(args.bind, workers, threads), daemon=True)
+            server.start()
+            try:
+                _wait_until_healthy(url)
+                # warm up every worker before measuring
+                run_load(url, payloads, mix, workers * threads, min(args.duration, 2))
+                for concurrency in args.concurrency:
+                    logger.info(f"workers={workers} threads={threads} concurrency={concurrency}")
+                    latencies, errors, elapsed = run_load(url, payloads, mix, concurrency, args.duration)
+                    results.append(summarize(latencies, errors, elapsed, concurrency, workers, threads))
+            finally:
+                server.terminate()
+                server.join()
+
+    print(format_results(results))
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump([asdict(r) | {"error_rate": r.error_rate} for r in results], handle, indent=2)
+
+
+def format_results(results: list[LoadTestResult]) -> str:
+    header = f"{'workers':>7} {'threads':>7} {'conc':>5} {'reqs':>6} {'err%':>6} {'req/s':>8} "
+    header += f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    rows = [header]
+    for r in results:
+        rows.append(
+            f"{r.workers or '-':>7} {r.threads or '-':>7} {r.concurrency:>5} {r.requests:>6} "
+            f"{100 * r.error_rate:>6.1f} {r.throughput:>8.2f} "
+            f"{1e3 * r.p50:>8.1f} {1e3 * r.p95:>8.1f} {1e3 * r.p99:>8.1f}"
+        )
+    return "\n".join(rows)
+
+
+def setup_parser(parser: argparse.ArgumentParser):
+    parser.add_argument("--workers", type=int, nargs="+", default=[4], help="gunicorn worker counts to sweep")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1], help="gunicorn thread counts to sweep")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4], help="concurrent clients to sweep")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run each configuration")
+    parser.add_argument("--mix", default="small=3,medium=1", help="weighted request sizes, e.g. small=3,large=1")
+    parser.add_argument("--basis", default="sto-3g")
+    parser.add_argument("--functional", default="pbe,pbe")
+    parser.add_argument("--bind", default="127.0.0.1:5055", help="where to start the stubbed service")
+    parser.add_argument("--url", default=None, help="drive an already running service instead")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
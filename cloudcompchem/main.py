@@ -2,9 +2,11 @@ import argparse
 import json
 import logging
 import os
+from dataclasses import asdict
 from typing import Callable, TypeAlias
 
-from cloudcompchem import dft
+from cloudcompchem import dft, export, ingest, loadtest
+from cloudcompchem.profiling import PROFILE_MODES, profiled
 from cloudcompchem.server import serve
 
 
@@ -18,7 +20,13 @@ def energy(args: argparse.Namespace):
         data = json.load(handle)
 
     request = dft.EnergyRequest.from_dict(data)
-    output = dft.calculate_energy(request)
+    if args.profile is None:
+        output = dft.calculate_energy(request)
+    else:
+        with profiled(args.profile, args.profile_dir) as profile:
+            output = dft.calculate_energy(request)
+        profile.attach_result(asdict(output))
+        logging.info(f"Profile written to {profile.directory}")
 
     print(output)
 
@@ -33,14 +41,21 @@ def main() -> int:
         "serve": (
             lambda parser: (
                 parser.add_argument("--bind", default="0.0.0.0:5000"),
-                parser.add_argument("--workers", default=4),
+                parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 4))),
             ),
             serve,
         ),
         "energy": (
-            lambda parser: (parser.add_argument("filename"),),
+            lambda parser: (
+                parser.add_argument("filename"),
+                parser.add_argument("--profile", choices=PROFILE_MODES, default=None),
+                parser.add_argument("--profile-dir", default="profiles"),
+            ),
             energy,
         ),
+        "loadtest": (loadtest.setup_parser, loadtest.loadtest),
+        "ingest": (ingest.setup_parser, ingest.ingest),
+        "export": (export.setup_parser, export.export),
     }
 
     parser = argparse.ArgumentParser()
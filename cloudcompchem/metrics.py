@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from celery.signals import before_task_publish, task_prerun
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.registry import REGISTRY
+
+from cloudcompchem.models import FunctionalConfig, Molecule
+
+logger = logging.getLogger("cloudcompchem.metrics")
+
+# Label values that come from user input (functional, basis set, molecule size)
+# are folded into a fixed set so the number of time series stays bounded no
+# matter what clients send.
+KNOWN_FUNCTIONALS = frozenset(
+    {
+        "lda",
+        "svwn",
+        "pbe",
+        "pbe,pbe",
+        "blyp",
+        "b88,lyp",
+        "bp86",
+        "tpss",
+        "scan",
+        "r2scan",
+        "b3lyp",
+        "pbe0",
+        "m06",
+        "m062x",
+        "wb97x",
+        "camb3lyp",
+        "hf",
+    }
+)
+KNOWN_BASIS_SETS = frozenset(
+    {
+        "sto3g",
+        "321g",
+        "631g",
+        "631g*",
+        "631g**",
+        "6311g",
+        "6311g**",
+        "ccpvdz",
+        "ccpvtz",
+        "augccpvdz",
+        "augccpvtz",
+        "def2svp",
+        "def2tzvp",
+        "def2qzvp",
+    }
+)
+SIZE_BUCKETS = (5, 20, 50, 100, 250)
+
+# wall time buckets (seconds) spanning sub-millisecond parsing up to hour long
+# optimizations
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 10, 15, 20, 30, 50, 75, 100, 200)
+
+CONFIG_LABELS = ("functional", "basis", "size")
+
+REQUESTS = Counter("cloudcompchem_requests", "HTTP requests handled, by endpoint and status.", ("endpoint", "status"))
+REQUEST_SECONDS = Histogram(
+    "cloudcompchem_request_seconds", "End to end request handling time.", ("endpoint",), buckets=LATENCY_BUCKETS
+)
+REQUEST_PARSE_SECONDS = Histogram(
+    "cloudcompchem_request_parse_seconds",
+    "Time spent unmarshalling and validating the request payload.",
+    ("endpoint",),
+    buckets=LATENCY_BUCKETS,
+)
+AUTH_SECONDS = Histogram(
+    "cloudcompchem_auth_seconds", "Time spent validating the auth token.", ("endpoint",), buckets=LATENCY_BUCKETS
+)
+SERIALIZATION_SECONDS = Histogram(
+    "cloudcompchem_serialization_seconds",
+    "Time spent converting a result into the response payload.",
+    ("endpoint",),
+    buckets=LATENCY_BUCKETS,
+)
+MOL_BUILD_SECONDS = Histogram(
+    "cloudcompchem_mol_build_seconds", "Time spent building the pyscf Mole.", CONFIG_LABELS, buckets=LATENCY_BUCKETS
+)
+SCF_SECONDS = Histogram(
+    "cloudcompchem_scf_seconds",
+    "Time spent in the SCF kernel.",
+    CONFIG_LABELS + ("converged",),
+    buckets=LATENCY_BUCKETS,
+)
+SCF_CYCLES = Histogram(
+    "cloudcompchem_scf_cycles", "Number of SCF cycles per kernel call.", CONFIG_LABELS, buckets=COUNT_BUCKETS
+)
+GRADIENT_STEP_SECONDS = Histogram(
+    "cloudcompchem_gradient_step_seconds",
+    "Wall time of one optimizer step (SCF plus nuclear gradient).",
+    CONFIG_LABELS,
+    buckets=LATENCY_BUCKETS,
+)
+INIT_GUESS_CYCLES = Histogram(
+    "cloudcompchem_init_guess_cycles",
+    "SCF cycles of the first SCF of a calculation, by initial guess strategy.",
+    ("init_guess",),
+    buckets=COUNT_BUCKETS,
+)
+SCF_RESCUES = Counter(
+    "cloudcompchem_scf_rescues",
+    "Steps of the SCF rescue ladder tried on unconverged calculations, by step and outcome.",
+    ("step", "converged"),
+)
+OPT_STEPS = Histogram(
+    "cloudcompchem_opt_steps",
+    "Number of optimizer steps per geometry optimization.",
+    ("solver", "size"),
+    buckets=COUNT_BUCKETS,
+)
+HESSIAN_SECONDS = Histogram(
+    "cloudcompchem_hessian_seconds", "Time spent computing the Hessian.", CONFIG_LABELS, buckets=LATENCY_BUCKETS
+)
+PROPERTY_SECONDS = Histogram(
+    "cloudcompchem_property_seconds",
+    "Time spent computing a molecular property from a converged SCF.",
+    ("property",),
+    buckets=LATENCY_BUCKETS,
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "cloudcompchem_queue_wait_seconds",
+    "Time a task spent in the broker queue before a worker picked it up.",
+    ("task",),
+    buckets=LATENCY_BUCKETS,
+)
+SESSIONS = Gauge(
+    "cloudcompchem_sessions", "Live calculation sessions held by the workers.", multiprocess_mode="livesum"
+)
+SESSION_EVICTIONS = Counter("cloudcompchem_session_evictions", "Sessions closed by the server, by reason.", ("reason",))
+BATCH_SIZE = Histogram(
+    "cloudcompchem_batch_size", "Number of small energy requests run per micro-batch.", buckets=COUNT_BUCKETS
+)
+# workload of each process, for the /scaling signals (scaling.Workload); "liveall" keeps one series per live worker
+JOBS_RUNNING = Gauge(
+    "cloudcompchem_jobs_running", "Calculations running in the worker process.", multiprocess_mode="liveall"
+)
+JOB_SLOTS = Gauge(
+    "cloudcompchem_job_slots",
+    "Calculations the worker process can run at once.",
+    multiprocess_mode="liveall",
+)
+RUNNING_CORE_SECONDS = Gauge(
+    "cloudcompchem_running_core_seconds",
+    "Predicted core-seconds of the calculations running in the worker process.",
+    multiprocess_mode="liveall",
+)
+OLDEST_JOB_STARTED = Gauge(
+    "cloudcompchem_oldest_job_started",
+    "Unix time the oldest running calculation of the worker process started (0 when idle).",
+    multiprocess_mode="liveall",
+)
+WORKER_DRAINING = Gauge(
+    "cloudcompchem_worker_draining", "1 while the worker process is shutting down.", multiprocess_mode="liveall"
+)
+BUSY_SECONDS = Counter(
+    "cloudcompchem_busy_seconds",
+    "Wall time spent running calculations; its rate over the slots is the utilization.",
+    ("endpoint",),
+)
+CACHE_REQUESTS = Counter("cloudcompchem_cache_requests", "Cache lookups, by cache and outcome.", ("cache", "result"))
+
+# header used to stamp tasks with the time they were published
+PUBLISHED_AT_HEADER = "cloudcompchem_published_at"
+
+
+def size_bucket(n_atoms: int) -> str:
+    """Map a molecule size onto one of a handful of label values."""
+    lower = 1
+    for upper in SIZE_BUCKETS:
+        if n_atoms <= upper:
+            return f"{lower}-{upper}"
+        lower = upper + 1
+    return f"{lower}+"
+
+
+def functional_label(functional: str) -> str:
+    name = functional.lower().replace(" ", "").replace("-", "")
+    return name if name in KNOWN_FUNCTIONALS else "other"
+
+
+def basis_label(basis_set: str) -> str:
+    name = basis_set.lower().replace(" ", "").replace("-", "").replace("_", "")
+    return name if name in KNOWN_BASIS_SETS else "other"
+
+
+def config_labels(config: FunctionalConfig, molecule: Molecule) -> dict[str, str]:
+    """The bounded (functional, basis, size) labels for a calculation."""
+    return {
+        "functional": functional_label(config.functional),
+        "basis": basis_label(config.basis_set),
+        "size": size_bucket(len(molecule.atoms)),
+    }
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels: str) -> Iterator[dict[str, str]]:
+    """Observe the wall time of the wrapped block in ``histogram``.
+
+    The yielded label dict may be updated inside the block for labels
+    that are only known once the work is done (e.g. convergence).
+    """
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+class SCFCycleCounter:
+    """SCF callback that counts the iterations of every kernel call it is
+    attached to."""
+
+    def __init__(self):
+        self.cycles = 0
+
+    def __call__(self, envs: dict):
+        self.cycles += 1
+
+
+class OptStepTimer:
+    """Optimizer callback that records the wall time of each step.
+
+    Both geomeTRIC and berny invoke the callback once per energy and
+    gradient evaluation. Given the SCF cycle counter attached to the
+    gradient scanner, the SCF cycles of every step are recorded too.
+    """
+
+    def __init__(self, labels: dict[str, str], scf_cycles: SCFCycleCounter | None = None):
+        self.labels = labels
+        self.steps = 0
+        self.scf_cycles = scf_cycles
+        # SCF cycles of the first step, the one started from the initial guess
+        self.first_step_cycles: int | None = None
+        self._last = time.perf_counter()
+        self._last_cycles = 0
+
+    def __call__(self, envs: dict):
+        now = time.perf_counter()
+        GRADIENT_STEP_SECONDS.labels(**self.labels).observe(now - self._last)
+        self._last = now
+        self.steps += 1
+        if self.scf_cycles is not None:
+            SCF_CYCLES.labels(**self.labels).observe(self.scf_cycles.cycles - self._last_cycles)
+            if self.first_step_cycles is None:
+                self.first_step_cycles = self.scf_cycles.cycles
+            self._last_cycles = self.scf_cycles.cycles
+
+
+def registry() -> CollectorRegistry:
+    """The registry holding the metrics of all worker processes.
+
+    When running under gunicorn with several workers, set
+    ``PROMETHEUS_MULTIPROC_DIR`` so that every worker writes its samples
+    to a shared directory which is aggregated here.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        aggregated = CollectorRegistry()
+        multiprocess.MultiProcessCollector(aggregated)
+        return aggregated
+    return REGISTRY
+
+
+def render() -> tuple[bytes, str]:
+    """Render the metrics in the prometheus text format."""
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+@before_task_publish.connect
+def _stamp_published_at(headers: dict | None = None, **kwargs):
+    if headers is not None:
+        headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+@task_prerun.connect
+def _observe_queue_wait(task=None, **kwargs):
+    published_at = getattr(getattr(task, "request", None), PUBLISHED_AT_HEADER, None)
+    if published_at is None:
+        return
+    QUEUE_WAIT_SECONDS.labels(task=task.name).observe(max(time.time() - published_at, 0.0))
@@ -1,14 +1,19 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, field
+from functools import cached_property
 from typing import Literal, get_args
 
+import numpy as np
 from pyscf.hessian.rhf import Hessian
 
+from .capabilities import capabilities
+from .ecp import ECP_MODES, EcpAssignment, EcpMode
 from .exceptions import (
     DFTRequestValidationException,
     MoleculeSpinAndChargeViolationError,
 )
+from .utils import SYMMETRY_TOLERANCE
 
 AtomSymbol = Literal[
     "H",
@@ -117,10 +122,118 @@ ATOMIC_NUMBERS: dict[AtomSymbol, int] = {atom: position for position, atom in en
 assert len(ATOMIC_NUMBERS) == 98
 
 
+def atomic_numbers(symbols: list[str]) -> np.ndarray:
+    """Look up the atomic numbers of ``symbols``, raising a ValueError for
+    unknown elements."""
+    numbers = np.fromiter((ATOMIC_NUMBERS.get(s, 0) for s in symbols), dtype=np.int64, count=len(symbols))
+    if not numbers.all():
+        raise ValueError(f"Unknown element symbol '{symbols[int(np.argmin(numbers))]}'.")
+    return numbers
+
+
+# Parts of a response that can be selected with the `fields` request parameter. The energy, convergence, point group
+# (and for optimizations the molecule and stages) are always returned; "energy" alone asks for just those.
+ResponseField = Literal["energy", "orbitals", "homo_lumo", "hessian", "frequencies"]
+
+ENERGY_FIELDS = frozenset({"energy", "orbitals", "homo_lumo"})
+OPT_FIELDS = frozenset(get_args(ResponseField))
+DEFAULT_ENERGY_FIELDS: tuple[ResponseField, ...] = ("energy", "orbitals")
+DEFAULT_OPT_FIELDS: tuple[ResponseField, ...] = ("energy", "orbitals", "hessian", "frequencies")
+
+
+# Molecular properties computed from the converged SCF of an energy calculation
+Property = Literal["dipole", "mulliken_charges", "lowdin_charges", "gradient"]
+
+PROPERTY_NAMES = frozenset(get_args(Property))
+
+# SCF initial guess strategies (see cloudcompchem.guess)
+InitGuess = Literal["minao", "atom", "huckel", "project", "auto"]
+
+INIT_GUESSES: tuple[InitGuess, ...] = get_args(InitGuess)
+
+
+def parse_fields(fields: object, allowed: frozenset[str], default: tuple = (), key: str = "fields") -> tuple:
+    """Validate a list of names (the `fields` or `properties` of a
+    request), falling back to ``default`` when none are given."""
+    if fields is None:
+        return default
+    if not isinstance(fields, (list, tuple)) or not all(isinstance(f, str) for f in fields):
+        raise DFTRequestValidationException(f"'{key}' must be a list of names.")
+    if unknown := set(fields) - allowed:
+        raise DFTRequestValidationException(
+            f"Unknown {key} [{', '.join(sorted(unknown))}], expected any of [{', '.join(sorted(allowed))}]."
+        )
+    return tuple(dict.fromkeys(fields))
+
+
+def parse_ecp(d: dict | None) -> dict[str, EcpAssignment] | None:
+    return None if d is None else {symbol: EcpAssignment(**assignment) for symbol, assignment in d.items()}
+
+
+def check_supported(config: FunctionalConfig, molecules: list[Molecule], gradient: bool = False, hessian: bool = False):
+    """Reject calculations that would only fail once running, such as a
+    basis set without functions for an element or a misspelled
+    functional (see cloudcompchem.capabilities)."""
+    if not isinstance(config.functional, str) or not isinstance(config.basis_set, str):
+        raise DFTRequestValidationException("'functional' and 'basis_set' must be strings.")
+    capabilities().check(
+        config.functional,
+        config.basis_set,
+        {atom.symbol for molecule in molecules for atom in molecule.atoms},
+        unrestricted=any(molecule.spin_multiplicity > 1 for molecule in molecules),
+        gradient=gradient,
+        hessian=hessian,
+        ecp=config.ecp,
+    )
+
+
+# many-body expansion defaults (see cloudcompchem.fragment)
+MBE_ORDERS = (1, 2, 3)
+DEFAULT_MBE_ORDER = 2
+DEFAULT_MAX_FRAGMENT_ATOMS = 20
+DEFAULT_MBE_CUTOFF = 5.0
+
+
+@dataclass
+class FragmentationConfig:
+    """A many-body expansion of the energy over fragments of the
+    molecule."""
+
+    # highest order of the expansion: 1 sums the fragments, 2 adds pair and 3 triple corrections
+    order: int = DEFAULT_MBE_ORDER
+    # larger covalently bonded molecules are cut into fragments of up to this many atoms
+    max_fragment_atoms: int = DEFAULT_MAX_FRAGMENT_ATOMS
+    # pairs and triples are included when their fragments are closer than this, in Angstrom
+    cutoff: float = DEFAULT_MBE_CUTOFF
+
+    @staticmethod
+    def from_dict(d: dict | bool) -> FragmentationConfig:
+        if d is True:
+            d = {}
+        if not isinstance(d, dict):
+            raise DFTRequestValidationException("'fragmentation' must be true or an object.")
+        try:
+            config = FragmentationConfig(**d)
+        except TypeError:
+            raise DFTRequestValidationException("Invalid fragmentation config") from None
+
+        if config.order not in MBE_ORDERS:
+            raise DFTRequestValidationException(f"The fragmentation order must be one of {MBE_ORDERS}.")
+        if not isinstance(config.max_fragment_atoms, int) or config.max_fragment_atoms < 1:
+            raise DFTRequestValidationException("max_fragment_atoms must be a positive integer.")
+        if not isinstance(config.cutoff, (int, float)) or config.cutoff <= 0:
+            raise DFTRequestValidationException("The fragmentation cutoff must be a positive distance.")
+        return config
+
+
 @dataclass
 class EnergyRequest:
     config: FunctionalConfig
     molecule: Molecule
+    fields: tuple[ResponseField, ...] = DEFAULT_ENERGY_FIELDS
+    properties: tuple[Property, ...] = ()
+    # opt-in many-body expansion over fragments, for molecules too large for one calculation
+    fragmentation: FragmentationConfig | None = None
 
     @staticmethod
     def from_dict(d: dict) -> EnergyRequest:
@@ -139,13 +252,46 @@ class EnergyRequest:
         except (KeyError, TypeError) as err:
             raise ValueError("Invalid functional configuration") from err
 
-        return EnergyRequest(config=config, molecule=molecule)
+        fragmentation = d.get("fragmentation")
+        if fragmentation is None or fragmentation is False:
+            fields = parse_fields(d.get("fields"), ENERGY_FIELDS, DEFAULT_ENERGY_FIELDS)
+            properties = parse_fields(d.get("properties"), PROPERTY_NAMES, key="properties")
+            check_supported(config, [molecule], gradient="gradient" in properties)
+            return EnergyRequest(config=config, molecule=molecule, fields=fields, properties=properties)
+
+        # the expansion only yields the energy and gradient, which need a closed shell to start from
+        fields = parse_fields(d.get("fields"), frozenset({"energy"}), ("energy",))
+        properties = parse_fields(d.get("properties"), frozenset({"gradient"}), key="properties")
+        if molecule.charge != 0 or molecule.spin_multiplicity != 1:
+            raise DFTRequestValidationException("Fragmentation needs a neutral molecule with spin multiplicity 1.")
+        check_supported(config, [molecule], gradient="gradient" in properties)
+        return EnergyRequest(
+            config=config,
+            molecule=molecule,
+            fields=fields,
+            properties=properties,
+            fragmentation=FragmentationConfig.from_dict(fragmentation),
+        )
 
 
 @dataclass
 class FunctionalConfig:
     functional: str
     basis_set: str
+    # detect and exploit point group symmetry, tolerating geometric noise up to `symmetry_tolerance` (Bohr)
+    symmetry: bool = True
+    symmetry_tolerance: float = SYMMETRY_TOLERANCE
+    init_guess: InitGuess = "minao"
+    # climb the rescue ladder (see cloudcompchem.rescue) when the SCF does not converge
+    scf_rescue: bool = True
+    # "auto": effective core potentials for the elements past krypton (see cloudcompchem.ecp)
+    ecp: EcpMode = "none"
+
+    def __post_init__(self):
+        if self.init_guess not in INIT_GUESSES:
+            raise DFTRequestValidationException(f"init_guess must be one of {', '.join(INIT_GUESSES)}.")
+        if self.ecp not in ECP_MODES:
+            raise DFTRequestValidationException(f"ecp must be one of {', '.join(ECP_MODES)}.")
 
 
 @dataclass
@@ -166,20 +312,70 @@ class Molecule:
             raise DFTRequestValidationException("spin multiplicity must be an integer")
 
         charge, spin = self.charge, (self.spin_multiplicity - 1) % 2
-        total_e = sum(ATOMIC_NUMBERS[atom.symbol] for atom in self.atoms) - charge
+        total_e = int(self.numbers.sum()) - charge
         total_e %= 2
         if total_e != spin:
             raise MoleculeSpinAndChargeViolationError(self.spin_multiplicity, self.charge)
 
+    @cached_property
+    def numbers(self) -> np.ndarray:
+        """The atomic numbers of the atoms.
+
+        Like ``positions`` this is computed once, so the atoms must not
+        be modified afterwards.
+        """
+        return atomic_numbers([atom.symbol for atom in self.atoms])
+
+    @cached_property
+    def positions(self) -> np.ndarray:
+        """The (n_atoms, 3) array of atom positions in Angstrom."""
+        return np.array([atom.position for atom in self.atoms], dtype=float).reshape(-1, 3)
+
+    def to_pyscf(self) -> list[tuple[str, list[float]]]:
+        """The atoms in pyscf's list input format, which pyscf parses a lot
+        faster than the string from ``str``."""
+        return list(zip([atom.symbol for atom in self.atoms], self.positions.tolist()))
+
     @staticmethod
     def from_dict(d: dict) -> Molecule:
         """Method that converts a dict from a json request into an object of
-        this class."""
+        this class.
+
+        Atoms are checked against the ``{"symbol": ..., "position": [x,
+        y, z]}`` schema in a single pass and their positions go straight
+        into an array, so large payloads avoid per-atom keyword
+        unpacking. ``d`` is not modified.
+        """
         try:
-            return Molecule(atoms=[Atom(**a) for a in d.pop("atoms")], **d)
+            atoms = d["atoms"]
+            if not isinstance(atoms, list) or any(len(a) != 2 for a in atoms):
+                raise TypeError("atoms must be a list of symbol and position objects")
+            return Molecule.from_positions(
+                [a["symbol"] for a in atoms],
+                [a["position"] for a in atoms],
+                **{key: value for key, value in d.items() if key != "atoms"},
+            )
         except (AttributeError, KeyError, TypeError) as err:
             raise ValueError from err
 
+    @staticmethod
+    def from_positions(symbols: list[str], positions: list[list[float]], **kwargs) -> Molecule:
+        """A molecule of atoms with ``symbols`` at ``positions``, a list of
+        ``[x, y, z]`` coordinates.
+
+        The positions are checked and kept as the ``positions`` array;
+        ``kwargs`` are the other fields of the molecule.
+        """
+        array = np.array(positions, dtype=float)
+        if array.shape != (len(symbols), 3) and symbols:
+            raise ValueError("atom positions must have three coordinates")
+        if not np.isfinite(array).all():
+            raise ValueError("atom positions must be finite")
+
+        molecule = Molecule(atoms=[Atom(symbol, position) for symbol, position in zip(symbols, positions)], **kwargs)
+        molecule.__dict__["positions"] = array.reshape(-1, 3)
+        return molecule
+
 
 @dataclass
 class Atom:
@@ -199,17 +395,175 @@ class Orbital:
     occupancy: float
 
 
+@dataclass
+class FragmentationResult:
+    fragments: int
+    # fragments, pairs and triples of the expansion
+    subsystems: int
+    # calculations run for them, identical subsystems being calculated once
+    calculations: int
+
+
 @dataclass
 class SinglePointEnergyResponse:
     energy: float
     converged: bool
-    orbitals: list[Orbital]
+    # None when not requested through `fields`; unrestricted calculations list the alpha, then the beta orbitals
+    orbitals: list[Orbital] | None = None
+    point_group: str | None = None
+    homo: float | None = None
+    lumo: float | None = None
+    # requested `properties`: dipole in Debye, partial charges per atom, gradient in Hartree/Bohr per atom
+    dipole: list[float] | None = None
+    mulliken_charges: list[float] | None = None
+    lowdin_charges: list[float] | None = None
+    gradient: list[list[float]] | None = None
+    # the initial guess strategy used (``auto`` resolved) and the SCF cycles it took from there
+    init_guess: str | None = None
+    scf_cycles: int | None = None
+    # the rescue steps tried when the first SCF did not converge, the last one converged unless `converged` is false
+    rescue_path: list[str] | None = None
+    # for fragmented requests, the size of the expansion
+    fragmentation: FragmentationResult | None = None
+    # the effective core potential and valence basis set of each element that got one
+    ecp: dict[str, EcpAssignment] | None = None
+
+    def to_dict(self) -> dict:
+        """Serialize the response, leaving out the parts that were not
+        requested."""
+        return {key: value for key, value in asdict(self).items() if value is not None}
 
     @staticmethod
     def from_dict(d: dict) -> SinglePointEnergyResponse:
-        orbital_info = d["orbitals"]
-        orbitals = [Orbital(**kwargs) for kwargs in orbital_info]
-        return SinglePointEnergyResponse(orbitals=orbitals, converged=d["converged"], energy=d["energy"])
+        orbital_info = d.get("orbitals")
+        orbitals = None if orbital_info is None else [Orbital(**kwargs) for kwargs in orbital_info]
+        return SinglePointEnergyResponse(
+            orbitals=orbitals,
+            converged=d["converged"],
+            energy=d["energy"],
+            point_group=d.get("point_group"),
+            homo=d.get("homo"),
+            lumo=d.get("lumo"),
+            dipole=d.get("dipole"),
+            mulliken_charges=d.get("mulliken_charges"),
+            lowdin_charges=d.get("lowdin_charges"),
+            gradient=d.get("gradient"),
+            init_guess=d.get("init_guess"),
+            scf_cycles=d.get("scf_cycles"),
+            rescue_path=d.get("rescue_path"),
+            fragmentation=None if d.get("fragmentation") is None else FragmentationResult(**d["fragmentation"]),
+            ecp=parse_ecp(d.get("ecp")),
+        )
+
+
+@dataclass
+class GradientRequest:
+    """Energies and nuclear gradients for a sequence of geometries of the
+    same molecule, e.g. the frames of a trajectory."""
+
+    config: FunctionalConfig
+    molecules: list[Molecule]
+
+    @staticmethod
+    def from_dict(d: dict) -> GradientRequest:
+        """Create a GradientRequest from a json-like dictionary with either
+        a single `molecule` or a list of `molecules`."""
+
+        try:
+            molecule_dicts = d["molecules"] if "molecules" in d else [d["molecule"]]
+        except KeyError:
+            raise DFTRequestValidationException("No molecule information contained in request.") from None
+        if not isinstance(molecule_dicts, list) or not molecule_dicts:
+            raise DFTRequestValidationException("'molecules' must be a non-empty list.")
+        try:
+            molecules = [Molecule.from_dict(m) for m in molecule_dicts]
+        except ValueError as err:
+            raise DFTRequestValidationException("Invalid molecule.") from err
+
+        first = molecules[0]
+        for molecule in molecules[1:]:
+            if (
+                molecule.charge != first.charge
+                or molecule.spin_multiplicity != first.spin_multiplicity
+                or not np.array_equal(molecule.numbers, first.numbers)
+            ):
+                raise DFTRequestValidationException(
+                    "All geometries must have the same atoms, charge and spin multiplicity."
+                )
+
+        try:
+            config = FunctionalConfig(**d["config"])
+        except KeyError:
+            raise DFTRequestValidationException(
+                "No functional configuration has been specified (use the 'config' keyword)."
+            ) from None
+        except TypeError:
+            raise DFTRequestValidationException("Invalid functional config") from None
+
+        check_supported(config, molecules, gradient=True)
+        return GradientRequest(config=config, molecules=molecules)
+
+
+@dataclass
+class GradientResult:
+    energy: float
+    converged: bool
+    # Hartree/Bohr, one row per atom; the forces are its negative. None for energy-only session steps
+    gradient: list[list[float]] | None
+    # SCF iterations this geometry took, lower for warm started ones
+    scf_cycles: int
+
+
+@dataclass
+class GradientResponse:
+    results: list[GradientResult]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def from_dict(d: dict) -> GradientResponse:
+        return GradientResponse(results=[GradientResult(**result) for result in d["results"]])
+
+
+@dataclass
+class SessionStepRequest:
+    """New atom positions (Angstrom, same atom order as the session's
+    molecule) for a session to evaluate."""
+
+    positions: np.ndarray
+    gradient: bool = True
+
+    @staticmethod
+    def from_dict(d: dict) -> SessionStepRequest:
+        try:
+            positions = np.array(d["positions"], dtype=float)
+        except KeyError:
+            raise DFTRequestValidationException("missing 'positions' key") from None
+        except (TypeError, ValueError):
+            raise DFTRequestValidationException("'positions' must be a list of [x, y, z] coordinates.") from None
+        if positions.ndim != 2 or positions.shape[1] != 3 or not np.isfinite(positions).all():
+            raise DFTRequestValidationException("'positions' must be a list of finite [x, y, z] coordinates.")
+
+        gradient = d.get("gradient", True)
+        if not isinstance(gradient, bool):
+            raise DFTRequestValidationException("'gradient' must be a boolean.")
+        return SessionStepRequest(positions=positions, gradient=gradient)
+
+
+@dataclass
+class SessionResponse:
+    session_id: str
+    # the evaluation of the step, None when closing
+    result: GradientResult | None = None
+
+    def to_dict(self) -> dict:
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+    @staticmethod
+    def from_dict(d: dict) -> SessionResponse:
+        result = d.get("result")
+        return SessionResponse(session_id=d["session_id"], result=None if result is None else GradientResult(**result))
 
 
 DEFAULT_CONV_PARAMS = {
@@ -229,10 +583,107 @@ DEFAULT_CONV_PARAMS = {
 }
 
 
+# pre-optimization defaults: a GGA in a small basis, converged ten times more loosely than the defaults
+DEFAULT_PREOPT_CONFIG = {"functional": "pbe,pbe", "basis_set": "3-21g"}
+PREOPT_CONV_PARAMS_FACTOR = 10
+PREOPT_SCF_CONV_TOL = 1e-6
+
+
 @dataclass
 class SolverConfig:
     solver: str
     conv_params: dict
+    # SCF convergence threshold, pyscf's default when None
+    scf_conv_tol: float | None = None
+
+
+@dataclass
+class PreOptConfig:
+    """A cheap level of theory used to relax the geometry before the
+    requested one."""
+
+    config: FunctionalConfig
+    conv_params: dict
+    scf_conv_tol: float | None = PREOPT_SCF_CONV_TOL
+
+    @staticmethod
+    def from_dict(d: dict | bool, solver: str) -> PreOptConfig:
+        if d is True:
+            d = {}
+        if not isinstance(d, dict):
+            raise DFTRequestValidationException("'preopt' must be true or an object.")
+
+        d = DEFAULT_PREOPT_CONFIG | d
+        conv_params = d.pop("conv_params", {})
+        scf_conv_tol = d.pop("scf_conv_tol", PREOPT_SCF_CONV_TOL)
+        try:
+            config = FunctionalConfig(**d)
+        except TypeError:
+            raise DFTRequestValidationException("Invalid pre-optimization config") from None
+
+        default_conv_params = {k: v * PREOPT_CONV_PARAMS_FACTOR for k, v in DEFAULT_CONV_PARAMS[solver].items()}
+        if not isinstance(conv_params, dict):
+            raise DFTRequestValidationException("invalid pre-optimization 'conv_params'")
+        if extra := set(conv_params) - set(default_conv_params):
+            raise DFTRequestValidationException(
+                f"Pre-optimization convergence parameter(s) [{', '.join(extra)}] is (are) not supported."
+            )
+        if invalid := [key for key, value in conv_params.items() if not _positive_number(value)]:
+            raise DFTRequestValidationException(
+                f"Pre-optimization convergence parameter(s) [{', '.join(invalid)}] must be positive numbers."
+            )
+        if scf_conv_tol is not None and not _positive_number(scf_conv_tol):
+            raise DFTRequestValidationException(
+                "The pre-optimization 'scf_conv_tol' must be a positive number or null."
+            )
+
+        return PreOptConfig(config, default_conv_params | conv_params, scf_conv_tol)
+
+
+def _positive_number(value: object) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 < value < float("inf")
+
+
+# optimizer steps of a transition state search, over all Hessian recalculations
+DEFAULT_TS_MAX_STEPS = 100
+
+
+@dataclass
+class TransitionStateConfig:
+    """Search for a first-order saddle point instead of a minimum.
+
+    The search starts from ``hessian`` (e.g. the Hessian of an earlier
+    job at the same geometry) or, without one, from an analytic Hessian
+    at the starting geometry; with a pre-optimization that is the
+    Hessian of the cheap level at its transition state. geomeTRIC then
+    updates it every step, and it is recalculated analytically every
+    ``recalc_hessian`` steps (never when 0).
+    """
+
+    hessian: np.ndarray | None = None
+    recalc_hessian: int = 0
+    max_steps: int = DEFAULT_TS_MAX_STEPS
+
+    @staticmethod
+    def from_dict(d: dict | bool, n_atoms: int) -> TransitionStateConfig:
+        if d is True:
+            d = {}
+        if not isinstance(d, dict):
+            raise DFTRequestValidationException("'transition_state' must be true or an object.")
+        if extra := set(d) - {"hessian", "recalc_hessian", "max_steps"}:
+            raise DFTRequestValidationException(f"Unknown transition state option(s) [{', '.join(extra)}].")
+
+        recalc_hessian = d.get("recalc_hessian", 0)
+        max_steps = d.get("max_steps", DEFAULT_TS_MAX_STEPS)
+        for key, value, minimum in (("recalc_hessian", recalc_hessian, 0), ("max_steps", max_steps, 1)):
+            if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+                raise DFTRequestValidationException(f"'{key}' must be an integer of at least {minimum}.")
+        hessian = d.get("hessian")
+        return TransitionStateConfig(
+            hessian=None if hessian is None else parse_hessian(hessian, n_atoms),
+            recalc_hessian=recalc_hessian,
+            max_steps=max_steps,
+        )
 
 
 @dataclass
@@ -240,6 +691,10 @@ class DFTOptRequest:
     config: FunctionalConfig
     molecule: Molecule
     solver_config: SolverConfig
+    preopt: PreOptConfig | None = None
+    fields: tuple[ResponseField, ...] = DEFAULT_OPT_FIELDS
+    # search for a transition state (geomeTRIC only) instead of a minimum
+    transition_state: TransitionStateConfig | None = None
 
     @staticmethod
     def from_dict(d: dict) -> DFTOptRequest:
@@ -283,6 +738,27 @@ class DFTOptRequest:
                 f"Convergence parameter(s) [{', '.join(extra)}] is (are) not supported."
             )
 
+        preopt = d.get("preopt")
+        if preopt is not None and preopt is not False:
+            preopt = PreOptConfig.from_dict(preopt, solver)
+        else:
+            preopt = None
+
+        transition_state = d.get("transition_state")
+        if transition_state is not None and transition_state is not False:
+            if solver != "geomeTRIC":
+                raise DFTRequestValidationException("Transition state searches need the geomeTRIC solver.")
+            transition_state = TransitionStateConfig.from_dict(transition_state, len(molecule.atoms))
+        else:
+            transition_state = None
+
+        fields = parse_fields(d.get("fields"), OPT_FIELDS, DEFAULT_OPT_FIELDS)
+        hessian = transition_state is not None or bool({"hessian", "frequencies"} & set(fields))
+        check_supported(config, [molecule], gradient=True, hessian=hessian)
+        if preopt is not None:
+            # the pre-optimization calculates the initial Hessian of a transition state search
+            check_supported(preopt.config, [molecule], gradient=True, hessian=transition_state is not None)
+
         return DFTOptRequest(
             config=config,
             molecule=molecule,
@@ -290,27 +766,394 @@ class DFTOptRequest:
                 solver,
                 default_conv_params | conv_params,
             ),
+            preopt=preopt,
+            fields=fields,
+            transition_state=transition_state,
         )
 
 
+@dataclass
+class OptStage:
+    """Timing and outcome of one level of a (multi-level) optimization."""
+
+    name: str
+    functional: str
+    basis_set: str
+    steps: int
+    seconds: float
+    energy: float
+    converged: bool
+    # initial guess of the first SCF ("preopt" when starting from the pre-optimization)
+    init_guess: str | None = None
+
+
+@dataclass
+class TransitionStateResult:
+    # exactly one imaginary frequency at the final geometry, from an analytic Hessian
+    verified: bool
+    # magnitudes of the imaginary frequencies, in cm^-1
+    imaginary_frequencies: list[float]
+    # analytic Hessians calculated, over all stages and including the final one
+    hessians: int
+
+
 @dataclass
 class StructureRelaxationResponse:
     molecule: Molecule
     energy: float
     converged: bool | object
-    orbitals: list[Orbital]
-    hessian: Hessian
-    frequencies: dict
+    # None when not requested through `fields`; unrestricted calculations list the alpha, then the beta orbitals
+    orbitals: list[Orbital] | None = None
+    hessian: Hessian | None = None
+    frequencies: dict | None = None
+    point_group: str | None = None
+    stages: list[OptStage] = field(default_factory=list)
+    homo: float | None = None
+    lumo: float | None = None
+    transition_state: TransitionStateResult | None = None
+    # the effective core potential and valence basis set of each element that got one
+    ecp: dict[str, EcpAssignment] | None = None
+
+    def to_dict(self) -> dict:
+        """Serialize the response, leaving out the parts that were not
+        requested."""
+        return {key: value for key, value in asdict(self).items() if value is not None}
 
     @staticmethod
     def from_dict(d: dict) -> StructureRelaxationResponse:
-        orbital_info = d["orbitals"]
-        orbitals = [Orbital(**kwargs) for kwargs in orbital_info]
+        orbital_info = d.get("orbitals")
+        orbitals = None if orbital_info is None else [Orbital(**kwargs) for kwargs in orbital_info]
         return StructureRelaxationResponse(
             orbitals=orbitals,
             converged=d["converged"],
             energy=d["energy"],
             molecule=d["molecule"],
-            hessian=d["hessian"],
-            frequencies=d["frequencies"],
+            hessian=d.get("hessian"),
+            frequencies=d.get("frequencies"),
+            point_group=d.get("point_group"),
+            stages=[OptStage(**stage) for stage in d.get("stages", [])],
+            homo=d.get("homo"),
+            lumo=d.get("lumo"),
+            transition_state=(
+                None if d.get("transition_state") is None else TransitionStateResult(**d["transition_state"])
+            ),
+            ecp=parse_ecp(d.get("ecp")),
+        )
+
+
+# standard conditions of the thermochemistry, in K and Pa
+STANDARD_TEMPERATURE = 298.15
+STANDARD_PRESSURE = 101325.0
+# largest temperature x pressure grid of one thermochemistry request
+MAX_THERMO_GRID_POINTS = 10**6
+
+
+def parse_hessian(value, n_atoms: int) -> np.ndarray:
+    """A Hessian (Hartree/Bohr^2) as pyscf's (n_atoms, n_atoms, 3, 3) array,
+    from that shape or the flattened (3 n_atoms, 3 n_atoms) matrix."""
+    try:
+        hessian = np.array(value, dtype=float)
+    except (TypeError, ValueError):
+        raise DFTRequestValidationException("'hessian' must be a nested list of numbers.") from None
+    if hessian.shape == (3 * n_atoms, 3 * n_atoms):
+        hessian = hessian.reshape(n_atoms, 3, n_atoms, 3).transpose(0, 2, 1, 3)
+    if hessian.shape != (n_atoms, n_atoms, 3, 3) or not np.isfinite(hessian).all():
+        raise DFTRequestValidationException(
+            f"'hessian' must have the shape ({n_atoms}, {n_atoms}, 3, 3) or ({3 * n_atoms}, {3 * n_atoms})."
+        )
+    return hessian
+
+
+def _positive_values(d: dict, key: str, default: float) -> np.ndarray:
+    try:
+        values = np.array(d.get(key, [default]), dtype=float).reshape(-1)
+    except (TypeError, ValueError):
+        raise DFTRequestValidationException(f"'{key}' must be a list of numbers.") from None
+    if not values.size or not np.isfinite(values).all() or (values <= 0).any():
+        raise DFTRequestValidationException(f"'{key}' must be a non-empty list of positive numbers.")
+    return values
+
+
+@dataclass
+class ThermoRequest:
+    """Thermochemistry of an optimized molecule from its Hessian, e.g. the
+    response of an earlier /opt request, over grids of temperatures (K)
+    and pressures (Pa)."""
+
+    molecule: Molecule
+    # electronic energy (Hartree) and Hessian (Hartree/Bohr^2, (n_atoms, n_atoms, 3, 3)) at the equilibrium geometry
+    energy: float
+    hessian: np.ndarray
+    temperatures: np.ndarray
+    pressures: np.ndarray
+
+    @staticmethod
+    def from_dict(d: dict) -> ThermoRequest:
+        try:
+            molecule = Molecule.from_dict(d["molecule"])
+        except KeyError:
+            raise DFTRequestValidationException("No molecule information contained in request.") from None
+        except ValueError as err:
+            raise DFTRequestValidationException("Invalid molecule.") from err
+
+        energy = d.get("energy")
+        if not isinstance(energy, (int, float)) or isinstance(energy, bool):
+            raise DFTRequestValidationException("'energy' must be the electronic energy in Hartree.")
+
+        if "hessian" not in d:
+            raise DFTRequestValidationException("'hessian' is required, request it from /opt.")
+        hessian = parse_hessian(d["hessian"], len(molecule.atoms))
+
+        temperatures = _positive_values(d, "temperatures", STANDARD_TEMPERATURE)
+        pressures = _positive_values(d, "pressures", STANDARD_PRESSURE)
+        if temperatures.size * pressures.size > MAX_THERMO_GRID_POINTS:
+            raise DFTRequestValidationException(f"At most {MAX_THERMO_GRID_POINTS} temperature and pressure pairs.")
+        return ThermoRequest(
+            molecule=molecule,
+            energy=float(energy),
+            hessian=hessian,
+            temperatures=temperatures,
+            pressures=pressures,
+        )
+
+
+@dataclass
+class ThermoResponse:
+    """Ideal gas, rigid rotor, harmonic oscillator thermochemistry, in
+    Hartree (per molecule) and Hartree/K.
+
+    Quantities that only depend on the temperature have one value per
+    temperature, the entropy and Gibbs free energy one row per
+    temperature with one value per pressure.
+    """
+
+    temperatures: list[float]
+    pressures: list[float]
+    energy: float
+    zpe: float
+    internal_energy: list[float]
+    enthalpy: list[float]
+    heat_capacity: list[float]
+    entropy: list[list[float]]
+    gibbs_free_energy: list[list[float]]
+    # real vibrational frequencies (cm^-1); imaginary ones are counted and left out of the thermochemistry
+    frequencies: list[float]
+    imaginary_frequencies: int
+    symmetry_number: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def from_dict(d: dict) -> ThermoResponse:
+        return ThermoResponse(**d)
+
+
+# intermediate images of a reaction path, the reactant and product not counted
+DEFAULT_NEB_IMAGES = 7
+MAX_NEB_IMAGES = 32
+# largest force on an atom (Hartree/Bohr) perpendicular to the path at convergence
+DEFAULT_NEB_FMAX = 1e-3
+# spring constant between neighbouring images, in Hartree/Bohr^2
+DEFAULT_NEB_SPRING = 0.05
+DEFAULT_NEB_MAX_ITERATIONS = 200
+
+
+@dataclass
+class ReactionPathRequest:
+    """Minimum energy path between two geometries of the same molecule, by
+    the (climbing image) nudged elastic band method.
+
+    The reactant and product should be optimized beforehand: they are
+    the fixed ends of the band and are evaluated once.
+    """
+
+    config: FunctionalConfig
+    reactant: Molecule
+    product: Molecule
+    images: int = DEFAULT_NEB_IMAGES
+    # let the highest image climb to the saddle point once the band is roughly converged
+    climbing: bool = True
+    fmax: float = DEFAULT_NEB_FMAX
+    spring: float = DEFAULT_NEB_SPRING
+    max_iterations: int = DEFAULT_NEB_MAX_ITERATIONS
+
+    @staticmethod
+    def from_dict(d: dict) -> ReactionPathRequest:
+        try:
+            reactant, product = Molecule.from_dict(d["reactant"]), Molecule.from_dict(d["product"])
+        except KeyError:
+            raise DFTRequestValidationException("A reaction path needs a 'reactant' and a 'product'.") from None
+        except ValueError as err:
+            raise DFTRequestValidationException("Invalid molecule.") from err
+        if (
+            reactant.charge != product.charge
+            or reactant.spin_multiplicity != product.spin_multiplicity
+            or not np.array_equal(reactant.numbers, product.numbers)
+        ):
+            raise DFTRequestValidationException(
+                "The reactant and product must have the same atoms (in the same order), charge and spin multiplicity."
+            )
+
+        try:
+            config = FunctionalConfig(**d["config"])
+        except KeyError:
+            raise DFTRequestValidationException(
+                "No functional configuration has been specified (use the 'config' keyword)."
+            ) from None
+        except TypeError:
+            raise DFTRequestValidationException("Invalid functional config") from None
+
+        images = d.get("images", DEFAULT_NEB_IMAGES)
+        if not isinstance(images, int) or isinstance(images, bool) or not 1 <= images <= MAX_NEB_IMAGES:
+            raise DFTRequestValidationException(f"'images' must be an integer from 1 to {MAX_NEB_IMAGES}.")
+        max_iterations = d.get("max_iterations", DEFAULT_NEB_MAX_ITERATIONS)
+        if not isinstance(max_iterations, int) or isinstance(max_iterations, bool) or max_iterations < 1:
+            raise DFTRequestValidationException("'max_iterations' must be a positive integer.")
+        climbing = d.get("climbing", True)
+        if not isinstance(climbing, bool):
+            raise DFTRequestValidationException("'climbing' must be a boolean.")
+        for key in ("fmax", "spring"):
+            value = d.get(key, 1.0)
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or not value > 0:
+                raise DFTRequestValidationException(f"'{key}' must be a positive number.")
+
+        check_supported(config, [reactant, product], gradient=True)
+        return ReactionPathRequest(
+            config=config,
+            reactant=reactant,
+            product=product,
+            images=images,
+            climbing=climbing,
+            fmax=float(d.get("fmax", DEFAULT_NEB_FMAX)),
+            spring=float(d.get("spring", DEFAULT_NEB_SPRING)),
+            max_iterations=max_iterations,
+        )
+
+
+@dataclass
+class ReactionPathProgress:
+    """The state of the band after one iteration, streamed while the
+    reaction path job runs."""
+
+    iteration: int
+    # Hartree, of every image from the reactant to the product
+    energies: list[float]
+    # largest force on an atom of a moving image (Hartree/Bohr)
+    max_force: float
+    # index of the climbing image, None until it climbs
+    climbing_image: int | None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class ReactionPathResponse:
+    # the geometries from the reactant to the product
+    images: list[Molecule]
+    energies: list[float]
+    converged: bool
+    iterations: int
+    max_force: float
+    climbing_image: int | None
+    # highest energy along the path above the reactant, in Hartree
+    barrier: float
+    scf_cycles: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def from_dict(d: dict) -> ReactionPathResponse:
+        return ReactionPathResponse(**(d | {"images": [Molecule.from_dict(m) for m in d["images"]]}))
+
+
+# structure file formats of bulk ingestion (see cloudcompchem.ingest)
+StructureFormat = Literal["xyz", "sdf"]
+
+STRUCTURE_FORMATS: tuple[StructureFormat, ...] = get_args(StructureFormat)
+
+# JSON lines, or columns (see cloudcompchem.export)
+IngestOutput = Literal["jsonl", "arrow", "parquet"]
+
+INGEST_OUTPUTS: tuple[IngestOutput, ...] = get_args(IngestOutput)
+
+
+@dataclass
+class IngestRequest:
+    """Energies of every structure of a multi-XYZ or SDF file. The file is
+    the request body, so these come from the query string."""
+
+    config: FunctionalConfig
+    format: StructureFormat
+    # of XYZ records that do not set their own
+    charge: int = 0
+    spin_multiplicity: int = 1
+    fields: tuple[ResponseField, ...] = DEFAULT_ENERGY_FIELDS
+    output: IngestOutput = "jsonl"
+
+    @staticmethod
+    def from_dict(d: dict[str, str]) -> IngestRequest:
+        """Create an IngestRequest from query parameters, where ``fields``
+        is a comma separated list."""
+        if "functional" not in d or "basis_set" not in d:
+            raise DFTRequestValidationException("The 'functional' and 'basis_set' query parameters are required.")
+        if d.get("format") not in STRUCTURE_FORMATS:
+            raise DFTRequestValidationException(f"'format' must be one of [{', '.join(STRUCTURE_FORMATS)}].")
+        try:
+            charge, spin_multiplicity = int(d.get("charge", 0)), int(d.get("spin_multiplicity", 1))
+        except ValueError:
+            raise DFTRequestValidationException("'charge' and 'spin_multiplicity' must be integers.") from None
+        if spin_multiplicity < 1:
+            raise DFTRequestValidationException("'spin_multiplicity' must be positive.")
+        if d.get("output", "jsonl") not in INGEST_OUTPUTS:
+            raise DFTRequestValidationException(f"'output' must be one of [{', '.join(INGEST_OUTPUTS)}].")
+        # the elements are checked record by record
+        capabilities().functional(d["functional"])
+        fields = d.get("fields")
+        config = FunctionalConfig(
+            functional=d["functional"], basis_set=d["basis_set"], ecp=d.get("ecp", "none")  # pyright: ignore
+        )
+        return IngestRequest(
+            config=config,
+            format=d["format"],  # pyright: ignore
+            charge=charge,
+            spin_multiplicity=spin_multiplicity,
+            fields=parse_fields(None if fields is None else fields.split(","), ENERGY_FIELDS, DEFAULT_ENERGY_FIELDS),
+            output=d.get("output", "jsonl"),  # pyright: ignore
+        )
+
+
+@dataclass
+class IngestResult:
+    """The outcome of one record of a structure file: its energy, or with
+    no calculation requested its molecule, or the error of either."""
+
+    # position in the file, from 0
+    index: int
+    # the comment line of an XYZ record or the name line of a molfile
+    title: str
+    result: SinglePointEnergyResponse | None = None
+    molecule: Molecule | None = None
+    error: str | None = None
+
+    def to_dict(self) -> dict:
+        d: dict = {"index": self.index, "title": self.title}
+        if self.result is not None:
+            d["result"] = self.result.to_dict()
+        if self.molecule is not None:
+            d["molecule"] = asdict(self.molecule)
+        if self.error is not None:
+            d["error"] = self.error
+        return d
+
+    @staticmethod
+    def from_dict(d: dict) -> IngestResult:
+        return IngestResult(
+            index=d["index"],
+            title=d["title"],
+            result=None if "result" not in d else SinglePointEnergyResponse.from_dict(d["result"]),
+            molecule=None if "molecule" not in d else Molecule.from_dict(d["molecule"]),
+            error=d.get("error"),
         )
@@ -0,0 +1,320 @@
+"""Reaction paths by the nudged elastic band (NEB) method.
+
+The band is a chain of images between a fixed reactant and product. It
+starts from the image dependent pair potential (IDPP) interpolation:
+every intermediate image is relaxed towards the interatomic distances
+interpolated between the ends, which keeps atoms from running through
+each other as they can in a linear interpolation of the positions.
+
+Every iteration evaluates the energies and gradients of all moving
+images at once, in parallel when given a ``map`` over worker processes,
+each SCF starting from the density of the same image one iteration
+earlier. The images then move along the NEB force with the FIRE
+optimizer: the true force perpendicular to the path plus the spring
+force along it, with the improved tangent of Henkelman and Jonsson. Once
+the band is roughly converged the highest image climbs: its spring force
+is dropped and its true force along the path reversed, so that it ends
+on the saddle point.
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from itertools import repeat
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+from pyscf.data.nist import BOHR
+from pyscf.dft import RKS, UKS
+
+from cloudcompchem.guess import prepare_guess
+from cloudcompchem.metrics import SCFCycleCounter
+from cloudcompchem.models import (
+    DEFAULT_NEB_SPRING,
+    FunctionalConfig,
+    Molecule,
+    ReactionPathProgress,
+    ReactionPathRequest,
+    ReactionPathResponse,
+)
+from cloudcompchem.rescue import rescue_scf
+from cloudcompchem.utils import M
+
+logger = logging.getLogger("cloudcompchem.neb")
+
+# the highest image starts climbing once the largest force is below this multiple of fmax
+CLIMB_FACTOR = 5.0
+# FIRE parameters (Bitzek et al. 2006) for positions in Bohr and forces in Hartree/Bohr
+FIRE_DT = 0.7
+FIRE_MAX_DT = 7.0
+# largest displacement of an atom in one step, in Bohr
+FIRE_MAX_STEP = 0.2
+FIRE_N_MIN = 5
+FIRE_F_INC = 1.1
+FIRE_F_DEC = 0.5
+FIRE_ALPHA = 0.1
+FIRE_F_ALPHA = 0.99
+# convergence of the IDPP interpolation, on a potential in Bohr^-2
+IDPP_FMAX = 1e-3
+IDPP_MAX_ITERATIONS = 1000
+
+Map = Callable[..., Iterable]
+
+
+@dataclass
+class ImageResult:
+    energy: float
+    # Hartree/Bohr, one row per atom
+    gradient: np.ndarray
+    converged: bool
+    scf_cycles: int
+    # the converged density, for the next iteration to start from
+    density: np.ndarray
+
+
+def evaluate_image(config: FunctionalConfig, molecule: Molecule, dm0: np.ndarray | None = None) -> ImageResult:
+    """Energy and gradient of one image, starting from the density ``dm0``
+    (the configured initial guess without one).
+
+    Nothing is kept between calls, so the images of an iteration can be
+    evaluated by any worker process.
+    """
+    mole = M(
+        atom=molecule.to_pyscf(),
+        basis=config.basis_set,
+        charge=molecule.charge,
+        # spin in pyscf is 2S not 2S+1
+        spin=molecule.spin_multiplicity - 1,
+        ecp=config.ecp,
+    )
+    fn = UKS if molecule.spin_multiplicity > 1 else RKS
+    calc = fn(mole)
+    calc.xc = config.functional
+    calc.callback = cycles = SCFCycleCounter()
+    if dm0 is None:
+        prepare_guess(calc, config, molecule)
+        dm0 = None if calc.mo_coeff is None else calc.make_rdm1()
+    calc.kernel(dm0=dm0)
+    if not calc.converged and config.scf_rescue:
+        calc, _ = rescue_scf(calc)
+    gradient = calc.nuc_grad_method().kernel()
+    return ImageResult(
+        energy=float(calc.e_tot),
+        gradient=gradient,
+        converged=bool(calc.converged),
+        scf_cycles=cycles.cycles,
+        density=calc.make_rdm1(),
+    )
+
+
+def align(reference: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """``positions`` rotated and translated onto ``reference`` (Kabsch),
+    so that the band does not spend its images on a rigid motion."""
+    centered, center = positions - positions.mean(axis=0), reference.mean(axis=0)
+    u, _, vt = np.linalg.svd(centered.T @ (reference - center))
+    # a proper rotation, not a reflection
+    d = np.sign(np.linalg.det(u @ vt))
+    return centered @ (u * [1, 1, d]) @ vt + center
+
+
+def _idpp_objective(
+    positions: np.ndarray, target: np.ndarray, i: np.ndarray, j: np.ndarray
+) -> tuple[float, np.ndarray]:
+    diff = positions[i] - positions[j]
+    d = np.linalg.norm(diff, axis=1)
+    residual, weight = target - d, d**-4
+    # the derivative of sum w (target - d)^2 with respect to every distance, then to the positions
+    dd = -2 * weight * residual - 4 * weight * residual**2 / d
+    pair = (dd / d)[:, None] * diff
+    gradient = np.zeros_like(positions)
+    np.add.at(gradient, i, pair)
+    np.add.at(gradient, j, -pair)
+    return float((weight * residual**2).sum()), gradient
+
+
+def idpp(reactant: np.ndarray, product: np.ndarray, n_images: int, spring: float = DEFAULT_NEB_SPRING) -> np.ndarray:
+    """The (n_images + 2, n_atoms, 3) IDPP path between two aligned
+    geometries.
+
+    The image dependent pair potential of an image is sum (d_t - d)^2 /
+    d^4 over its interatomic distances d, with d_t interpolated linearly
+    between the ends. Starting from the linear interpolation of the
+    positions, the band is relaxed on these potentials like on the real
+    one, so that the images stay spread along the path.
+    """
+    path = np.linspace(reactant, product, n_images + 2)
+    i, j = np.triu_indices(len(reactant), 1)
+    if not len(i):
+        return path
+    start = np.linalg.norm(reactant[i] - reactant[j], axis=1)
+    end = np.linalg.norm(product[i] - product[j], axis=1)
+    targets = np.linspace(start, end, n_images + 2)[1:-1]
+
+    optimizer = FIRE()
+    energies = np.zeros(n_images + 2)
+    for _ in range(IDPP_MAX_ITERATIONS):
+        values, gradients = zip(*(_idpp_objective(x, target, i, j) for x, target in zip(path[1:-1], targets)))
+        energies[1:-1] = values
+        forces = neb_forces(path, energies, np.array(gradients), spring)
+        if np.linalg.norm(forces, axis=-1).max() < IDPP_FMAX:
+            break
+        path[1:-1] = optimizer.step(path[1:-1], forces)
+    return path
+
+
+def tangents(path: np.ndarray, energies: np.ndarray) -> np.ndarray:
+    """Unit tangents of the intermediate images, pointing uphill
+    (the improved tangent of Henkelman and Jonsson, 2000)."""
+    result = []
+    for k in range(1, len(path) - 1):
+        forward, backward = path[k + 1] - path[k], path[k] - path[k - 1]
+        up, down = energies[k + 1] - energies[k], energies[k - 1] - energies[k]
+        if up > 0 > down:
+            tangent = forward
+        elif up < 0 < down:
+            tangent = backward
+        else:
+            larger, smaller = max(abs(up), abs(down)), min(abs(up), abs(down))
+            if energies[k + 1] > energies[k - 1]:
+                tangent = forward * larger + backward * smaller
+            else:
+                tangent = forward * smaller + backward * larger
+        result.append(tangent / np.linalg.norm(tangent))
+    return np.array(result)
+
+
+def neb_forces(
+    path: np.ndarray, energies: np.ndarray, gradients: np.ndarray, spring: float, climbing: int | None = None
+) -> np.ndarray:
+    """The NEB forces on the intermediate images of ``path``, given the
+    gradients of those images; ``climbing`` indexes ``path``."""
+    tau = tangents(path, energies)
+    forces = -gradients
+    along = np.einsum("kij,kij->k", forces, tau)[:, None, None]
+    lengths = np.linalg.norm((path[1:] - path[:-1]).reshape(len(path) - 1, -1), axis=1)
+    springs = (spring * (lengths[1:] - lengths[:-1]))[:, None, None] * tau
+    result = forces - along * tau + springs
+    if climbing is not None:
+        result[climbing - 1] = forces[climbing - 1] - 2 * along[climbing - 1] * tau[climbing - 1]
+    return result
+
+
+class FIRE:
+    """The fast inertial relaxation engine, moving all images as one
+    system (unit masses)."""
+
+    def __init__(self, dt: float = FIRE_DT, max_dt: float = FIRE_MAX_DT, max_step: float = FIRE_MAX_STEP):
+        self.dt, self.max_dt, self.max_step = dt, max_dt, max_step
+        self.alpha = FIRE_ALPHA
+        self.velocity: np.ndarray | None = None
+        self.downhill_steps = 0
+
+    def step(self, positions: np.ndarray, forces: np.ndarray) -> np.ndarray:
+        if self.velocity is None:
+            self.velocity = np.zeros_like(positions)
+        elif np.vdot(forces, self.velocity) > 0:
+            norm = np.linalg.norm(forces)
+            self.velocity = (1 - self.alpha) * self.velocity + self.alpha * forces / norm * np.linalg.norm(
+                self.velocity
+            )
+            if self.downhill_steps > FIRE_N_MIN:
+                self.dt = min(self.dt * FIRE_F_INC, self.max_dt)
+                self.alpha *= FIRE_F_ALPHA
+            self.downhill_steps += 1
+        else:
+            # uphill: stop and start over more carefully
+            self.velocity[:] = 0
+            self.alpha = FIRE_ALPHA
+            self.dt *= FIRE_F_DEC
+            self.downhill_steps = 0
+
+        self.velocity += self.dt * forces
+        displacement = self.dt * self.velocity
+        largest = np.linalg.norm(displacement, axis=-1).max()
+        if largest > self.max_step:
+            # the velocity too, or a single large force keeps pushing at the step limit
+            displacement *= self.max_step / largest
+            self.velocity *= self.max_step / largest
+        return positions + displacement
+
+
+def _image(template: Molecule, positions: np.ndarray) -> Molecule:
+    """A molecule like ``template`` at ``positions`` (Bohr)."""
+    return Molecule.from_dict(
+        {
+            "atoms": [
+                {"symbol": atom.symbol, "position": position}
+                for atom, position in zip(template.atoms, (positions * BOHR).tolist())
+            ],
+            "charge": template.charge,
+            "spin_multiplicity": template.spin_multiplicity,
+        }
+    )
+
+
+def reaction_path(
+    request: ReactionPathRequest, map_images: Map = map
+) -> Iterator[ReactionPathProgress | ReactionPathResponse]:
+    """Run a NEB job, yielding its progress after every iteration and its
+    response last.
+
+    ``map_images`` is called like ``map(evaluate_image, configs,
+    molecules, densities)`` once per iteration; the builtin ``map``
+    evaluates the images one after the other.
+    """
+    reactant = request.reactant.positions / BOHR
+    product = align(reactant, request.product.positions / BOHR)
+    path = idpp(reactant, product, request.images, request.spring)
+    logger.info(f"Starting a reaction path of {request.images} images between {len(path[0])} atom geometries")
+
+    n_images = len(path)
+    energies, gradients = np.zeros(n_images), np.zeros_like(path)
+    densities: list[np.ndarray | None] = [None] * n_images
+    # the ends are evaluated in the first iteration only
+    indices = list(range(n_images))
+    optimizer = FIRE()
+    climbing, converged, scf_cycles = None, False, 0
+    for iteration in range(1, request.max_iterations + 1):
+        results = map_images(
+            evaluate_image,
+            repeat(request.config),
+            [_image(request.reactant, path[k]) for k in indices],
+            [densities[k] for k in indices],
+        )
+        for k, result in zip(indices, results):
+            energies[k], gradients[k], densities[k] = result.energy, result.gradient, result.density
+            scf_cycles += result.scf_cycles
+            if not result.converged:
+                logger.warning(f"The SCF of image {k} did not converge in iteration {iteration}")
+        indices = list(range(1, n_images - 1))
+
+        forces = neb_forces(path, energies, gradients[1:-1], request.spring, climbing)
+        max_force = float(np.linalg.norm(forces, axis=-1).max())
+        if request.climbing and (climbing is not None or max_force < CLIMB_FACTOR * request.fmax):
+            # the highest image climbs, which may become another one as the band moves
+            highest = 1 + int(np.argmax(energies[1:-1]))
+            if highest != climbing:
+                climbing = highest
+                forces = neb_forces(path, energies, gradients[1:-1], request.spring, climbing)
+                max_force = float(np.linalg.norm(forces, axis=-1).max())
+
+        yield ReactionPathProgress(
+            iteration=iteration, energies=energies.tolist(), max_force=max_force, climbing_image=climbing
+        )
+        converged = max_force < request.fmax and (climbing is not None or not request.climbing)
+        if converged or iteration == request.max_iterations:
+            break
+        path[1:-1] = optimizer.step(path[1:-1], forces)
+
+    logger.info(f"Reaction path {'converged' if converged else 'did not converge'} after {iteration} iterations")
+    yield ReactionPathResponse(
+        images=[_image(request.reactant, positions) for positions in path],
+        energies=energies.tolist(),
+        converged=converged,
+        iterations=iteration,
+        max_force=max_force,
+        climbing_image=climbing,
+        barrier=float(energies.max() - energies[0]),
+        scf_cycles=scf_cycles,
+    )
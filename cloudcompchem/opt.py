@@ -1,74 +1,317 @@
+from __future__ import annotations
+
 import logging
+import os
+import tempfile
+import time
 
+import geometric.optimize
 import numpy as np
+from pyscf import gto, lib
 from pyscf.dft import RKS, UKS
+from pyscf.geomopt import geometric_solver
 from pyscf.geomopt.berny_solver import optimize as berny_opt
+from pyscf.geomopt.geometric_solver import NotConvergedError, PySCFEngine
 from pyscf.geomopt.geometric_solver import optimize as geomeTRIC_opt
 from pyscf.hessian import thermo
-from pyscf.hessian.rhf import Hessian
+from pyscf.scf.addons import project_mo_nr2nr
 
+from cloudcompchem.dft import orbital_list
+from cloudcompchem.ecp import assign
+from cloudcompchem.guess import prepare_guess, record_guess
+from cloudcompchem.metrics import (
+    HESSIAN_SECONDS,
+    MOL_BUILD_SECONDS,
+    OPT_STEPS,
+    OptStepTimer,
+    SCFCycleCounter,
+    config_labels,
+    size_bucket,
+    timed,
+)
 from cloudcompchem.models import (
     Atom,
     DFTOptRequest,
+    FunctionalConfig,
     Molecule,
-    Orbital,
+    OptStage,
     StructureRelaxationResponse,
+    TransitionStateConfig,
+    TransitionStateResult,
 )
-from cloudcompchem.utils import M
+from cloudcompchem.utils import M, frontier_orbitals, point_group
 
 optimizers = {"geomeTRIC": geomeTRIC_opt, "berny": berny_opt}
 
+# imaginary frequencies below this (in cm^-1) are numerical noise of the Hessian
+IMAGINARY_TOLERANCE = 10.0
+
 logger = logging.getLogger("cloudcompchem.opt")
 
 
 def run_dft_opt(dft_input: DFTOptRequest) -> StructureRelaxationResponse:
     """Method to run a DFT optimization on the initial request payload and
-    calculate frequencies."""
+    calculate frequencies.
+
+    With a pre-optimization configured, the geometry is first relaxed at
+    the cheap level and the target level starts from that geometry and
+    (projected) density.
+    """
     logger.info("Starting DFT optimization!")
+    molecule = dft_input.molecule
+    stages = []
 
     # Set up molecule
-    s = dft_input.molecule.spin_multiplicity - 1
-    mol = M(
-        atom=str(dft_input.molecule),
-        basis=dft_input.config.basis_set,
-        charge=dft_input.molecule.charge,
-        spin=s,
-    )
+    atom = molecule.to_pyscf()
+    guess = None
+    ts = dft_input.transition_state
+    search = None if ts is None else TransitionStateSearch(ts)
+    if dft_input.preopt is not None:
+        logger.info(f"Pre-optimizing at {dft_input.preopt.config.functional}/{dft_input.preopt.config.basis_set}")
+        calc, stage = _optimize_stage(
+            "preopt",
+            atom,
+            molecule,
+            dft_input.preopt.config,
+            dft_input.solver_config.solver,
+            dft_input.preopt,
+            search=search,
+        )
+        stages.append(stage)
+        atom = [(a[0], c) for a, c in zip(calc.mol._atom, calc.mol.atom_coords(unit="Angstrom"))]
+        guess = calc
+        if search is not None:
+            # the target level starts from the cheap Hessian at the cheap transition state
+            search.hessian = search.calculate_hessian(calc, config_labels(dft_input.preopt.config, molecule))
 
-    # Choose RKS or UKS based on spin multiplicity
-    fn = UKS if dft_input.molecule.spin_multiplicity > 1 else RKS
-    calc = fn(mol)
-    calc.xc = dft_input.config.functional
-
-    # Run geometry optimization
-    optimizer = optimizers[dft_input.solver_config.solver]
-    mol_eq = optimizer(method=calc, **dft_input.solver_config.conv_params)
-    energy = calc.kernel()
-    assert energy is not None
+    calc, stage = _optimize_stage(
+        "target",
+        atom,
+        molecule,
+        dft_input.config,
+        dft_input.solver_config.solver,
+        dft_input.solver_config,
+        guess,
+        search=search,
+    )
+    stages.append(stage)
+    mol_eq = calc.mol
 
-    # Frequency and Hessian calculation
-    hessian_calculator = Hessian(calc)
-    hessian_matrix = hessian_calculator.kernel()
-    frequencies = thermo.harmonic_analysis(mol, hess=hessian_matrix)
+    # Frequency and Hessian calculation (calc.Hessian() picks the RKS/UKS hessian including the XC kernel). By far
+    # the most expensive part for larger molecules, so skipped unless requested.
+    fields = dft_input.fields
+    hessian_matrix = frequencies = transition_state = None
+    if search is not None:
+        # a transition state is verified by its Hessian, which then serves the requested fields too
+        hessian_matrix = search.calculate_hessian(calc, config_labels(dft_input.config, molecule))
+        transition_state = search.verify(mol_eq, hessian_matrix)
+    if "hessian" in fields or "frequencies" in fields:
+        if hessian_matrix is None:
+            with timed(HESSIAN_SECONDS, **config_labels(dft_input.config, molecule)):
+                hessian_calculator = calc.Hessian()
+                hessian_matrix = hessian_calculator.kernel()
+        if "frequencies" in fields:
+            frequencies = thermo.harmonic_analysis(mol_eq, hess=hessian_matrix)
+        if "hessian" not in fields:
+            hessian_matrix = None
 
-    logger.info("Finished DFT optimization and frequency calculation!")
+    logger.info(f"Finished DFT optimization in {sum(s.steps for s in stages)} steps!")
 
     # Prepare response
-    list_of_atoms = [Atom(atom, tuple(np.round(position, 7))) for atom, position in mol_eq.atom]
-    charge, spin_multiplicity = dft_input.molecule.charge, dft_input.molecule.spin_multiplicity
+    # the optimizers leave the geometry in Bohr
+    list_of_atoms = [
+        Atom(symbol, tuple(np.round(position, 7)))
+        for (symbol, _), position in zip(mol_eq.atom, mol_eq.atom_coords(unit="Angstrom"))
+    ]
+    charge, spin_multiplicity = molecule.charge, molecule.spin_multiplicity
     response_mol = Molecule(list_of_atoms, spin_multiplicity=spin_multiplicity, charge=charge)
 
-    assert isinstance(calc.mo_energy, np.ndarray)
-    assert isinstance(calc.mo_occ, np.ndarray)
-
-    energies = map(float, calc.mo_energy)
-    occupancies = map(float, calc.mo_occ)
+    assert calc.mo_energy is not None and calc.mo_occ is not None
+    # unrestricted calculations hold the energies of each spin (a tuple when symmetry adapted)
+    mo_energy, mo_occ = np.asarray(calc.mo_energy), np.asarray(calc.mo_occ)
 
-    return StructureRelaxationResponse(
+    response = StructureRelaxationResponse(
         molecule=response_mol,
-        energy=energy,
+        energy=calc.e_tot,
         converged=calc.converged,
-        orbitals=[Orbital(energy=energy, occupancy=occ) for energy, occ in zip(energies, occupancies, strict=True)],
         hessian=hessian_matrix,
         frequencies=frequencies,
+        point_group=point_group(mol_eq),
+        stages=stages,
+        transition_state=transition_state,
+        ecp=assign(dft_input.config.basis_set, mol_eq.elements, dft_input.config.ecp) or None,
+    )
+    if "orbitals" in fields:
+        response.orbitals = orbital_list(mo_energy, mo_occ)
+    if "homo_lumo" in fields:
+        response.homo, response.lumo = frontier_orbitals(mo_energy, mo_occ)
+    return response
+
+
+def _optimize_stage(
+    name,
+    atom,
+    molecule: Molecule,
+    config: FunctionalConfig,
+    solver: str,
+    stage_config,
+    guess=None,
+    search: TransitionStateSearch | None = None,
+):
+    """Relax the geometry at one level of theory, to a transition state
+    when ``search`` is given.
+
+    Returns the SCF object converged at the final geometry, which is what
+    the optimizer's gradient scanner evaluated last, together with the
+    timing of the stage. ``guess`` is a converged SCF object (possibly in
+    a different basis) whose orbitals seed the first SCF.
+    """
+    start = time.perf_counter()
+    labels = config_labels(config, molecule)
+
+    with timed(MOL_BUILD_SECONDS, **labels):
+        mol = M(
+            atom=atom,
+            basis=config.basis_set,
+            # spin in pyscf is 2S not 2S+1
+            charge=molecule.charge,
+            spin=molecule.spin_multiplicity - 1,
+            # symmetrized steps would never leave the point group of the guess, which a saddle point may not have
+            symmetry=config.symmetry and search is None,
+            symmetry_tolerance=config.symmetry_tolerance,
+            ecp=config.ecp,
+        )
+
+    # Choose RKS or UKS based on spin multiplicity
+    fn = UKS if molecule.spin_multiplicity > 1 else RKS
+    calc = fn(mol)
+    calc.xc = config.functional
+    calc.callback = cycles = SCFCycleCounter()
+    if stage_config.scf_conv_tol is not None:
+        calc.conv_tol = stage_config.scf_conv_tol
+    init_guess = None
+    if guess is not None:
+        # the scanner starts from the density of the current orbitals
+        calc.mo_coeff = project_mo_nr2nr(guess.mol, guess.mo_coeff, mol)
+        calc.mo_occ = guess.mo_occ
+    else:
+        init_guess = prepare_guess(calc, config, molecule)
+
+    # Run geometry optimization
+    g_scanner = calc.nuc_grad_method().as_scanner()
+    step_timer = OptStepTimer(labels, cycles)
+    if search is None:
+        mol_eq = optimizers[solver](method=g_scanner, callback=step_timer, **stage_config.conv_params)
+    else:
+        mol_eq = search.run(g_scanner, step_timer, stage_config.conv_params)
+    OPT_STEPS.labels(solver=solver, size=size_bucket(mol.natm)).observe(step_timer.steps)
+    if init_guess is not None and step_timer.first_step_cycles is not None:
+        # the convergence of individual optimizer steps is not tracked
+        record_guess(init_guess, step_timer.first_step_cycles, True)
+
+    final = g_scanner.base
+    if not _same_geometry(final.mol, mol_eq):
+        final(mol_eq)
+
+    stage = OptStage(
+        name=name,
+        functional=config.functional,
+        basis_set=config.basis_set,
+        steps=step_timer.steps,
+        seconds=time.perf_counter() - start,
+        energy=float(final.e_tot),
+        converged=bool(final.converged),
+        init_guess="preopt" if init_guess is None else init_guess.strategy,
     )
+    logger.info(f"Stage {name} finished in {stage.steps} steps and {stage.seconds:.1f} seconds")
+    return final, stage
+
+
+def _same_geometry(mol: gto.Mole, other: gto.Mole) -> bool:
+    return mol.natm == other.natm and np.allclose(mol.atom_coords(), other.atom_coords(), atol=1e-10)
+
+
+class TransitionStateSearch:
+    """A geomeTRIC transition state search (``transition=True``) from a
+    given or analytic Hessian, over all stages of an optimization.
+
+    geomeTRIC only updates its Hessian from the gradients of each step,
+    which drifts as the geometry moves away from where the Hessian was
+    calculated. With ``recalc_hessian`` the search runs in chunks of that
+    many steps, each starting from an analytic Hessian at the geometry
+    the last one ended on.
+    """
+
+    def __init__(self, config: TransitionStateConfig):
+        self.config = config
+        # (n_atoms, n_atoms, 3, 3) Hessian to start the next stage from
+        self.hessian = config.hessian
+        self.hessians = 0
+
+    def calculate_hessian(self, calc, labels: dict[str, str]) -> np.ndarray:
+        """The analytic Hessian at the geometry of ``calc``, converging its
+        SCF first if needed."""
+        if not calc.converged:
+            calc.kernel(dm0=None if calc.mo_coeff is None else calc.make_rdm1())
+        with timed(HESSIAN_SECONDS, **labels):
+            hessian = calc.Hessian().kernel()
+        self.hessians += 1
+        return hessian
+
+    def run(self, g_scanner, step_timer: OptStepTimer, conv_params: dict) -> gto.Mole:
+        """Search from the geometry of ``g_scanner``; returns the final
+        geometry."""
+        steps = 0
+        hessian, self.hessian = self.hessian, None
+        with tempfile.TemporaryDirectory(dir=lib.param.TMPDIR) as tmpdir:
+            path = os.path.join(tmpdir, "hessian.txt")
+            while True:
+                if hessian is None:
+                    hessian = self.calculate_hessian(g_scanner.base, step_timer.labels)
+                natm = len(hessian)
+                np.savetxt(path, hessian.transpose(0, 2, 1, 3).reshape(3 * natm, 3 * natm))
+
+                budget = self.config.max_steps - steps
+                chunk = min(self.config.recalc_hessian or budget, budget)
+                evaluations = step_timer.steps
+                converged, mol = _run_geometric(
+                    g_scanner, step_timer, chunk + 1, transition=True, hessian=f"file:{path}", **conv_params
+                )
+                # every chunk first evaluates the geometry it starts from
+                steps += step_timer.steps - evaluations - 1
+                if converged or steps >= self.config.max_steps:
+                    if not converged:
+                        logger.warning(f"Transition state search not converged in {steps} steps")
+                    return mol
+                # the scanner's SCF is converged at the last geometry, which the next chunk starts from
+                logger.info(f"Recalculating the Hessian after {steps} steps")
+                hessian = None
+
+    def verify(self, mol: gto.Mole, hessian: np.ndarray) -> TransitionStateResult:
+        """Check that ``hessian`` (at ``mol``) has exactly one imaginary
+        frequency."""
+        frequencies = thermo.harmonic_analysis(mol, hessian)["freq_wavenumber"]
+        imaginary = sorted(float(f.imag) for f in np.atleast_1d(frequencies) if f.imag > IMAGINARY_TOLERANCE)
+        verified = len(imaginary) == 1
+        if not verified:
+            logger.warning(f"Expected one imaginary frequency at the transition state, found {len(imaginary)}")
+        return TransitionStateResult(verified=verified, imaginary_frequencies=imaginary, hessians=self.hessians)
+
+
+def _run_geometric(g_scanner, callback, maxsteps: int, **kwargs) -> tuple[bool, gto.Mole]:
+    """``pyscf.geomopt.geometric_solver.kernel``, which would replace a
+    Hessian file with its own analytic Hessian at the scanner's current
+    state. Returns whether geomeTRIC converged and the last geometry."""
+    engine = PySCFEngine(g_scanner)
+    engine.callback = callback
+    engine.maxsteps = maxsteps
+    engine.mol = g_scanner.mol.copy()
+    if not os.path.exists(os.path.join(os.path.dirname(geometric.optimize.__file__), "log.ini")):
+        kwargs.setdefault("logIni", os.path.join(os.path.dirname(geometric_solver.__file__), "log.ini"))
+
+    with tempfile.TemporaryDirectory(dir=lib.param.TMPDIR) as tmpdir:
+        try:
+            geometric.optimize.run_optimizer(customengine=engine, input=os.path.join(tmpdir, "opt"), **kwargs)
+        except NotConvergedError:
+            return False, engine.mol
+    return True, engine.mol
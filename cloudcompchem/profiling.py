@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Literal, get_args
+
+from cloudcompchem.utils import jsonable
+
+logger = logging.getLogger("cloudcompchem.profiling")
+
+ProfileMode = Literal["cprofile", "sampling"]
+
+PROFILE_MODES: tuple[ProfileMode, ...] = get_args(ProfileMode)
+
+_profiling_lock = threading.Lock()
+
+
+@dataclass
+class Profile:
+    """Handle to the artifacts of a single profiled call.
+
+    Everything lives in ``directory``: the profile itself
+    (``profile.pstats`` or ``stacks.collapsed``), the tracemalloc report
+    (``memory.txt``) and, once attached, the job result
+    (``result.json``).
+    """
+
+    id: str
+    mode: ProfileMode
+    directory: str
+    files: list[str] = field(default_factory=list)
+
+    def write(self, name: str, data: str | bytes):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb" if isinstance(data, bytes) else "w") as handle:
+            handle.write(data)
+        self.files.append(name)
+
+    def attach_result(self, result: dict):
+        """Store the job result next to the profile artifacts."""
+        self.write("result.json", json.dumps(result, default=jsonable, indent=2))
+
+
+class SamplingProfiler:
+    """Periodically samples the stack of one thread and aggregates the
+    samples into flamegraph-ready collapsed stacks (``frame;frame;frame
+    count``)."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cloudcompchem-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+
+@contextmanager
+def profiled(mode: ProfileMode, directory: str) -> Iterator[Profile]:
+    """Run the wrapped block under the requested profiler and tracemalloc,
+    writing the artifacts to a fresh sub-directory of ``directory``.
+
+    Callers should only enter this context when profiling was actually
+    requested so that unprofiled calls pay nothing. Concurrent profiled
+    calls run one at a time.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}', expected one of {', '.join(PROFILE_MODES)}.")
+
+    profile_id = uuid.uuid4().hex
+    profile = Profile(id=profile_id, mode=mode, directory=os.path.join(directory, profile_id))
+    os.makedirs(profile.directory, exist_ok=True)
+    logger.info(f"Profiling ({mode}) into {profile.directory}")
+
+    # cProfile and tracemalloc are process-wide, so profiled calls take turns
+    with _profiling_lock:
+        tracing_memory = tracemalloc.is_tracing()
+        if not tracing_memory:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        snapshot_before = tracemalloc.take_snapshot()
+
+        profiler = cProfile.Profile() if mode == "cprofile" else SamplingProfiler(threading.get_ident())
+        start = time.perf_counter()
+        if isinstance(profiler, cProfile.Profile):
+            profiler.enable()
+        else:
+            profiler.start()
+        try:
+            yield profile
+        finally:
+            if isinstance(profiler, cProfile.Profile):
+                profiler.disable()
+            else:
+                profiler.stop()
+            elapsed = time.perf_counter() - start
+
+            snapshot_after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if not tracing_memory:
+                tracemalloc.stop()
+
+            if isinstance(profiler, cProfile.Profile):
+                stats = pstats.Stats(profiler)
+                stats.dump_stats(os.path.join(profile.directory, "profile.pstats"))
+                profile.files.append("profile.pstats")
+                report = io.StringIO()
+                pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(50)
+                profile.write("profile.txt", report.getvalue())
+            else:
+                profile.write("stacks.collapsed", profiler.collapsed())
+
+            top = snapshot_after.compare_to(snapshot_before, "lineno")[:25]
+            memory_report = [f"wall time: {elapsed:.3f} s", f"peak traced memory: {peak / 2**20:.1f} MiB", ""]
+            memory_report += [str(stat) for stat in top]
+            profile.write("memory.txt", "\n".join(memory_report) + "\n")
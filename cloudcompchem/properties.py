@@ -0,0 +1,78 @@
+"""Molecular properties derived from a converged SCF object.
+
+Everything here reuses the density of the SCF that produced the energy,
+so requesting properties never runs a second SCF.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Callable
+
+import numpy as np
+from pyscf import gto
+from pyscf.scf.hf import SCF
+
+from cloudcompchem.metrics import PROPERTY_SECONDS, timed
+from cloudcompchem.models import Property
+
+logger = logging.getLogger("cloudcompchem.properties")
+
+
+def dipole(calc: SCF) -> list[float]:
+    """Dipole moment in Debye."""
+    return calc.dip_moment(unit="Debye", verbose=0).tolist()
+
+
+def mulliken_charges(calc: SCF) -> list[float]:
+    """Mulliken partial charges: nuclear (or ECP valence) charge minus the
+    diagonal of PS summed per atom."""
+    density, overlap = _total_density(calc), calc.get_ovlp()
+    populations = np.einsum("ij,ji->i", density, overlap)
+    return _atomic_charges(calc.mol, populations)
+
+
+def lowdin_charges(calc: SCF) -> list[float]:
+    """Löwdin partial charges, from the diagonal of S^1/2 P S^1/2."""
+    density, overlap = _total_density(calc), calc.get_ovlp()
+    eigenvalues, eigenvectors = np.linalg.eigh(overlap)
+    sqrt_overlap = (eigenvectors * np.sqrt(eigenvalues)) @ eigenvectors.T
+    populations = np.einsum("ij,jk,ki->i", sqrt_overlap, density, sqrt_overlap)
+    return _atomic_charges(calc.mol, populations)
+
+
+def gradient(calc: SCF) -> list[list[float]]:
+    """Analytic nuclear gradient in Hartree/Bohr, one row per atom."""
+    return calc.nuc_grad_method().kernel().tolist()
+
+
+# property name (and response attribute) -> function of the converged SCF object
+PROPERTIES: dict[Property, Callable[[SCF], object]] = {
+    "dipole": dipole,
+    "mulliken_charges": mulliken_charges,
+    "lowdin_charges": lowdin_charges,
+    "gradient": gradient,
+}
+
+
+def compute_properties(calc: SCF, properties: tuple[Property, ...]) -> dict[str, object]:
+    """Compute the requested properties, keyed by name."""
+    results = {}
+    for name in properties:
+        with timed(PROPERTY_SECONDS, property=name):
+            results[name] = PROPERTIES[name](calc)
+    return results
+
+
+def _total_density(calc: SCF) -> np.ndarray:
+    density = calc.make_rdm1()
+    # unrestricted calculations have one density per spin
+    return density.sum(axis=0) if density.ndim == 3 else density
+
+
+def _atomic_charges(mol: gto.Mole, populations: np.ndarray) -> list[float]:
+    # AO populations are summed per atom in a single bincount instead of looping over AO labels
+    ao_per_atom = mol.aoslice_by_atom()[:, 3] - mol.aoslice_by_atom()[:, 2]
+    ao_atoms = np.repeat(np.arange(mol.natm), ao_per_atom)
+    electrons = np.bincount(ao_atoms, weights=populations, minlength=mol.natm)
+    return (mol.atom_charges() - electrons).tolist()
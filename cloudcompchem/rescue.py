@@ -0,0 +1,95 @@
+"""Rescuing SCF calculations that do not converge.
+
+When the SCF of a job does not converge, the job climbs a ladder of
+increasingly robust (and expensive) convergence aids instead of failing:
+level shifting, damping, a larger DIIS space, second-order SCF and
+finally fractional occupations by Fermi smearing. Every step starts from
+the last density of the step before and gets its own cycle budget; the
+ladder stops at the first step that converges.
+
+Each step starts from a copy of the original SCF object, so the aids do
+not pile up. Smearing changes the problem rather than the solver: its
+energy is the free energy at the smearing temperature, with fractionally
+occupied orbitals.
+"""
+
+from __future__ import annotations
+
+import copy
+import logging
+from typing import Callable
+
+from pyscf.scf.addons import smearing
+from pyscf.scf.hf import SCF
+
+from cloudcompchem.metrics import SCF_RESCUES
+
+logger = logging.getLogger("cloudcompchem.rescue")
+
+# SCF cycles each step may take (for second-order SCF: macro iterations)
+RESCUE_CYCLES = 30
+# virtual orbital shift, in Hartree
+LEVEL_SHIFT = 0.5
+# fraction of the previous Fock matrix mixed into the next one
+DAMPING = 0.5
+DIIS_SPACE = 16
+# Fermi smearing width, in Hartree (about 0.27 eV)
+SMEARING_SIGMA = 0.01
+
+
+def _level_shift(calc: SCF) -> SCF:
+    calc.level_shift = LEVEL_SHIFT
+    return calc
+
+
+def _damping(calc: SCF) -> SCF:
+    calc.damp = DAMPING
+    # damping only applies before DIIS takes over
+    calc.diis_start_cycle = RESCUE_CYCLES // 2
+    return calc
+
+
+def _diis_space(calc: SCF) -> SCF:
+    calc.diis_space = DIIS_SPACE
+    return calc
+
+
+def _newton(calc: SCF) -> SCF:
+    return calc.newton()
+
+
+def _smearing(calc: SCF) -> SCF:
+    return smearing(calc, sigma=SMEARING_SIGMA, method="fermi")
+
+
+# step name -> function configuring a copy of the SCF object, in the order they are tried
+RESCUE_STEPS: dict[str, Callable[[SCF], SCF]] = {
+    "level_shift": _level_shift,
+    "damping": _damping,
+    "diis_space": _diis_space,
+    "newton": _newton,
+    "smearing": _smearing,
+}
+
+
+def rescue_scf(calc: SCF, max_cycle: int = RESCUE_CYCLES) -> tuple[SCF, list[str]]:
+    """Climb the rescue ladder for the unconverged SCF ``calc``.
+
+    Returns the SCF object of the last step tried, converged unless the
+    whole ladder failed, and the names of the steps tried. Callbacks of
+    ``calc`` (e.g. cycle counters) stay attached to every step.
+    """
+    path: list[str] = []
+    last = calc
+    for name, configure in RESCUE_STEPS.items():
+        if last.converged:
+            break
+        dm = last.make_rdm1()
+        step = configure(copy.copy(calc))
+        step.max_cycle = max_cycle
+        step.kernel(dm0=dm)
+        path.append(name)
+        SCF_RESCUES.labels(step=name, converged=str(bool(step.converged)).lower()).inc()
+        logger.info(f"SCF rescue step {name} {'converged' if step.converged else 'did not converge'}")
+        last = step
+    return last, path
@@ -0,0 +1,275 @@
+"""Signals for scaling workers horizontally, and draining them on shutdown.
+
+Every process tracks the calculations it runs in a ``Workload``, which
+publishes them in a few per-process gauges. Under gunicorn with
+``PROMETHEUS_MULTIPROC_DIR`` set, the multiprocess collector gathers
+these from every worker, so whichever worker serves ``/scaling`` reports
+on all of them. The report also includes the depth and age of the Celery
+queues in Redis.
+
+The running calculations are also measured in predicted core-seconds;
+queued Celery jobs only count towards the queue depth, as their messages
+do not say how large the calculation is. The cost model is rough:
+a single-threaded GGA SCF in this service takes about
+``CORE_SECONDS_PER_ATOM_FUNCTION`` per atom and basis function, since it
+is dominated by evaluating the basis functions on the integration grid.
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator
+
+from redis import Redis
+from redis.exceptions import RedisError
+
+from cloudcompchem import metrics
+from cloudcompchem.ecp import EcpMode, assign
+from cloudcompchem.exceptions import ServiceDrainingException
+from cloudcompchem.fragment import plan
+from cloudcompchem.metrics import (
+    BUSY_SECONDS,
+    JOB_SLOTS,
+    JOBS_RUNNING,
+    OLDEST_JOB_STARTED,
+    PUBLISHED_AT_HEADER,
+    RUNNING_CORE_SECONDS,
+    WORKER_DRAINING,
+)
+from cloudcompchem.models import (
+    DFTOptRequest,
+    EnergyRequest,
+    FunctionalConfig,
+    GradientRequest,
+    Molecule,
+    ReactionPathRequest,
+)
+from cloudcompchem.utils import load_basis, load_element_basis
+
+logger = logging.getLogger("cloudcompchem.scaling")
+
+CORE_SECONDS_PER_ATOM_FUNCTION = 0.01
+# a gradient costs about as much as the SCF before it
+GRADIENT_COST = 2.0
+# typical number of optimizer steps, each one an SCF plus gradient
+OPT_STEPS_ESTIMATE = 10
+# NEB iterations of a typical reaction path
+NEB_ITERATIONS_ESTIMATE = 50
+# an analytic Hessian costs about as much as a gradient per atom
+HESSIAN_COST_PER_ATOM = 2.0
+
+# celery's default queue
+QUEUES = ("celery",)
+
+
+def basis_functions(basis_set: str, molecule: Molecule, ecp: EcpMode = "none") -> int:
+    """The number of (spherical) basis functions of a molecule, with the
+    ECP basis sets of the heavy elements in the ``ecp`` mode."""
+    symbols = [atom.symbol for atom in molecule.atoms]
+    assignments = assign(basis_set, symbols, ecp)
+    basis = load_basis(basis_set, [symbol for symbol in symbols if symbol not in assignments])
+    basis.update({symbol: load_element_basis(a.basis_set, symbol) for symbol, a in assignments.items()})
+    per_element = {}
+    for symbol, shells in basis.items():
+        # each shell is [l, (exponent, coefficient, coefficient, ...), ...], with one coefficient per contraction
+        per_element[symbol] = sum((2 * shell[0] + 1) * (len(shell[-1]) - 1) for shell in shells)
+    return sum(per_element[atom.symbol] for atom in molecule.atoms)
+
+
+def scf_core_seconds(config: FunctionalConfig, molecule: Molecule) -> float:
+    try:
+        n_functions = basis_functions(config.basis_set, molecule, config.ecp)
+    except (RuntimeError, KeyError, IndexError):
+        # unknown basis sets fail validation later on
+        return 0.0
+    return CORE_SECONDS_PER_ATOM_FUNCTION * len(molecule.atoms) * n_functions
+
+
+def predict_core_seconds(request: object) -> float:
+    """Predicted cost of a parsed request, in core-seconds."""
+    if isinstance(request, EnergyRequest):
+        if request.fragmentation is not None:
+            # identical subsystems are calculated once
+            unique = {str(s.request.molecule): s.request for s in plan(request)[1]}
+            return sum(scf_core_seconds(r.config, r.molecule) for r in unique.values())
+        return scf_core_seconds(request.config, request.molecule)
+    if isinstance(request, GradientRequest):
+        return len(request.molecules) * GRADIENT_COST * scf_core_seconds(request.config, request.molecules[0])
+    if isinstance(request, DFTOptRequest):
+        scf = scf_core_seconds(request.config, request.molecule)
+        cost = OPT_STEPS_ESTIMATE * GRADIENT_COST * scf
+        hessians = int("hessian" in request.fields or "frequencies" in request.fields)
+        if (ts := request.transition_state) is not None:
+            # the Hessian verifying the transition state is also the requested one
+            hessians = 1 + (ts.hessian is None)
+            if ts.recalc_hessian:
+                hessians += (OPT_STEPS_ESTIMATE - 1) // ts.recalc_hessian
+        return cost + hessians * HESSIAN_COST_PER_ATOM * len(request.molecule.atoms) * scf
+    if isinstance(request, ReactionPathRequest):
+        scf = scf_core_seconds(request.config, request.reactant)
+        return (NEB_ITERATIONS_ESTIMATE * request.images + 2) * GRADIENT_COST * scf
+    return 0.0
+
+
+class Workload:
+    """The calculations running in this process.
+
+    ``slots`` is the number of calculations the process can run at once
+    (the number of gunicorn threads per worker). The gauges are only
+    published from the worker processes: gunicorn creates the workload in
+    its master, and prometheus starts the multiprocess values of a forked
+    process over from zero.
+    """
+
+    def __init__(self, slots: int = 1):
+        self.slots = slots
+        self.draining = False
+        # job id -> (start time, predicted core-seconds)
+        self._jobs: dict[int, tuple[float, float]] = {}
+        self._ids = itertools.count()
+        self._changed = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    @contextmanager
+    def track(self, endpoint: str, core_seconds: float) -> Iterator[None]:
+        """Account for a calculation while the block runs. Raises a
+        ServiceDrainingException once the process is draining."""
+        with self._changed:
+            if self.draining:
+                raise ServiceDrainingException("This worker is shutting down, please retry.")
+            job = next(self._ids)
+            self._jobs[job] = (time.time(), core_seconds)
+            self._publish()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            BUSY_SECONDS.labels(endpoint=endpoint).inc(time.perf_counter() - start)
+            with self._changed:
+                del self._jobs[job]
+                self._publish()
+                self._changed.notify_all()
+
+    def drain(self, timeout: float) -> bool:
+        """Stop accepting calculations and wait up to ``timeout`` seconds
+        for the running ones. Returns whether they all finished."""
+        with self._changed:
+            self.draining = True
+            self._publish()
+            return self._changed.wait_for(lambda: not self._jobs, timeout)
+
+    def publish(self):
+        """Publish the slots and load of this process, so that a worker
+        shows up in the scaling signals before its first calculation."""
+        with self._changed:
+            self._publish()
+
+    def _publish(self):
+        JOB_SLOTS.set(self.slots)
+        WORKER_DRAINING.set(int(self.draining))
+        jobs = self._jobs.values()
+        JOBS_RUNNING.set(len(jobs))
+        RUNNING_CORE_SECONDS.set(sum(core_seconds for _, core_seconds in jobs))
+        OLDEST_JOB_STARTED.set(min((started for started, _ in jobs), default=0))
+
+
+def worker_signals() -> list[dict]:
+    """The load of every live worker process, from the workload gauges."""
+    gauges = {
+        gauge.describe()[0].name: key
+        for gauge, key in (
+            (JOBS_RUNNING, "running"),
+            (JOB_SLOTS, "slots"),
+            (RUNNING_CORE_SECONDS, "running_core_seconds"),
+            (OLDEST_JOB_STARTED, "oldest_job_started"),
+            (WORKER_DRAINING, "draining"),
+        )
+    }
+    workers: dict[str, dict] = defaultdict(dict)
+    for family in metrics.registry().collect():
+        if family.name in gauges:
+            for sample in family.samples:
+                # the multiprocess collector labels the samples of every process with its pid
+                workers[sample.labels.get("pid", str(os.getpid()))][gauges[family.name]] = sample.value
+
+    now, signals = time.time(), []
+    for pid, values in sorted(workers.items()):
+        # prometheus creates the gauges of every process that imports them, such as the gunicorn
+        # master, but only workers publish their slots
+        if not values.get("slots"):
+            continue
+        running, slots = int(values.get("running", 0)), int(values["slots"])
+        started = values.get("oldest_job_started", 0)
+        signals.append(
+            {
+                "pid": pid,
+                "running": running,
+                "slots": slots,
+                "utilization": running / slots,
+                "running_core_seconds": values.get("running_core_seconds", 0.0),
+                "oldest_job_seconds": now - started if started else None,
+                "draining": bool(values.get("draining", 0)),
+            }
+        )
+    return signals
+
+
+def queue_signals(redis: Redis, queues: tuple[str, ...] = QUEUES) -> dict[str, dict]:
+    """Depth and age of the oldest message of the Celery queues.
+
+    kombu pushes messages on the left of a Redis list and workers pop
+    them from the right, so the oldest message is the last element.
+    """
+    signals = {}
+    for queue in queues:
+        try:
+            depth = redis.llen(queue)
+            oldest = redis.lindex(queue, -1) if depth else None
+        except RedisError as err:
+            logger.warning(f"Unable to read the depth of queue {queue}: {err}")
+            signals[queue] = {"depth": None, "oldest_job_seconds": None}
+            continue
+        published_at = _published_at(oldest) if oldest is not None else None
+        signals[queue] = {
+            "depth": depth,
+            "oldest_job_seconds": max(time.time() - published_at, 0.0) if published_at is not None else None,
+        }
+    return signals
+
+
+def _published_at(message: bytes) -> float | None:
+    """The publication time stamped on a queued Celery message, if any."""
+    try:
+        headers = json.loads(message).get("headers") or {}
+    except (ValueError, AttributeError):
+        return None
+    published_at = headers.get(PUBLISHED_AT_HEADER)
+    return float(published_at) if isinstance(published_at, (int, float)) else None
+
+
+def scaling_signals(redis: Redis | None, queues: tuple[str, ...] = QUEUES) -> dict:
+    """Everything an autoscaler needs, in one document."""
+    workers = worker_signals()
+    queue_stats = queue_signals(redis, queues) if redis is not None else {}
+    running, slots = sum(w["running"] for w in workers), sum(w["slots"] for w in workers)
+    ages = [w["oldest_job_seconds"] for w in workers] + [q["oldest_job_seconds"] for q in queue_stats.values()]
+    return {
+        "queues": queue_stats,
+        "queue_depth": sum(q["depth"] or 0 for q in queue_stats.values()),
+        "running": running,
+        "slots": slots,
+        "utilization": running / slots if slots else 0.0,
+        "running_core_seconds": sum(w["running_core_seconds"] for w in workers),
+        "oldest_job_seconds": max((age for age in ages if age is not None), default=None),
+        "workers": workers,
+    }
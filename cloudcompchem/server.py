@@ -1,38 +1,130 @@
 import argparse
 import logging
+import math
 import os
 import random
+import threading
+import time
 
 from celery import Celery, Task
-from flask import Flask, request
+from flask import Flask, Response, current_app, g, request
+from flask.json.provider import DefaultJSONProvider
 from gunicorn.app.base import BaseApplication
+from gunicorn.workers.gthread import ThreadWorker
+from prometheus_client import multiprocess
 from pysll import Constellation
+from redis import Redis
 
-from cloudcompchem.controllers import DFTController
+from cloudcompchem import compression, metrics
+from cloudcompchem.batching import MAX_BATCH_SIZE, MicroBatcher, default_workers
+from cloudcompchem.capabilities import capabilities
+from cloudcompchem.controllers import MAX_BODY_BYTES, SHUTDOWN_TIMEOUT, DFTController
+from cloudcompchem.profiling import PROFILE_MODES, ProfileMode
+from cloudcompchem.scaling import QUEUES, Workload
+from cloudcompchem.sessions import (
+    MAX_SESSIONS,
+    SESSION_IDLE_SECONDS,
+    SESSION_MAX_BYTES,
+    SessionStore,
+)
+from cloudcompchem.singleflight import LEASE_SECONDS, SingleFlight
 from cloudcompchem.tasks import add_together
+from cloudcompchem.utils import jsonable
 
 
-def create_app(constellation: Constellation | None = None) -> Flask:
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, extended to the numpy arrays (Hessians,
+    frequencies) found in calculation results."""
+
+    @staticmethod
+    def default(o: object) -> object:
+        try:
+            return jsonable(o)
+        except TypeError:
+            return DefaultJSONProvider.default(o)
+
+
+def create_app(constellation: Constellation | None = None, web_workers: int | None = None) -> Flask:
+    """The web application, for ``web_workers`` gunicorn worker processes
+    (default: ``WEB_CONCURRENCY``, which gunicorn reads as well)."""
     app = Flask(__name__)
+    app.json = JSONProvider(app)
 
     gunicorn_logger = logging.getLogger("gunicorn.error")
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
 
     # Configure the DFT controller
-    dft_controller = DFTController(app.logger, constellation or Constellation())
+    max_body_bytes = int(os.environ.get("CLOUDCOMPCHEM_MAX_BODY_BYTES", MAX_BODY_BYTES))
+    batch_window_ms = float(os.environ.get("CLOUDCOMPCHEM_BATCH_WINDOW_MS", 0))
+    web_workers = web_workers or int(os.environ.get("WEB_CONCURRENCY", 1))
+    redis_url = f"redis://{os.environ.get('CLOUDCOMPCHEM_REDIS_URL', 'localhost')}"
+    # connects on first use
+    redis = Redis.from_url(redis_url)
+    dft_controller = DFTController(
+        app.logger,
+        constellation or Constellation(),
+        profile_dir=os.environ.get("CLOUDCOMPCHEM_PROFILE_DIR", "profiles"),
+        profile_admins=frozenset(filter(None, os.environ.get("CLOUDCOMPCHEM_PROFILE_ADMINS", "").split(","))),
+        profile_mode=_profile_mode(),
+        max_body_bytes=max_body_bytes,
+        sessions=SessionStore(
+            max_sessions=int(os.environ.get("CLOUDCOMPCHEM_SESSION_MAX", MAX_SESSIONS)),
+            idle_seconds=float(os.environ.get("CLOUDCOMPCHEM_SESSION_IDLE_SECONDS", SESSION_IDLE_SECONDS)),
+            max_bytes=int(os.environ.get("CLOUDCOMPCHEM_SESSION_MAX_BYTES", SESSION_MAX_BYTES)),
+        ),
+        batcher=(
+            MicroBatcher(
+                window=batch_window_ms / 1000,
+                max_batch=int(os.environ.get("CLOUDCOMPCHEM_BATCH_MAX_SIZE", MAX_BATCH_SIZE)),
+                # every web worker runs its own pool, so the cores are shared out between them
+                workers=int(os.environ.get("CLOUDCOMPCHEM_BATCH_WORKERS", 0)) or default_workers(web_workers),
+            )
+            if batch_window_ms > 0
+            else None
+        ),
+        single_flight=_single_flight(redis),
+        workload=Workload(slots=int(os.environ.get("CLOUDCOMPCHEM_WORKER_THREADS", 1))),
+        redis=redis,
+        queues=tuple(filter(None, os.environ.get("CLOUDCOMPCHEM_SCALING_QUEUES", ",".join(QUEUES)).split(","))),
+        shutdown_timeout=float(os.environ.get("CLOUDCOMPCHEM_SHUTDOWN_TIMEOUT", SHUTDOWN_TIMEOUT)),
+    )
+    app.extensions["dft_controller"] = dft_controller
+    # index what the basis sets and functionals support before the first request is parsed
+    capabilities()
 
     app.add_url_rule("/health-check", "healthcheck", dft_controller.health_check, methods=["GET"])
     app.add_url_rule("/energy", "energy", dft_controller.simulate_energy, methods=["POST"])
     app.add_url_rule("/opt", "geom opt", dft_controller.geom_opt, methods=["POST"])
+    app.add_url_rule("/gradient", "gradient", dft_controller.gradient, methods=["POST"])
+    app.add_url_rule("/thermo", "thermo", dft_controller.thermochemistry, methods=["POST"])
+    app.add_url_rule("/reaction-path", "reaction path", dft_controller.reaction_path, methods=["POST"])
+    app.add_url_rule("/ingest", "ingest", dft_controller.ingest, methods=["POST"])
+    app.add_url_rule("/sessions", "session create", dft_controller.create_session, methods=["POST"])
+    app.add_url_rule(
+        "/sessions/<session_id>/evaluate", "session evaluate", dft_controller.evaluate_session, methods=["POST"]
+    )
+    app.add_url_rule("/sessions/<session_id>", "session close", dft_controller.close_session, methods=["DELETE"])
     app.add_url_rule("/aadd", "aadd", async_add, methods=["POST"])
     app.add_url_rule("/result/<id>", "result", result)
+    app.add_url_rule("/metrics", "metrics", prometheus_metrics, methods=["GET"])
+    app.add_url_rule("/scaling", "scaling", dft_controller.scaling, methods=["GET"])
+
+    app.before_request(_start_request_timer)
+    app.after_request(_observe_request)
+    app.after_request(_compress_response)
+    app.config["COMPRESS_MIN_BYTES"] = int(
+        os.environ.get("CLOUDCOMPCHEM_COMPRESS_MIN_BYTES", compression.COMPRESS_MIN_BYTES)
+    )
+
+    # werkzeug enforces the limit on bodies sent without a content length
+    app.config["MAX_CONTENT_LENGTH"] = max_body_bytes
 
     # celery
     app.config.from_mapping(
         CELERY=dict(
-            broker_url=f"redis://{os.environ.get('CLOUDCOMPCHEM_REDIS_URL', 'localhost')}",
-            result_backend=f"redis://{os.environ.get('CLOUDCOMPCHEM_REDIS_URL', 'localhost')}",
+            broker_url=redis_url,
+            result_backend=redis_url,
             task_ignore_result=True,
         ),
     )
@@ -42,6 +134,33 @@ def create_app(constellation: Constellation | None = None) -> Flask:
     return app
 
 
+def _profile_mode() -> ProfileMode | None:
+    """The mode ``CLOUDCOMPCHEM_PROFILE`` profiles every calculation in, if
+    any."""
+    mode = os.environ.get("CLOUDCOMPCHEM_PROFILE") or None
+    if mode is None:
+        return None
+    for profile_mode in PROFILE_MODES:
+        if mode == profile_mode:
+            return profile_mode
+    raise ValueError(f"CLOUDCOMPCHEM_PROFILE must be one of {', '.join(PROFILE_MODES)}, not '{mode}'.")
+
+
+def _single_flight(redis: Redis) -> SingleFlight | None:
+    """Request coalescing as configured by ``CLOUDCOMPCHEM_SINGLE_FLIGHT``:
+    ``local`` (the default) within each worker process, ``redis`` across
+    all workers sharing the Redis instance, or ``off``."""
+    mode = os.environ.get("CLOUDCOMPCHEM_SINGLE_FLIGHT", "local")
+    if mode == "off":
+        return None
+    if mode not in ("local", "redis"):
+        raise ValueError(f"CLOUDCOMPCHEM_SINGLE_FLIGHT must be one of local, redis or off, not '{mode}'.")
+    return SingleFlight(
+        redis=redis if mode == "redis" else None,
+        lease_seconds=float(os.environ.get("CLOUDCOMPCHEM_SINGLE_FLIGHT_LEASE_SECONDS", LEASE_SECONDS)),
+    )
+
+
 class FlaskApp(BaseApplication):
     def __init__(self, app, options=None):
         self.options = options or {}
@@ -57,18 +176,59 @@ class FlaskApp(BaseApplication):
         return self.application
 
 
+class DrainingWorker(ThreadWorker):
+    """gunicorn's threaded worker, publishing its workload once forked and
+    draining the running calculations as soon as it is asked to stop
+    (SIGTERM) rather than once its loop has ended."""
+
+    _drain: threading.Thread | None = None
+
+    def handle_exit(self, sig, frame):
+        self._start_drain()
+        super().handle_exit(sig, frame)
+
+    def run(self):
+        # the gauges of the workload only count from the worker process
+        self.wsgi.extensions["dft_controller"].publish_workload()
+        super().run()
+        # the loop also ends without a signal when the arbiter dies
+        self._start_drain()
+        assert self._drain is not None
+        self._drain.join()
+
+    def _start_drain(self):
+        # the drain waits for the running calculations, which a signal handler must not do
+        if self._drain is None:
+            self._drain = threading.Thread(target=self.wsgi.extensions["dft_controller"].shutdown, name="drain")
+            self._drain.start()
+
+
 def serve(args: argparse.Namespace):
+    app = create_app(web_workers=int(args.workers))
+    threads = int(os.environ.get("CLOUDCOMPCHEM_WORKER_THREADS", 1))
+    shutdown_timeout = float(os.environ.get("CLOUDCOMPCHEM_SHUTDOWN_TIMEOUT", SHUTDOWN_TIMEOUT))
     FlaskApp(
-        create_app(),
+        app,
         {
             "bind": args.bind,
             "workers": args.workers,
+            "threads": threads,
             "loglevel": os.environ.get("LOG_LEVEL", "INFO"),
             "timeout": 90,
+            # on SIGTERM gunicorn stops accepting connections and waits this long (whole seconds) for running requests
+            "graceful_timeout": math.ceil(shutdown_timeout),
+            "worker_class": "cloudcompchem.server.DrainingWorker",
+            "child_exit": _child_exit,
         },
     ).run()
 
 
+def _child_exit(server, worker):
+    # drop the live gauges (sessions, workload) of a worker that exited
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
+
+
 def celery_init_app(app: Flask) -> Celery:
     class FlaskTask(Task):
         def __call__(self, *args: object, **kwargs: object) -> object:
@@ -98,3 +258,38 @@ def result(id: str) -> dict[str, object]:
         "successful": result.successful(),
         "value": result.result if result.ready() else None,
     }
+
+
+def prometheus_metrics() -> Response:
+    payload, content_type = metrics.render()
+    return Response(payload, content_type=content_type)
+
+
+def _start_request_timer():
+    g.request_started_at = time.perf_counter()
+
+
+def _observe_request(response: Response) -> Response:
+    # flask endpoint names are fixed by the url rules, so they make bounded labels
+    endpoint = request.endpoint or "unknown"
+    if endpoint != "metrics":
+        metrics.REQUESTS.labels(endpoint=endpoint, status=str(response.status_code)).inc()
+        metrics.REQUEST_SECONDS.labels(endpoint=endpoint).observe(time.perf_counter() - g.request_started_at)
+    return response
+
+
+def _compress_response(response: Response) -> Response:
+    """Compress large responses with the best encoding the client
+    accepts."""
+    if response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.content_length is None or response.content_length < current_app.config["COMPRESS_MIN_BYTES"]:
+        return response
+
+    encoding = request.accept_encodings.best_match(compression.supported_encodings())
+    if encoding is None:
+        return response
+    response.set_data(compression.compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
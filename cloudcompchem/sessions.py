@@ -0,0 +1,198 @@
+"""Stateful calculation sessions for MD and optimizer drivers.
+
+A session keeps a live pyscf gradient scanner in the worker process that
+created it. Every step moves the atoms and re-runs the SCF starting from
+the previous density, reusing the basis setup and grid settings, so a
+step costs about one warm SCF instead of a full request.
+
+Sessions are local to a worker process: run the service with a single
+worker (and threads for concurrency) or route requests for a session to
+the same worker.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from pyscf.dft import RKS, UKS
+
+from cloudcompchem.exceptions import (
+    DFTRequestValidationException,
+    SessionNotFoundException,
+)
+from cloudcompchem.guess import prepare_guess, record_guess
+from cloudcompchem.metrics import (
+    GRADIENT_STEP_SECONDS,
+    MOL_BUILD_SECONDS,
+    SCF_CYCLES,
+    SESSION_EVICTIONS,
+    SESSIONS,
+    SCFCycleCounter,
+    config_labels,
+    timed,
+)
+from cloudcompchem.models import (
+    GradientRequest,
+    GradientResult,
+    SessionResponse,
+    SessionStepRequest,
+)
+from cloudcompchem.utils import M
+
+logger = logging.getLogger("cloudcompchem.sessions")
+
+MAX_SESSIONS = 32
+SESSION_IDLE_SECONDS = 600
+SESSION_MAX_BYTES = 4 * 2**30
+
+
+class Session:
+    """One live SCF, bound to the atoms, charge and spin it was created
+    with."""
+
+    def __init__(self, owner: str | None, request: GradientRequest):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.molecule = request.molecules[0]
+        self.labels = config_labels(request.config, self.molecule)
+        self.steps = 0
+        self.last_used = time.monotonic()
+        # one step at a time: the scanner is not thread safe
+        self.lock = threading.Lock()
+
+        with timed(MOL_BUILD_SECONDS, **self.labels):
+            mole = M(
+                atom=self.molecule.to_pyscf(),
+                basis=request.config.basis_set,
+                charge=self.molecule.charge,
+                # spin in pyscf is 2S not 2S+1
+                spin=self.molecule.spin_multiplicity - 1,
+                ecp=request.config.ecp,
+            )
+        fn = UKS if self.molecule.spin_multiplicity > 1 else RKS
+        calc = fn(mole)
+        calc.xc = request.config.functional
+        calc.callback = self.cycles = SCFCycleCounter()
+        self.guess = prepare_guess(calc, request.config, self.molecule)
+        self.scanner = calc.nuc_grad_method().as_scanner()
+
+    def evaluate(self, positions: np.ndarray, gradient: bool = True) -> GradientResult:
+        """Move the atoms to ``positions`` (Angstrom) and converge the SCF
+        from the previous density."""
+        if positions.shape != (len(self.molecule.atoms), 3):
+            raise DFTRequestValidationException(f"Expected positions for {len(self.molecule.atoms)} atoms.")
+
+        with self.lock:
+            cycles_before = self.cycles.cycles
+            with timed(GRADIENT_STEP_SECONDS, **self.labels):
+                if gradient:
+                    energy, grad = self.scanner(positions)
+                    grad = grad.tolist()
+                else:
+                    energy, grad = self.scanner.base(positions), None
+            scf_cycles = self.cycles.cycles - cycles_before
+            SCF_CYCLES.labels(**self.labels).observe(scf_cycles)
+            if self.steps == 0:
+                record_guess(self.guess, scf_cycles, bool(self.scanner.base.converged))
+            self.steps += 1
+            self.last_used = time.monotonic()
+
+        return GradientResult(
+            energy=float(energy), converged=bool(self.scanner.base.converged), gradient=grad, scf_cycles=scf_cycles
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the arrays of the SCF object and its grid
+        (orbitals, incore integrals, grid points)."""
+        calc = self.scanner.base
+        owners = (vars(calc), vars(calc.grids), vars(self.scanner))
+        return sum(value.nbytes for d in owners for value in d.values() if isinstance(value, np.ndarray))
+
+
+class SessionStore:
+    """The sessions of this worker process, least recently used first.
+
+    Sessions idle for longer than ``idle_seconds`` are closed, and the
+    least recently used ones are evicted while there are more than
+    ``max_sessions`` or their arrays take more than ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = MAX_SESSIONS,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+        max_bytes: int = SESSION_MAX_BYTES,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_bytes = max_bytes
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self, owner: str | None, request: GradientRequest) -> SessionResponse:
+        """Start a session and evaluate its initial geometry."""
+        session = Session(owner, request)
+        result = session.evaluate(session.molecule.positions)
+        with self._lock:
+            self._sessions[session.id] = session
+            SESSIONS.inc()
+            self._evict()
+        logger.info(f"Created session {session.id} ({session.nbytes / 2**20:.1f} MiB)")
+        return SessionResponse(session_id=session.id, result=result)
+
+    def evaluate(self, session_id: str, owner: str | None, step: SessionStepRequest) -> SessionResponse:
+        session = self._get(session_id, owner)
+        result = session.evaluate(step.positions, gradient=step.gradient)
+        with self._lock:
+            self._evict()
+        return SessionResponse(session_id=session.id, result=result)
+
+    def close(self, session_id: str, owner: str | None) -> SessionResponse:
+        session = self._get(session_id, owner)
+        with self._lock:
+            if self._sessions.pop(session.id, None) is not None:
+                SESSIONS.dec()
+        logger.info(f"Closed session {session.id} after {session.steps} steps")
+        return SessionResponse(session_id=session.id)
+
+    def _get(self, session_id: str, owner: str | None) -> Session:
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is None or session.owner != owner:
+                raise SessionNotFoundException(f"No session '{session_id}' in this worker.")
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def _evict(self):
+        """Drop idle sessions, then the least recently used ones while over
+        the limits. The most recently used session is always kept.
+
+        Must hold ``self._lock``.
+        """
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_used > self.idle_seconds:
+                self._drop(session_id, "idle")
+
+        total_bytes = sum(session.nbytes for session in self._sessions.values())
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or total_bytes > self.max_bytes):
+            session_id, session = next(iter(self._sessions.items()))
+            total_bytes -= session.nbytes
+            self._drop(session_id, "capacity")
+
+    def _drop(self, session_id: str, reason: str):
+        self._sessions.pop(session_id)
+        SESSIONS.dec()
+        SESSION_EVICTIONS.labels(reason=reason).inc()
+        logger.info(f"Evicted session {session_id} ({reason})")
@@ -0,0 +1,212 @@
+"""Single-flight execution of identical calculations.
+
+Clients retrying after a timeout, or several users submitting the same
+molecule at once, would otherwise run the same SCF several times in
+parallel. Requests are keyed by a hash of their canonical form, and while
+a calculation for a key is running, identical requests wait for it and
+receive its result instead of starting their own.
+
+Within a process, waiting requests attach to the future of the running
+calculation. Across processes (gunicorn workers, Celery workers) sharing
+a Redis instance, the running calculation holds a lease on the key that
+it renews while it runs, and publishes its result for the waiting
+requests to pick up. The lease of a process that crashed is no longer
+renewed and expires, after which one of the waiting requests takes over.
+If the calculation fails, the waiting requests run it themselves, and
+while Redis is unreachable calculations are only coalesced within the
+process.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from dataclasses import asdict
+from typing import Callable, TypeVar
+
+from redis import Redis
+from redis.exceptions import RedisError, WatchError
+
+from cloudcompchem.metrics import CACHE_REQUESTS
+from cloudcompchem.utils import jsonable
+
+logger = logging.getLogger("cloudcompchem.singleflight")
+
+LEASE_SECONDS = 30
+# results only need to outlive the polling of the waiting requests
+RESULT_TTL_SECONDS = 10
+POLL_SECONDS = 0.25
+
+KEY_PREFIX = "cloudcompchem:singleflight"
+
+
+Resp = TypeVar("Resp")
+
+
+def request_key(endpoint: str, request: object) -> str:
+    """Hash of the endpoint and a parsed request (a dataclass).
+
+    Requests that only differ in JSON formatting, key order or in writing
+    a coordinate as ``1`` or ``1.0`` get the same key.
+    """
+    payload = json.dumps(_canonical(asdict(request)), sort_keys=True, separators=(",", ":"), default=jsonable)
+    return hashlib.sha256(f"{endpoint}:{payload}".encode()).hexdigest()
+
+
+def _canonical(value: object) -> object:
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+class SingleFlight:
+    """Runs at most one calculation per key at a time, in this process
+    and, given a Redis client, across all processes using it."""
+
+    def __init__(
+        self,
+        redis: Redis | None = None,
+        lease_seconds: float = LEASE_SECONDS,
+        result_ttl: float = RESULT_TTL_SECONDS,
+        poll_seconds: float = POLL_SECONDS,
+    ):
+        self._redis = redis
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self.poll_seconds = poll_seconds
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, fn: Callable[[], Resp], decode: Callable[[dict], Resp]) -> Resp:
+        """Return the result of ``fn``, or of the identical calculation
+        already running for ``key``.
+
+        ``decode`` rebuilds a result published by another process from
+        its ``to_dict()``.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            CACHE_REQUESTS.labels(cache="singleflight", result="hit").inc()
+            logger.info(f"Attached to the running calculation {key[:12]}")
+            return future.result()
+
+        try:
+            if self._redis is None:
+                CACHE_REQUESTS.labels(cache="singleflight", result="miss").inc()
+                result = fn()
+            else:
+                result = self._run_shared(key, fn, decode)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _run_shared(self, key: str, fn: Callable[[], Resp], decode: Callable[[dict], Resp]) -> Resp:
+        assert self._redis is not None
+        lease_key, result_key = f"{KEY_PREFIX}:{key}:lease", f"{KEY_PREFIX}:{key}:result"
+        token = uuid.uuid4().hex
+
+        try:
+            published = self._acquire(key, lease_key, result_key, token)
+        except RedisError as err:
+            logger.warning(f"Redis unavailable, running calculation {key[:12]} without a lease: {err}")
+            CACHE_REQUESTS.labels(cache="singleflight", result="miss").inc()
+            return fn()
+        if published is not None:
+            CACHE_REQUESTS.labels(cache="singleflight", result="hit").inc()
+            logger.info(f"Received the result of calculation {key[:12]} from another worker")
+            return decode(json.loads(published))
+
+        CACHE_REQUESTS.labels(cache="singleflight", result="miss").inc()
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(lease_key, token, stop), daemon=True)
+        renewer.start()
+        try:
+            result = fn()
+            payload = json.dumps(result.to_dict(), default=jsonable)  # pyright: ignore
+            try:
+                self._redis.set(result_key, payload, px=int(self.result_ttl * 1000))
+            except RedisError as err:
+                logger.warning(f"Unable to publish the result of calculation {key[:12]}: {err}")
+            return result
+        finally:
+            stop.set()
+            renewer.join()
+            self._release(lease_key, token)
+
+    def _acquire(self, key: str, lease_key: str, result_key: str, token: str) -> bytes | None:
+        """Wait until either the lease is ours (returns None) or another
+        worker published the result (returns it)."""
+        assert self._redis is not None
+        waited = False
+        while True:
+            published = self._redis.get(result_key)
+            if published is None and self._redis.set(lease_key, token, nx=True, px=int(self.lease_seconds * 1000)):
+                # the result may have been published between the two calls
+                published = self._redis.get(result_key)
+                if published is None:
+                    return None
+                self._release(lease_key, token)
+            if published is not None:
+                return published
+            if not waited:
+                logger.info(f"Waiting for calculation {key[:12]} running in another worker")
+                waited = True
+            time.sleep(self.poll_seconds)
+
+    def _renew(self, lease_key: str, token: str, stop: threading.Event):
+        """Extend the lease every third of its duration until ``stop`` is
+        set."""
+        lease_ms = int(self.lease_seconds * 1000)
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                renewed = self._if_owner(lease_key, token, lambda pipe: pipe.pexpire(lease_key, lease_ms))
+            except RedisError as err:
+                logger.warning(f"Unable to renew the lease {lease_key}: {err}")
+                continue
+            if not renewed:
+                logger.warning(f"Lost the lease {lease_key}, identical requests may start their own calculation")
+                return
+
+    def _release(self, lease_key: str, token: str):
+        try:
+            self._if_owner(lease_key, token, lambda pipe: pipe.delete(lease_key))
+        except RedisError as err:
+            # the lease expires on its own
+            logger.warning(f"Unable to release the lease {lease_key}: {err}")
+
+    def _if_owner(self, lease_key: str, token: str, command: Callable) -> bool:
+        """Run ``command`` on a pipeline if ``token`` still holds the lease,
+        atomically with the check."""
+        assert self._redis is not None
+        with self._redis.pipeline() as pipe:
+            try:
+                pipe.watch(lease_key)
+                owner = pipe.get(lease_key)
+                if owner not in (token, token.encode()):
+                    return False
+                pipe.multi()
+                command(pipe)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
@@ -0,0 +1,111 @@
+"""Thermochemistry from a stored Hessian, over temperature and pressure
+grids.
+
+The partition functions are those of ``pyscf.hessian.thermo.thermo``
+(ideal gas, rigid rotor, harmonic oscillator), which evaluates one
+temperature and pressure per call. Here they are evaluated for whole
+grids at once with numpy broadcasting: the vibrational terms as a
+(temperatures, modes) array and the translational entropy, the only term
+that depends on the pressure, as a (temperatures, pressures) array. No
+electronic structure calculation is involved, the frequencies come from
+diagonalizing the mass-weighted Hessian once.
+"""
+
+from __future__ import annotations
+
+import logging
+
+import numpy as np
+from pyscf import gto
+from pyscf.data import nist
+from pyscf.hessian import thermo
+
+from cloudcompchem.models import ThermoRequest, ThermoResponse
+
+logger = logging.getLogger("cloudcompchem.thermochemistry")
+
+# gas constant per molecule, in Hartree/K
+R_EH = nist.BOLTZMANN / nist.HARTREE2J
+# frequencies in atomic units to Hz
+AU2HZ = (nist.HARTREE2J / (nist.ATOMIC_MASS * nist.BOHR_SI**2)) ** 0.5 / (2 * np.pi)
+
+
+def calculate_thermo(request: ThermoRequest) -> ThermoResponse:
+    """ZPE, internal energy, enthalpy, heat capacity, entropy and Gibbs
+    free energy for every temperature (and pressure)."""
+    molecule = request.molecule
+    # only the geometry and masses are needed, not a basis set
+    mol = gto.M(
+        atom=molecule.to_pyscf(),
+        basis="sto-3g",
+        charge=molecule.charge,
+        spin=molecule.spin_multiplicity - 1,
+        verbose=0,
+    )
+    modes = thermo.harmonic_analysis(mol, request.hessian)
+    frequencies = modes["freq_au"]
+    real = frequencies.real > 0
+    n_imaginary = int(modes["freq_error"])
+    if n_imaginary:
+        logger.warning(f"Leaving {n_imaginary} imaginary frequencies out of the thermochemistry")
+
+    mass = mol.atom_mass_list(isotope_avg=True)
+    coords = mol.atom_coords()
+    coords = coords - mass @ coords / mass.sum()
+    rotation = thermo.rotation_const(mass, coords, "GHz") * 1e9
+    rotor = thermo._get_rotor_type(rotation / 1e9)
+    symmetry_number = int(thermo.rotational_symmetry_number(mol))
+
+    temperatures, pressures = request.temperatures, request.pressures
+    t = temperatures[:, None]
+    kt = nist.BOLTZMANN * temperatures
+
+    # translation; q_trans = (2 pi m kT / h^2)^(3/2) kT / P, in logarithms to stay in range
+    mass_kg = mass.sum() * nist.ATOMIC_MASS
+    log_q_trans = (
+        1.5 * np.log(2 * np.pi * mass_kg * kt / nist.PLANCK**2)[:, None] + np.log(kt)[:, None] - np.log(pressures)
+    )
+    s_trans = R_EH * (2.5 + log_q_trans)
+
+    # rotation
+    if rotor == "ATOM":
+        s_rot = e_rot = cv_rot = np.zeros_like(temperatures)
+    elif rotor == "LINEAR":
+        s_rot = R_EH * (1 + np.log(kt / (symmetry_number * nist.PLANCK * rotation[1])))
+        e_rot, cv_rot = R_EH * temperatures, np.full_like(temperatures, R_EH)
+    else:
+        log_q_rot = 1.5 * np.log(kt / nist.PLANCK) + 0.5 * np.log(np.pi / np.prod(rotation)) - np.log(symmetry_number)
+        s_rot = R_EH * (1.5 + log_q_rot)
+        e_rot, cv_rot = 1.5 * R_EH * temperatures, np.full_like(temperatures, 1.5 * R_EH)
+
+    # vibration, one column per real mode
+    theta = frequencies.real[real] * AU2HZ * nist.PLANCK / nist.BOLTZMANN
+    zpe = R_EH * 0.5 * theta.sum()
+    x = theta / t
+    with np.errstate(over="ignore"):
+        occupation = 1 / np.expm1(x)
+    s_vib = R_EH * (x * occupation - np.log1p(-np.exp(-x))).sum(axis=1)
+    e_vib = zpe + R_EH * (theta * occupation).sum(axis=1)
+    cv_vib = R_EH * (x**2 * occupation * (1 + occupation)).sum(axis=1)
+
+    s_elec = R_EH * np.log(molecule.spin_multiplicity)
+    internal_energy = request.energy + 1.5 * R_EH * temperatures + e_rot + e_vib
+    # H = U + pV = U + kT for an ideal gas
+    enthalpy = internal_energy + R_EH * temperatures
+    entropy = s_trans + (s_elec + s_rot + s_vib)[:, None]
+    gibbs = enthalpy[:, None] - t * entropy
+
+    return ThermoResponse(
+        temperatures=temperatures.tolist(),
+        pressures=pressures.tolist(),
+        energy=request.energy,
+        zpe=float(zpe),
+        internal_energy=internal_energy.tolist(),
+        enthalpy=enthalpy.tolist(),
+        heat_capacity=(2.5 * R_EH + cv_rot + cv_vib).tolist(),
+        entropy=entropy.tolist(),
+        gibbs_free_energy=gibbs.tolist(),
+        frequencies=modes["freq_wavenumber"].real[real].tolist(),
+        imaginary_frequencies=n_imaginary,
+        symmetry_number=symmetry_number,
+    )
@@ -1,14 +1,37 @@
+import functools
+import importlib.util
 import logging
 import os
+from types import ModuleType
 
-from pyscf import gto
+import numpy as np
+from pyscf import gto, symm
+from pyscf.lib.exceptions import PointGroupSymmetryError
 from pyscf.lib.logger import CRIT, DEBUG, ERROR, NOTE, WARNING
+from pyscf.symm.param import OPERATOR_TABLE
+
+from cloudcompchem.ecp import EcpMode, assign
 
 logger = logging.getLogger("cloudcompchem")
 
+# default point group detection tolerance, in Bohr (same convention as pyscf.symm.geom.TOLERANCE). Loose
+# enough to see through coordinates that were rounded to 4 decimals in Angstrom.
+SYMMETRY_TOLERANCE = 1e-2
+
+LINEAR_SUBGROUPS = {"Dooh": "D2h", "Coov": "C2v"}
+
+
+def M(symmetry: bool = False, symmetry_tolerance: float = SYMMETRY_TOLERANCE, ecp: EcpMode = "none", **kwargs):
+    """A version of pyscf.gto.M that observes the root logger level.
 
-def M(**kwargs):
-    """A version of pyscf.gto.M that observes the root logger level."""
+    With ``symmetry=True`` the point group is detected within
+    ``symmetry_tolerance``, the geometry is symmetrized to that group
+    and the molecule is built with symmetry enabled. If no symmetry is
+    found, or pyscf cannot use it, the molecule is built in C1.
+
+    With ``ecp="auto"`` the elements past krypton get effective core
+    potentials and matching valence basis sets (see cloudcompchem.ecp).
+    """
 
     def verbose() -> int:
         pyscf_log_level = os.environ.get("PYSCF_LOG_LEVEL")
@@ -29,4 +52,140 @@ def M(**kwargs):
 
         return NOTE
 
-    return gto.M(**kwargs, verbose=verbose())
+    if isinstance(kwargs.get("basis"), str) and isinstance(kwargs.get("atom"), list):
+        symbols = [symbol for symbol, _ in kwargs["atom"]]
+        assignments = assign(kwargs["basis"], symbols, ecp)
+        basis = load_basis(kwargs["basis"], [symbol for symbol in symbols if symbol not in assignments])
+        for symbol, assignment in assignments.items():
+            basis[symbol] = load_element_basis(assignment.basis_set, symbol)
+        kwargs["basis"] = basis
+        if assignments:
+            kwargs["ecp"] = {symbol: assignment.ecp for symbol, assignment in assignments.items()}
+    mole = gto.M(**kwargs, verbose=verbose())
+    if symmetry:
+        mole = apply_symmetry(mole, symmetry_tolerance)
+    return mole
+
+
+def load_basis(basis: str, symbols: list[str]) -> dict[str, list]:
+    """The basis set ``basis`` for each of ``symbols``, in pyscf's dict
+    format.
+
+    Parsed basis sets are cached per process, so that building many
+    molecules in the same basis does not read and parse the basis set
+    file each time.
+    """
+    return {symbol: load_element_basis(basis, symbol) for symbol in set(symbols)}
+
+
+@functools.lru_cache(maxsize=1024)
+def load_element_basis(basis: str, symbol: str) -> list:
+    """The basis set ``basis`` of the element ``symbol``, from the cache
+    of ``load_basis``."""
+    # pyscf copies the basis while formatting it, so the cached lists are never modified
+    return gto.basis.load(basis, symbol)
+
+
+def basis_name(basis: str) -> str:
+    """A basis set name the way pyscf looks it up (``def2-SVP`` and
+    ``def2svp`` are the same basis)."""
+    return basis.lower().replace("-", "").replace("_", "").replace(" ", "")
+
+
+def jsonable(obj: object) -> object:
+    """JSON fallback for the numpy arrays and scalars found in
+    calculation results."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def frontier_orbitals(mo_energy: np.ndarray, mo_occ: np.ndarray) -> tuple[float | None, float | None]:
+    """HOMO and LUMO energies (Hartree), over both spin channels for
+    unrestricted calculations."""
+    energies, occupancies = np.ravel(mo_energy), np.ravel(mo_occ)
+    occupied, virtual = energies[occupancies > 0], energies[occupancies == 0]
+    homo = float(occupied.max()) if occupied.size else None
+    lumo = float(virtual.min()) if virtual.size else None
+    return homo, lumo
+
+
+def point_group(mole: gto.Mole) -> str:
+    """The point group a molecule was built with ("C1" without
+    symmetry)."""
+    return mole.topgroup if mole.symmetry else "C1"
+
+
+def apply_symmetry(mole: gto.Mole, tolerance: float = SYMMETRY_TOLERANCE) -> gto.Mole:
+    """Rebuild ``mole`` with point group symmetry, tolerating geometric
+    noise up to ``tolerance`` (Bohr).
+
+    The geometry is symmetrized to the largest subgroup pyscf can
+    exploit so that the symmetry holds exactly at pyscf's own (much
+    tighter) tolerance. Falls back to C1 when detection or the symmetric
+    build fails.
+    """
+    geom = _symmetry_detection(tolerance)
+    try:
+        topgroup, orig, axes = geom.detect_symm(mole._atom, mole._basis)
+        groupname, axes = geom.as_subgroup(topgroup, axes)
+    except PointGroupSymmetryError as err:
+        logger.warning(f"Point group detection failed, running in C1: {err}")
+        return mole
+
+    if groupname == "C1":
+        return mole
+    # linear molecules run in the abelian subgroup of their infinite group, which converges far more reliably
+    linear = groupname in LINEAR_SUBGROUPS
+    groupname = LINEAR_SUBGROUPS.get(groupname, groupname)
+
+    try:
+        coords = _symmetrize_coords(mole, groupname, orig, axes, tolerance)
+        symmetric = mole.copy()
+        symmetric.set_geom_(coords, unit="Bohr", symmetry=groupname if linear else True)
+    except (PointGroupSymmetryError, ValueError) as err:
+        logger.warning(f"Unable to use {topgroup} symmetry, running in C1: {err}")
+        return mole
+
+    logger.info(f"Detected point group {topgroup}, using {symmetric.groupname}")
+    return symmetric
+
+
+@functools.lru_cache(maxsize=8)
+def _symmetry_detection(tolerance: float) -> ModuleType:
+    """A copy of ``pyscf.symm.geom`` detecting point groups within
+    ``tolerance``.
+
+    pyscf reads its detection tolerance from the ``TOLERANCE`` global of
+    that module and takes no argument for it, so the copy has its own
+    rather than changing the one every other thread reads.
+    """
+    spec = importlib.util.find_spec("pyscf.symm.geom")
+    assert spec is not None and spec.loader is not None
+    geom = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(geom)
+    geom.TOLERANCE = tolerance
+    return geom
+
+
+def _symmetrize_coords(mole: gto.Mole, groupname: str, orig: np.ndarray, axes: np.ndarray, tolerance: float):
+    """Average the atomic positions over the operations of ``groupname``
+    so that the geometry is exactly symmetric."""
+    coords = (mole.atom_coords() - orig) @ axes.T
+    symbols = np.array([mole.atom_symbol(i) for i in range(mole.natm)])
+
+    symmetrized = np.zeros_like(coords)
+    operations = symm.symm_ops(groupname)
+    for name in OPERATOR_TABLE[groupname]:
+        image = coords @ np.asarray(operations[name] * np.eye(3))
+        distances = np.linalg.norm(image[:, None, :] - coords[None, :, :], axis=-1)
+        distances[symbols[:, None] != symbols[None, :]] = np.inf
+        mapping = distances.argmin(axis=1)
+        if distances[np.arange(mole.natm), mapping].max() > 10 * tolerance or len(set(mapping)) != mole.natm:
+            raise ValueError(f"geometry is not {groupname} symmetric within the tolerance")
+        symmetrized[mapping] += image
+
+    symmetrized /= len(OPERATOR_TABLE[groupname])
+    return symmetrized @ axes + orig
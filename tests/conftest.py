@@ -93,6 +93,7 @@ def expected_energy_response():
             {"energy": 3.32053671239125, "occupancy": 0.0},
             {"energy": 3.646663078270252, "occupancy": 0.0},
         ],
+        "point_group": "C2v",
     }
 
 
@@ -100,6 +101,7 @@ def mol_matcher(resp: SinglePointEnergyResponse, expected_response: dict):
 
     assert resp.converged is True
     assert isclose(resp.energy, expected_response["energy"])
+    assert resp.point_group == expected_response["point_group"]
     # make sure all orbital energies are close
     assert all(
         isclose(ex_orb["energy"], t_orb.energy) for ex_orb, t_orb in zip(expected_response["orbitals"], resp.orbitals)
@@ -0,0 +1,79 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from pyscf import gto
+from pysll import Constellation
+
+from cloudcompchem.batching import MicroBatcher, default_workers, is_small, run_batch
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.models import EnergyRequest, FunctionalConfig
+from cloudcompchem.server import create_app
+from cloudcompchem.utils import M, load_basis
+
+
+@pytest.fixture()
+def energy_requests(req_dict):
+    # water in a few geometries, plus one request pyscf will reject
+    requests = []
+    for scale in (1.0, 1.05, 1.1):
+        atoms = [atom | {"position": [x * scale for x in atom["position"]]} for atom in req_dict["molecule"]["atoms"]]
+        requests.append(EnergyRequest.from_dict(req_dict | {"molecule": req_dict["molecule"] | {"atoms": atoms}}))
+    # built directly, since parsing rejects unknown basis sets
+    requests.append(EnergyRequest(config=FunctionalConfig("pbe,pbe", "no-such-basis"), molecule=requests[0].molecule))
+    return requests
+
+
+def test_is_small(energy_requests, req_dict):
+    assert is_small(energy_requests[0])
+    assert not is_small(energy_requests[-1])
+
+    atoms = req_dict["molecule"]["atoms"] * 4
+    assert not is_small(EnergyRequest.from_dict(req_dict | {"molecule": req_dict["molecule"] | {"atoms": atoms}}))
+
+
+def test_run_batch(energy_requests):
+    results = run_batch(energy_requests)
+    expected = [calculate_energy(request).energy for request in energy_requests[:-1]]
+    assert [result.energy for result in results[:-1]] == expected  # pyright: ignore
+    assert isinstance(results[-1], RuntimeError)
+
+
+def test_micro_batcher(energy_requests):
+    batcher = MicroBatcher(window=0.5, workers=2)
+    try:
+        futures = [batcher.submit(request) for request in energy_requests]
+        for future, request in zip(futures[:-1], energy_requests):
+            assert np.isclose(future.result(timeout=120).energy, calculate_energy(request).energy, atol=1e-10)
+        with pytest.raises(RuntimeError):
+            futures[-1].result(timeout=120)
+    finally:
+        batcher.close()
+
+
+def test_web_workers_share_the_cores(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 16)
+    assert default_workers() == MicroBatcher().workers == 16
+    assert default_workers(4) == 4 and default_workers(32) == 1
+
+    monkeypatch.setenv("CLOUDCOMPCHEM_BATCH_WINDOW_MS", "20")
+    monkeypatch.setenv("WEB_CONCURRENCY", "8")
+    with patch("pysll.Constellation.me", return_value=None):
+        assert create_app(constellation=Constellation()).extensions["dft_controller"]._batcher.workers == 2
+        assert (
+            create_app(constellation=Constellation(), web_workers=4).extensions["dft_controller"]._batcher.workers == 4
+        )
+
+
+def test_micro_batcher_map():
+    batcher = MicroBatcher(workers=2)
+    try:
+        assert batcher.map(pow, [2, 3, 4], [2, 2, 2]) == [4, 9, 16]
+    finally:
+        batcher.close()
+
+
+def test_cached_basis_sets():
+    atom = [("O", [0, 0, 0]), ("H", [0, 1, 0]), ("H", [0, 0, 1])]
+    assert load_basis("ccpvdz", ["O", "H", "H"])["O"] is load_basis("ccpvdz", ["O"])["O"]
+    assert M(atom=atom, basis="ccpvdz")._basis == gto.M(atom=atom, basis="ccpvdz")._basis
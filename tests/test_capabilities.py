@@ -0,0 +1,106 @@
+import re
+from unittest.mock import patch
+
+import pytest
+
+from cloudcompchem.capabilities import CapabilityIndex, capabilities
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.ingest import calculate_energies, read_xyz
+from cloudcompchem.models import (
+    DFTOptRequest,
+    EnergyRequest,
+    FunctionalConfig,
+    GradientRequest,
+)
+
+HEADERS = {"Authorization": "Bearer abc123"}
+
+XENON_HYDRIDE = {
+    "atoms": [{"symbol": "Xe", "position": [0, 0, 0]}, {"symbol": "H", "position": [0, 0, 1.7]}],
+    "charge": 1,
+    "spin_multiplicity": 1,
+}
+
+HYDROXYL = {
+    "atoms": [{"symbol": "O", "position": [0, 0, 0]}, {"symbol": "H", "position": [0, 0, 0.97]}],
+    "charge": 0,
+    "spin_multiplicity": 2,
+}
+
+
+def _config(req_dict, **config):
+    return req_dict | {"config": req_dict["config"] | config}
+
+
+def test_index():
+    index = CapabilityIndex.build(["sto-3g", "def2-svp"], ["b3lyp", "wb97m_v", "b3lpy"], ["H", "O", "Xe", "Og"])
+    # keyed the way pyscf looks basis sets up
+    assert index.basis_elements == {"sto3g": frozenset({"H", "O"}), "def2svp": frozenset({"H", "O", "Xe"})}
+    assert set(index.functionals) == {"B3LYP", "WB97M_V"} and index.functionals["WB97M_V"].nlc
+    assert index.missing_elements("STO-3G", ["O", "Xe", "H"]) == ["Xe"]
+    assert index.missing_elements("DEF2_SVP", ["O", "Xe"]) == []
+    # basis sets outside the index are looked up on first use
+    assert index.missing_elements("cc-pvdz", ["O", "Xe"]) == ["Xe"]
+
+
+@pytest.mark.parametrize(
+    "change, message",
+    [
+        ({"basis_set": "6-31g*", "molecule": XENON_HYDRIDE}, "[Xe]"),
+        ({"basis_set": "no-such-basis"}, "no-such-basis"),
+        ({"functional": "b3lpy"}, "Unknown functional 'b3lpy'"),
+        ({"functional": " "}, "No exchange-correlation functional"),
+        ({"functional": 42}, "must be strings"),
+    ],
+)
+def test_unsupported_energy_requests(req_dict, change, message):
+    molecule = change.pop("molecule", req_dict["molecule"])
+    with pytest.raises(DFTRequestValidationException, match=re.escape(message)):
+        EnergyRequest.from_dict(_config(req_dict, **change) | {"molecule": molecule})
+
+
+@pytest.mark.parametrize("config", [{"basis_set": "def2-SVP"}, {"basis_set": "pc-1"}, {"functional": "B3LYP"}])
+def test_supported_energy_requests(req_dict, config):
+    EnergyRequest.from_dict(_config(req_dict, **config))
+
+
+def test_non_local_functionals(req_dict):
+    nlc = _config(req_dict, functional="wb97m_v") | {"solver": "geomeTRIC"}
+    # no Hessians, so no frequencies or transition states
+    with pytest.raises(DFTRequestValidationException, match="Hessians"):
+        DFTOptRequest.from_dict(nlc)
+    transition_state = {"fields": ["energy"], "transition_state": {}}
+    with pytest.raises(DFTRequestValidationException, match="Hessians"):
+        DFTOptRequest.from_dict(nlc | transition_state)
+    DFTOptRequest.from_dict(nlc | {"fields": ["energy"]})
+
+    # and no gradients of open shells
+    with pytest.raises(DFTRequestValidationException, match="open-shell"):
+        GradientRequest.from_dict(nlc | {"molecule": HYDROXYL})
+    with pytest.raises(DFTRequestValidationException, match="open-shell"):
+        EnergyRequest.from_dict(nlc | {"molecule": HYDROXYL, "properties": ["gradient"]})
+    EnergyRequest.from_dict(nlc | {"molecule": HYDROXYL})
+
+
+def test_rejected_before_dispatch(client, req_dict):
+    with patch("cloudcompchem.controllers.calculate_energy") as calculate:
+        payload = _config(req_dict, basis_set="sto-3g") | {"molecule": XENON_HYDRIDE}
+        response = client.post("/energy", json=payload, headers=HEADERS)
+    assert response.status_code == 400 and b"Xe" in response.data
+    calculate.assert_not_called()
+
+
+def test_ingested_records_are_checked():
+    records = read_xyz(b"2\nxenon hydride charge=1\nXe 0 0 0\nH 0 0 1.7\n".splitlines(keepends=True))
+    submit = patch("cloudcompchem.ingest.run_inline").start()
+    try:
+        ((record, result),) = calculate_energies(records, FunctionalConfig("pbe,pbe", "sto-3g"), submit)
+    finally:
+        patch.stopall()
+    assert record.molecule is None and "[Xe]" in record.error and result is None
+    submit.assert_not_called()
+
+
+def test_built_once():
+    assert capabilities() is capabilities()
+    assert {"sto3g", "def2svp", "ccpvdz"} <= set(capabilities().basis_elements)
@@ -0,0 +1,100 @@
+import io
+import json
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import requests
+from pysll import Constellation
+
+from cloudcompchem import compression
+from cloudcompchem.client import Client
+from cloudcompchem.models import SinglePointEnergyResponse
+
+
+@pytest.mark.parametrize("encoding", compression.supported_encodings())
+def test_roundtrip(encoding):
+    data = json.dumps({"hessian": np.arange(3000.0).tolist()}).encode()
+    compressed = compression.compress(data, encoding)
+    assert len(compressed) < len(data)
+    assert compression.decompress(compressed, encoding, len(data)) == data
+
+    # a body may not expand past the limit
+    with pytest.raises(OverflowError):
+        compression.decompress(compressed, encoding, len(data) - 1)
+
+
+@pytest.mark.parametrize("encoding", compression.supported_encodings())
+def test_streamed_roundtrip(encoding):
+    data = json.dumps({"hessian": np.arange(30000.0).tolist()}).encode()
+    chunks = [data[i : i + 4096] for i in range(0, len(data), 4096)]
+    compressed = b"".join(compression.compress_chunks(chunks, encoding))
+    reader = compression.decompressing_reader(io.BytesIO(compressed), encoding)
+    assert compression.decompress(compressed, encoding, len(data)) == data
+    assert b"".join(reader) == data
+
+
+def test_unsupported_encoding():
+    with pytest.raises(ValueError):
+        compression.compress(b"data", "br")
+    with pytest.raises(ValueError):
+        compression.decompress(b"not gzip", "gzip", 100)
+
+
+@pytest.mark.parametrize("encoding", compression.supported_encodings())
+def test_compressed_energy_request_and_response(client, req_dict, match_mol, expected_energy_response, encoding):
+    body = compression.compress(json.dumps(req_dict).encode(), encoding)
+    response = client.post(
+        "/energy",
+        data=body,
+        headers={
+            "Authorization": "Bearer abc123",
+            "Content-Type": "application/json",
+            "Content-Encoding": encoding,
+            "Accept-Encoding": "gzip, zstd",
+        },
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == compression.supported_encodings()[0]
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+    payload = compression.decompress(response.data, response.headers["Content-Encoding"], 2**20)
+    match_mol(SinglePointEnergyResponse.from_dict(json.loads(payload)), expected_energy_response)
+
+
+def test_small_responses_are_not_compressed(client):
+    response = client.get("/health-check", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_unsupported_request_encoding(client, req_dict):
+    response = client.post(
+        "/energy",
+        data=json.dumps(req_dict),
+        headers={"Authorization": "Bearer abc123", "Content-Type": "application/json", "Content-Encoding": "br"},
+    )
+    assert response.status_code == 415
+
+
+def test_numpy_responses(app):
+    assert json.loads(app.json.dumps({"hessian": np.eye(2), "zpe": np.float64(0.5)})) == {
+        "hessian": [[1.0, 0.0], [0.0, 1.0]],
+        "zpe": 0.5,
+    }
+
+
+def test_client_compresses_requests(req_dict, expected_energy_response):
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = json.dumps(expected_energy_response).encode()
+
+    with patch("pysll.Constellation.me", return_value=None), patch("requests.post", return_value=resp) as post:
+        client = Client(local=False, constellation=Constellation())
+        # pad the request past the compression threshold
+        client._post("/energy", req_dict | {"padding": "x" * compression.COMPRESS_MIN_BYTES})
+
+    headers = post.call_args.kwargs["headers"]
+    assert headers["Content-Encoding"] == "gzip"
+    assert "gzip" in headers["Accept-Encoding"]
+    body = compression.decompress(post.call_args.kwargs["data"], "gzip", 2**20)
+    assert json.loads(body)["molecule"] == req_dict["molecule"]
@@ -0,0 +1,88 @@
+import re
+
+import pytest
+
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.ecp import EcpAssignment, assign, valence_basis
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.models import DFTOptRequest, EnergyRequest, SinglePointEnergyResponse
+from cloudcompchem.opt import run_dft_opt
+from cloudcompchem.scaling import basis_functions
+from cloudcompchem.utils import M
+
+HEADERS = {"Authorization": "Bearer abc123"}
+
+
+@pytest.fixture()
+def xenon_dict():
+    """XeH+, closed shell, with a basis set that has no xenon."""
+    return {
+        "config": {"functional": "pbe,pbe", "basis_set": "6-31g*", "ecp": "auto"},
+        "molecule": {
+            "atoms": [{"symbol": "Xe", "position": [0, 0, 0]}, {"symbol": "H", "position": [0, 0, 1.65]}],
+            "charge": 1,
+            "spin_multiplicity": 1,
+        },
+        "fields": ["energy"],
+    }
+
+
+@pytest.mark.parametrize(
+    "basis_set, expected",
+    [("def2-TZVPP", "def2-TZVPP"), ("sto-3g", "def2-svp"), ("cc-pVTZ", "def2-tzvp"), ("6-311g**", "def2-tzvp")],
+)
+def test_valence_basis(basis_set, expected):
+    assert valence_basis(basis_set) == expected
+
+
+def test_assign():
+    assert assign("cc-pvdz", ["C", "Kr", "Pt", "Ce", "Pt"]) == {
+        "Pt": EcpAssignment(basis_set="def2-svp", ecp="def2-svp", core_electrons=60),
+        # no def2 basis set for the lanthanides
+        "Ce": EcpAssignment(basis_set="crenbl", ecp="crenbl", core_electrons=54),
+    }
+    assert assign("cc-pvdz", ["Pt"], "none") == {}
+
+
+def test_molecule_with_ecp(xenon_dict):
+    molecule = EnergyRequest.from_dict(xenon_dict).molecule
+    mole = M(atom=molecule.to_pyscf(), basis="6-31g*", charge=1, ecp="auto")
+    # less the 28 core electrons of xenon, which are in the ECP
+    assert mole.nelectron == 54 + 1 - 1 - 28
+    assert mole.has_ecp()
+    assert basis_functions("6-31g*", molecule, "auto") == mole.nao
+    # all-electron, in a basis set that covers xenon
+    assert M(atom=molecule.to_pyscf(), basis="3-21g", charge=1).nelectron == 54
+
+
+def test_unsupported_without_ecp(xenon_dict):
+    xenon_dict["config"]["ecp"] = "none"
+    with pytest.raises(DFTRequestValidationException, match=re.escape('[Xe]. Set "ecp": "auto"')):
+        EnergyRequest.from_dict(xenon_dict)
+
+    xenon_dict["config"]["ecp"] = "always"
+    with pytest.raises(DFTRequestValidationException, match="ecp must be one of"):
+        EnergyRequest.from_dict(xenon_dict)
+
+
+def test_energy_records_ecp(xenon_dict):
+    response = calculate_energy(EnergyRequest.from_dict(xenon_dict))
+    assert response.converged
+    assert response.ecp == {"Xe": EcpAssignment(basis_set="def2-svp", ecp="def2-svp", core_electrons=28)}
+    assert SinglePointEnergyResponse.from_dict(response.to_dict()) == response
+
+    # the light elements alone get no ECP
+    xenon_dict["molecule"]["atoms"][0]["symbol"] = "He"
+    assert calculate_energy(EnergyRequest.from_dict(xenon_dict)).ecp is None
+
+
+def test_energy_endpoint(client, xenon_dict):
+    response = client.post("/energy", json=xenon_dict, headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json["ecp"] == {"Xe": {"basis_set": "def2-svp", "ecp": "def2-svp", "core_electrons": 28}}
+
+
+def test_optimization_records_ecp(xenon_dict):
+    response = run_dft_opt(DFTOptRequest.from_dict(xenon_dict | {"solver": "geomeTRIC"}))
+    assert response.converged
+    assert set(response.ecp or {}) == {"Xe"}
@@ -0,0 +1,139 @@
+import json
+from argparse import Namespace
+from dataclasses import asdict
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.export import export, hill_formula, read_results, record_batches
+from cloudcompchem.models import (
+    DFTOptRequest,
+    EnergyRequest,
+    FunctionalConfig,
+    IngestResult,
+    Molecule,
+    StructureRelaxationResponse,
+)
+from cloudcompchem.opt import run_dft_opt
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+HEADERS = {"Authorization": "Bearer abc123"}
+
+XYZ = """3
+water
+O 0.0 0.0 0.1173
+H 0.0 0.7572 -0.4692
+H 0.0 -0.7572 -0.4692
+1
+odd electrons
+H 0.0 0.0 0.0
+"""
+
+QUERY = "format=xyz&functional=hf&basis_set=sto-3g"
+
+
+def test_hill_formula():
+    def molecule(*symbols):
+        atoms = [{"symbol": s, "position": [i, 0, 0]} for i, s in enumerate(symbols)]
+        return Molecule.from_dict({"atoms": atoms, "charge": 0, "spin_multiplicity": 1})
+
+    assert hill_formula(molecule("O", "H", "H")) == "H2O"
+    assert hill_formula(molecule("O", "C", "H", "H", "H", "H")) == "CH4O"
+    assert hill_formula(molecule("Na", "Cl")) == "ClNa"
+
+
+def test_record_batches(expected_energy_response, mol):
+    results = [IngestResult(i, f"water {i}", result=None, molecule=mol) for i in range(5)]
+    results.append(IngestResult(5, "failed", error="Invalid molecule."))
+    batches = list(record_batches(results, FunctionalConfig("hf", "sto-3g"), batch_size=2))
+    assert [batch.num_rows for batch in batches] == [2, 2, 2]
+
+    table = pa.Table.from_batches(batches)
+    assert table["formula"].to_pylist() == ["H2O"] * 5 + [None]
+    assert table["coordinates"].type == pa.list_(pa.list_(pa.float64(), 3))
+    assert np.allclose(table["coordinates"][0].as_py(), mol.positions)
+    assert table["error"].to_pylist()[-1] == "Invalid molecule." and table["energy"].null_count == 6
+    assert table["functional"].to_pylist() == ["hf"] * 6
+
+
+def test_open_shell_rows():
+    """The orbitals of both spins, and the optimized geometry in Angstrom."""
+    hydroxyl = {
+        "config": {"functional": "hf", "basis_set": "sto-3g"},
+        "molecule": {
+            "atoms": [{"symbol": "O", "position": [0, 0, 0]}, {"symbol": "H", "position": [0, 0, 1.1]}],
+            "charge": 0,
+            "spin_multiplicity": 2,
+        },
+    }
+    energy = calculate_energy(EnergyRequest.from_dict(hydroxyl))
+    relaxation = run_dft_opt(DFTOptRequest.from_dict(hydroxyl | {"solver": "geomeTRIC", "fields": ["orbitals"]}))
+    results = [IngestResult(0, "hydroxyl", result=energy), IngestResult(1, "hydroxyl", result=relaxation)]
+
+    table = pa.Table.from_batches(record_batches(results))
+    assert [len(energies) for energies in table["orbital_energies"].to_pylist()] == [12, 12]
+    assert sum(table["orbital_occupancies"][0].as_py()) == 9
+    (origin, hydrogen) = table["coordinates"][1].as_py()
+    assert 0.9 < np.linalg.norm(np.subtract(hydrogen, origin)) < 1.1
+
+
+def test_read_results(expected_energy_response, mol):
+    relaxation = {"molecule": asdict(mol), "energy": -76.0, "converged": True}
+    lines = [
+        json.dumps({"index": 0, "title": "water", "result": expected_energy_response}),
+        json.dumps({"summary": {"records": 1, "failed": 0}}),
+        json.dumps(expected_energy_response),
+        "",
+        json.dumps(relaxation),
+    ]
+    ingested, energy, relaxed = read_results(lines)
+    assert ingested.title == "water" and energy.result.energy == expected_energy_response["energy"]
+    assert isinstance(relaxed.result, StructureRelaxationResponse)
+
+    table = pa.Table.from_batches(record_batches([ingested, energy, relaxed]))
+    assert table["converged"].to_pylist() == [True, True, True]
+    # the optimized geometry of a relaxation, nothing for energies
+    assert table["formula"].to_pylist() == [None, None, "H2O"]
+    assert len(table["orbital_energies"][0]) == len(expected_energy_response["orbitals"])
+
+
+def test_export_command(tmp_path, expected_energy_response):
+    results = tmp_path / "results.jsonl"
+    lines = [json.dumps({"index": i, "title": "", "result": expected_energy_response}) for i in range(7)]
+    results.write_text("\n".join(lines))
+    output = tmp_path / "results.parquet"
+    export(Namespace(filename=str(results), output=str(output), format=None, functional=None, basis=None, batch_size=3))
+    parquet = pq.ParquetFile(output)
+    assert parquet.metadata.num_rows == 7 and parquet.metadata.num_row_groups == 3
+    assert parquet.read(columns=["index"])["index"].to_pylist() == list(range(7))
+
+
+@pytest.mark.parametrize("output", ["arrow", "parquet"])
+def test_ingest_columns(client, tmp_path, output):
+    response = client.post(f"/ingest?{QUERY}&output={output}", data=XYZ, headers=HEADERS)
+    assert response.status_code == 200
+    path = tmp_path / f"results.{output}"
+    path.write_bytes(response.data)
+    table = pq.read_table(path) if output == "parquet" else pa.ipc.open_stream(response.data).read_all()
+    assert table["title"].to_pylist() == ["water", "odd electrons"]
+    assert table["formula"].to_pylist() == ["H2O", None]
+    assert table["energy"][0].as_py() < 0 and table["error"][1].as_py()
+    assert table["basis_set"].to_pylist() == ["sto-3g"] * 2
+
+
+def test_columns_need_pyarrow(client):
+    with patch("cloudcompchem.export.pyarrow", None):
+        response = client.post(f"/ingest?{QUERY}&output=parquet", data=XYZ, headers=HEADERS)
+    assert response.status_code == 406
+
+
+def test_local_client(local_sdk_client, tmp_path):
+    path = tmp_path / "structures.xyz"
+    path.write_text(XYZ)
+    output = tmp_path / "energies.parquet"
+    local_sdk_client.export_energies_from_file(str(path), FunctionalConfig("hf", "sto-3g"), str(output))
+    assert pq.read_table(output)["formula"].to_pylist() == ["H2O", None]
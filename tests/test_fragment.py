@@ -0,0 +1,183 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from pyscf.lib.parameters import BOHR
+from pysll import Constellation
+
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.fragment import (
+    calculate_fragment_energy,
+    expansion,
+    find_fragments,
+    plan,
+)
+from cloudcompchem.models import EnergyRequest, Molecule
+from cloudcompchem.server import create_app
+
+WATER = [["O", [0, 0, 0]], ["H", [0.76, 0.59, 0]], ["H", [-0.76, 0.59, 0]]]
+
+
+def _request(atoms: list, **extra) -> dict:
+    return {
+        "config": {"functional": "pbe,pbe", "basis_set": "sto-3g"},
+        "molecule": {
+            "atoms": [{"symbol": s, "position": p} for s, p in atoms],
+            "charge": 0,
+            "spin_multiplicity": 1,
+        },
+        "fields": ["energy"],
+        "properties": ["gradient"],
+    } | extra
+
+
+def water_chain(n: int, spacing: float = 2.9) -> list:
+    """``n`` identical water molecules in a row."""
+    return [[s, [x + i * spacing, y, z]] for i in range(n) for s, (x, y, z) in WATER]
+
+
+def alkane(n: int) -> list:
+    """A zig-zag chain of ``n`` CH2 groups, capped with hydrogens at both
+    ends."""
+    atoms = []
+    for i in range(n):
+        side = 1 if i % 2 else -1
+        x, y = 1.26 * i, 0.44 * side
+        atoms += [["C", [x, y, 0.0]], ["H", [x, y + 0.63 * side, 0.89]], ["H", [x, y + 0.63 * side, -0.89]]]
+        if i in (0, n - 1):
+            atoms.append(["H", [x + (0.95 if i else -0.95), y + 0.51 * side, 0.0]])
+    return atoms
+
+
+def test_fragments():
+    waters = Molecule.from_dict(_request(water_chain(3))["molecule"])
+    assert find_fragments(waters, 20) == [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+
+    # CH3 and CH2 groups are held together, C-C bonds are cut between them
+    hexane = Molecule.from_dict(_request(alkane(6))["molecule"])
+    fragments = find_fragments(hexane, 7)
+    assert sorted(atom for fragment in fragments for atom in fragment) == list(range(20))
+    assert [len(fragment) for fragment in fragments] == [7, 6, 7]
+    assert find_fragments(hexane, 20) == [list(range(20))]
+
+
+def test_expansion_coefficients():
+    waters = Molecule.from_dict(_request(water_chain(3))["molecule"])
+    fragments = find_fragments(waters, 20)
+    assert expansion(waters, fragments, 1, 5.0) == {(0,): 1, (1,): 1, (2,): 1}
+    # the ends of the chain are too far apart to be paired
+    assert expansion(waters, fragments, 2, 3.0) == {(1,): -1, (0, 1): 1, (1, 2): 1}
+    # with every pair and the triple the expansion is the whole molecule
+    assert expansion(waters, fragments, 3, 10.0) == {(0, 1, 2): 1}
+
+
+def test_caps():
+    request = EnergyRequest.from_dict(_request(alkane(6), fragmentation={"order": 1, "max_fragment_atoms": 7}))
+    _, subsystems = plan(request)
+    middle = subsystems[1]
+    assert len(middle.caps) == 2
+    symbols = [atom.symbol for atom in middle.request.molecule.atoms]
+    assert symbols.count("C") == 2 and symbols.count("H") == 6
+    # caps sit at the C-H bond length
+    positions = middle.request.molecule.positions
+    for i, cap in enumerate(middle.caps):
+        kept = middle.atoms.index(cap.kept)
+        assert np.linalg.norm(positions[len(middle.atoms) + i] - positions[kept]) == pytest.approx(1.08, abs=0.02)
+
+
+def test_converges_to_the_full_calculation():
+    payload = _request(water_chain(3))
+    full = calculate_energy(EnergyRequest.from_dict(payload))
+
+    errors = []
+    for order in (1, 2, 3):
+        request = EnergyRequest.from_dict(payload | {"fragmentation": {"order": order, "cutoff": 10.0}})
+        result = calculate_fragment_energy(request)
+        assert result.converged
+        errors.append(abs(result.energy - full.energy))
+    assert errors[0] > errors[1] > 1e-8
+    # the triple is the whole molecule
+    assert errors[2] < 1e-8
+    assert np.allclose(result.gradient, full.gradient, atol=1e-6)
+
+
+def test_identical_subsystems_are_calculated_once():
+    request = EnergyRequest.from_dict(_request(water_chain(4), fragmentation={"order": 2, "cutoff": 3.0}))
+    calculated = []
+
+    def run(subsystem: EnergyRequest):
+        calculated.append(subsystem)
+        return calculate_energy(subsystem)
+
+    result = calculate_fragment_energy(request, run, workers=2)
+    # four translated copies of the same water and three of the same pair
+    assert result.fragmentation.fragments == 4
+    assert result.fragmentation.subsystems == 5
+    assert result.fragmentation.calculations == len(calculated) == 2
+
+
+def test_capped_gradient_matches_finite_differences():
+    payload = _request(alkane(4), fragmentation={"order": 1, "max_fragment_atoms": 7})
+    # Hartree-Fock, as DFT gradients leave out the response of the integration grid
+    payload["config"]["functional"] = "hf"
+    gradient = np.array(calculate_fragment_energy(EnergyRequest.from_dict(payload)).gradient)
+
+    # the first carbon carries a cap of the C-C bond that was cut
+    step, energies = 1e-3, []
+    for sign in (1, -1):
+        request = EnergyRequest.from_dict(payload)
+        request.molecule.positions[0, 0] += sign * step
+        energies.append(calculate_fragment_energy(request).energy)
+    # the gradient is per Bohr, positions are in Angstrom
+    assert gradient[0, 0] == pytest.approx((energies[0] - energies[1]) / (2 * step) * BOHR, abs=1e-5)
+
+
+@pytest.mark.parametrize(
+    "extra",
+    [
+        {"fragmentation": {"order": 4}},
+        {"fragmentation": {"cutoff": -1}},
+        {"fragmentation": {"unknown": 1}},
+        {"fragmentation": 3},
+        {"fragmentation": True, "fields": ["orbitals"]},
+        {"fragmentation": True, "properties": ["dipole"]},
+    ],
+)
+def test_invalid_fragmentation(extra):
+    with pytest.raises(DFTRequestValidationException):
+        EnergyRequest.from_dict(_request(water_chain(2)) | extra)
+
+
+def test_fragmentation_needs_a_closed_shell():
+    payload = _request(water_chain(2), fragmentation=True)
+    payload["molecule"] |= {"charge": 2, "spin_multiplicity": 1}
+    with pytest.raises(DFTRequestValidationException):
+        EnergyRequest.from_dict(payload)
+
+
+def test_fragmented_energy_endpoint(client):
+    # at order 2 the pair of two fragments is the whole molecule
+    response = client.post(
+        "/energy", json=_request(water_chain(2), fragmentation=True), headers={"Authorization": "Bearer abc123"}
+    )
+    assert response.status_code == 200
+    assert response.json["fragmentation"] == {"fragments": 2, "subsystems": 1, "calculations": 1}
+    assert len(response.json["gradient"]) == 6
+
+
+def test_fragments_run_on_the_batcher():
+    with patch("pysll.Constellation.me", return_value=None), patch.dict(
+        "os.environ", {"CLOUDCOMPCHEM_BATCH_WINDOW_MS": "50", "CLOUDCOMPCHEM_BATCH_WORKERS": "1"}
+    ):
+        app = create_app(constellation=Constellation())
+    payload = _request(water_chain(3), fragmentation={"cutoff": 3.0})
+    try:
+        response = app.test_client().post("/energy", json=payload, headers={"Authorization": "Bearer abc123"})
+    finally:
+        app.extensions["dft_controller"].shutdown()
+
+    assert response.status_code == 200
+    assert response.json["fragmentation"] == {"fragments": 3, "subsystems": 3, "calculations": 2}
+    expected = calculate_fragment_energy(EnergyRequest.from_dict(payload))
+    assert response.json["energy"] == pytest.approx(expected.energy, abs=1e-8)
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from cloudcompchem.dft import calculate_energy, calculate_gradients
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.models import EnergyRequest, GradientRequest, GradientResponse
+
+
+def _trajectory(req_dict: dict, n: int) -> list[dict]:
+    """``n`` frames stretching the first O-H bond."""
+    frames = []
+    for shift in np.linspace(0, 0.04, n):
+        molecule = req_dict["molecule"] | {"atoms": [dict(atom) for atom in req_dict["molecule"]["atoms"]]}
+        molecule["atoms"][1]["position"] = [0, 1 + shift, 0]
+        frames.append(molecule)
+    return frames
+
+
+def test_gradients_match_single_points(req_dict):
+    frames = _trajectory(req_dict, 3)
+    response = calculate_gradients(GradientRequest.from_dict({"config": req_dict["config"], "molecules": frames}))
+    assert len(response.results) == 3
+
+    config = req_dict["config"] | {"symmetry": False}
+    for frame, result in zip(frames, response.results):
+        expected = calculate_energy(
+            EnergyRequest.from_dict({"config": config, "molecule": frame, "properties": ["gradient"]})
+        )
+        assert result.converged
+        assert np.isclose(result.energy, expected.energy, atol=1e-8)
+        assert np.allclose(result.gradient, expected.gradient, atol=1e-5)  # pyright: ignore
+
+
+def test_warm_start(req_dict):
+    """Repeating a geometry converges right away from the previous
+    density."""
+    frames = [req_dict["molecule"]] * 2
+    response = calculate_gradients(GradientRequest.from_dict({"config": req_dict["config"], "molecules": frames}))
+    cold, warm = response.results
+    assert warm.scf_cycles < cold.scf_cycles
+    assert np.isclose(warm.energy, cold.energy, atol=1e-8)
+
+
+def test_mismatched_geometries(req_dict):
+    other = req_dict["molecule"] | {"charge": 2}
+    with pytest.raises(DFTRequestValidationException):
+        GradientRequest.from_dict({"config": req_dict["config"], "molecules": [req_dict["molecule"], other]})
+    with pytest.raises(DFTRequestValidationException):
+        GradientRequest.from_dict({"config": req_dict["config"], "molecules": []})
+
+
+def test_gradient_endpoint(client, req_dict):
+    response = client.post("/gradient", json=req_dict, headers={"Authorization": "Bearer abc123"})
+    assert response.status_code == 200
+    result = GradientResponse.from_dict(response.json).results[0]
+    assert result.converged and np.shape(result.gradient) == (3, 3)
@@ -0,0 +1,83 @@
+from unittest.mock import patch
+
+import pytest
+
+from cloudcompchem import guess
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.guess import STRATEGIES, GuessChoice, GuessStatistics
+from cloudcompchem.models import EnergyRequest
+
+
+@pytest.fixture()
+def radical_dict():
+    """The OH radical, open shell (UKS) and linear."""
+    return {
+        "config": {"functional": "pbe,pbe", "basis_set": "6-31g"},
+        "molecule": {
+            "atoms": [{"symbol": "O", "position": [0, 0, 0]}, {"symbol": "H", "position": [0, 0, 0.97]}],
+            "charge": 0,
+            "spin_multiplicity": 2,
+        },
+        "fields": ["energy"],
+    }
+
+
+def test_invalid_init_guess(req_dict):
+    with pytest.raises(DFTRequestValidationException):
+        EnergyRequest.from_dict(req_dict | {"config": req_dict["config"] | {"init_guess": "random"}})
+
+
+@pytest.mark.parametrize("init_guess", STRATEGIES)
+def test_guesses_converge_to_the_same_state(radical_dict, init_guess):
+    reference = calculate_energy(EnergyRequest.from_dict(radical_dict))
+    assert reference.converged and reference.point_group == "Coov"
+
+    radical_dict["config"]["init_guess"] = init_guess
+    result = calculate_energy(EnergyRequest.from_dict(radical_dict))
+    assert result.converged
+    assert result.init_guess == init_guess
+    assert result.scf_cycles is not None and 0 < result.scf_cycles < 50
+    assert result.energy == pytest.approx(reference.energy, abs=1e-7)
+
+
+def test_statistics_explore_then_pick_the_cheapest():
+    statistics = GuessStatistics(min_runs=2)
+    costs = {"minao": 12, "atom": 8, "huckel": 10, "project": 9}
+
+    for _ in range(2 * len(STRATEGIES)):
+        strategy = statistics.choose("group")
+        # project pays a quarter of its 8 minimal-basis cycles on top, 11 in total
+        statistics.record(GuessChoice(strategy, "group", 8 if strategy == "project" else 0), costs[strategy], True)
+
+    assert {s: v["runs"] for s, v in statistics.summary()["group"].items()} == dict.fromkeys(STRATEGIES, 2)
+    assert statistics.choose("group") == "atom"
+
+    # a failure to converge is expensive
+    for _ in range(2):
+        statistics.record(GuessChoice("atom", "group"), 50, False)
+    assert statistics.choose("group") == "huckel"
+    assert statistics.choose("other group") == "minao"
+
+
+def test_auto_learns_from_past_runs(radical_dict):
+    radical_dict["config"]["init_guess"] = "auto"
+    with patch.object(guess, "STATISTICS", GuessStatistics(min_runs=1)):
+        used = [calculate_energy(EnergyRequest.from_dict(radical_dict)).init_guess for _ in STRATEGIES]
+        assert used == list(STRATEGIES)
+        (group,) = guess.STATISTICS.summary().values()
+        best = min(group, key=lambda s: group[s]["mean_cost"])
+        assert calculate_energy(EnergyRequest.from_dict(radical_dict)).init_guess == best
+
+
+def test_auto_settles_when_project_fails(radical_dict):
+    radical_dict["config"]["init_guess"] = "auto"
+    with patch.object(guess, "STATISTICS", GuessStatistics(min_runs=1)), patch.object(
+        guess, "_project_minimal_basis", side_effect=RuntimeError("no minimal basis")
+    ):
+        used = [calculate_energy(EnergyRequest.from_dict(radical_dict)).init_guess for _ in range(len(STRATEGIES) + 2)]
+        # the failed projection falls back to minao, and counts as a project run that did not converge
+        (group,) = guess.STATISTICS.summary().values()
+        assert group["project"] == {"runs": 1, "mean_cost": guess.UNCONVERGED_PENALTY}
+        best = min(group, key=lambda s: group[s]["mean_cost"])
+        assert best != "project" and used[-2:] == [best, best]
@@ -0,0 +1,330 @@
+import gzip
+import json
+from argparse import Namespace
+from concurrent.futures import Future
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import requests
+from pysll import Constellation
+
+from cloudcompchem.client import Client
+from cloudcompchem.ingest import (
+    calculate_energies,
+    detect_format,
+    ingest,
+    mapped_lines,
+    read_sdf,
+    read_xyz,
+    run_inline,
+)
+from cloudcompchem.models import FunctionalConfig, IngestResult, Molecule
+
+HEADERS = {"Authorization": "Bearer abc123"}
+
+WATER_XYZ = """3
+water
+O 0.0 0.0 0.1173
+H 0.0 0.7572 -0.4692
+H 0.0 -0.7572 -0.4692
+"""
+
+XYZ = (
+    WATER_XYZ
+    + """2
+hydroxide charge=-1
+O 0.0 0.0 0.0
+H 0.0 0.0 0.97
+1
+odd electrons
+H 0.0 0.0 0.0
+
+2
+hydroxyl multiplicity=2
+O 0.0 0.0 0.0
+H 0.0 0.0 0.97
+2
+unknown element
+Xx 0.0 0.0 0.0
+H 0.0 0.0 1.0
+2
+helium hydride charge=1
+2 0.0 0.0 0.0
+1 0.0 0.0 0.77
+"""
+)
+
+MOLFILE = """{title}
+  handwritten
+
+  {n_atoms}  {n_bonds}  0  0  0  0  0  0  0  0999 V2000
+{atoms}
+{bonds}
+{properties}M  END
+$$$$
+"""
+
+
+def _molfile(title: str, atoms: list[str], bonds: list[str], properties: list[str] = ()) -> str:
+    return MOLFILE.format(
+        title=title,
+        n_atoms=len(atoms),
+        n_bonds=len(bonds),
+        atoms="\n".join(atoms),
+        bonds="\n".join(bonds),
+        properties="".join(p + "\n" for p in properties),
+    )
+
+
+O_ATOM = "    0.0000    0.0000    0.0000 O   0  {code}"
+H_ATOM = "    0.0000    0.0000    0.9700 H   0  0"
+
+SDF = (
+    _molfile(
+        "water",
+        [
+            "    0.0000    0.0000    0.1173 O   0  0",
+            "    0.0000    0.7572   -0.4692 H   0  0",
+            "    0.0000   -0.7572   -0.4692 H   0  0",
+        ],
+        ["  1  2  1  0", "  1  3  1  0"],
+    )
+    + _molfile("hydroxide", [O_ATOM.format(code=5), H_ATOM], ["  1  2  1  0"])
+    + _molfile("hydroxyl", [O_ATOM.format(code=5), H_ATOM], ["  1  2  1  0"], ["M  RAD  1   1   2"])
+    + _molfile("broken", ["    0.0000    0.0000    0.0000 Q   0  0"], [])
+    + _molfile("hydroxide again", [O_ATOM.format(code=0), H_ATOM], ["  1  2  1  0"], ["M  CHG  1   1  -1"])
+)
+
+
+OPEN_SHELL_XYZ = (
+    WATER_XYZ
+    + """2
+hydroxyl multiplicity=2
+O 0.0 0.0 0.0
+H 0.0 0.0 0.97
+"""
+)
+
+
+def _lines(text: str) -> list[bytes]:
+    return text.encode().splitlines(keepends=True)
+
+
+def test_read_xyz():
+    records = list(read_xyz(_lines(XYZ)))
+    assert [r.index for r in records] == list(range(6))
+    assert [r.title for r in records][:2] == ["water", "hydroxide charge=-1"]
+
+    water, hydroxide, odd, hydroxyl, unknown, hydride = records
+    assert water.molecule is not None and np.allclose(water.molecule.positions[0], [0, 0, 0.1173])
+    # the same molecule as sent in a JSON request
+    assert water.molecule == Molecule.from_dict(IngestResult(0, "water", molecule=water.molecule).to_dict()["molecule"])
+    assert hydroxide.molecule.charge == -1
+    assert odd.molecule is None and "spin" in odd.error
+    assert hydroxyl.molecule.spin_multiplicity == 2
+    assert unknown.molecule is None
+    # atomic numbers work in place of symbols
+    assert [atom.symbol for atom in hydride.molecule.atoms] == ["He", "H"]
+
+
+def test_read_xyz_defaults():
+    hydrogen = "1\nH atom\nH 0 0 0\n"
+    (record,) = read_xyz(_lines(hydrogen), charge=1)
+    assert record.molecule.charge == 1 and record.molecule.spin_multiplicity == 1
+    (record,) = read_xyz(_lines(hydrogen), spin_multiplicity=2)
+    assert record.molecule.charge == 0 and record.molecule.spin_multiplicity == 2
+
+
+@pytest.mark.parametrize(
+    "text, error",
+    [(WATER_XYZ + "not a count\nH 0 0 0\n" + WATER_XYZ, "number of atoms"), (WATER_XYZ + "2\ncut\nH 0 0 0\n", "of 2")],
+)
+def test_read_xyz_stops_when_records_are_lost(text, error):
+    water, lost = read_xyz(_lines(text))
+    assert water.molecule is not None
+    assert lost.molecule is None and error in lost.error
+
+
+def test_read_sdf():
+    water, hydroxide, hydroxyl, broken, again = read_sdf(_lines(SDF))
+    assert water.title == "water" and len(water.molecule.atoms) == 3
+    assert (water.molecule.charge, water.molecule.spin_multiplicity) == (0, 1)
+    # charge code 5 in the atom block
+    assert (hydroxide.molecule.charge, hydroxide.molecule.spin_multiplicity) == (-1, 1)
+    # M  RAD supersedes the charge of the atom block
+    assert (hydroxyl.molecule.charge, hydroxyl.molecule.spin_multiplicity) == (0, 2)
+    assert broken.molecule is None and broken.error
+    assert (again.molecule.charge, again.molecule.spin_multiplicity) == (-1, 1)
+
+
+def test_read_sdf_unknown_radical():
+    sdf = _molfile("quintet", [O_ATOM.format(code=0)], [], ["M  RAD  1   1   4"]) + SDF
+    quintet, water, *_ = read_sdf(_lines(sdf))
+    assert quintet.molecule is None and "radical value 4" in quintet.error
+    assert water.molecule is not None
+
+
+def test_mapped_lines(tmp_path):
+    path = tmp_path / "structures.xyz"
+    path.write_text(XYZ)
+    with mapped_lines(path) as lines:
+        assert [r.title for r in read_xyz(lines)] == [r.title for r in read_xyz(_lines(XYZ))]
+    empty = tmp_path / "empty.xyz"
+    empty.touch()
+    with mapped_lines(empty) as lines:
+        assert list(read_xyz(lines)) == []
+
+
+def test_detect_format():
+    assert detect_format("conformers.XYZ") == "xyz"
+    assert detect_format("library.sdf") == "sdf"
+    with pytest.raises(ValueError):
+        detect_format("protein.pdb")
+
+
+def test_calculate_energies_bounds_the_records_in_flight():
+    records = list(read_xyz(_lines(XYZ)))
+    submitted = []
+
+    def submit(request):
+        submitted.append(request.molecule)
+        future = Future()
+        future.set_result(len(submitted))
+        return future
+
+    outcomes = calculate_energies(records, FunctionalConfig("hf", "sto-3g"), submit, window=3)
+    record, result = next(outcomes)
+    # the window holds three records, of which the third is invalid
+    assert record.index == 0 and result == 1 and len(submitted) == 2
+    rest = list(outcomes)
+    # invalid records are passed through without a calculation
+    assert [result for _, result in rest] == [2, None, 3, None, 4]
+
+
+def test_calculate_energies():
+    records = list(read_xyz(_lines(XYZ)))[:3]
+    config = FunctionalConfig("hf", "sto-3g")
+    outcomes = list(calculate_energies(records, config, run_inline, window=2, fields=("energy",)))
+    assert [record.index for record, _ in outcomes] == [0, 1, 2]
+    (_, water), (_, hydroxide), (_, odd) = outcomes
+    assert water.energy < hydroxide.energy < 0 and water.orbitals is None
+    assert odd is None
+
+
+def test_ingest_endpoint(client):
+    response = client.post(
+        "/ingest?format=xyz&functional=hf&basis_set=sto-3g&fields=energy",
+        data=gzip.compress(XYZ.encode()),
+        headers=HEADERS | {"Content-Encoding": "gzip", "Content-Type": "chemical/x-xyz"},
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    *lines, summary = [json.loads(line) for line in response.data.decode().splitlines()]
+    results = [IngestResult.from_dict(line) for line in lines]
+    assert [r.index for r in results] == list(range(6))
+    assert [r.error is None for r in results] == [True, True, False, True, False, True]
+    assert results[0].result.energy < 0 and results[0].result.orbitals is None
+    assert summary == {"summary": {"records": 6, "failed": 2}}
+
+
+def test_ingest_open_shell_orbitals(client, tmp_path):
+    response = client.post(
+        "/ingest?format=xyz&functional=hf&basis_set=sto-3g&fields=energy,orbitals",
+        data=OPEN_SHELL_XYZ,
+        headers=HEADERS,
+    )
+    assert response.status_code == 200
+    *lines, summary = [json.loads(line) for line in response.data.decode().splitlines()]
+    water, hydroxyl = [IngestResult.from_dict(line).result for line in lines]
+    assert summary == {"summary": {"records": 2, "failed": 0}}
+    # the alpha, then the beta orbitals
+    assert len(water.orbitals) == 7 and len(hydroxyl.orbitals) == 12
+    assert all(isinstance(orbital["energy"], float) for orbital in lines[1]["result"]["orbitals"])
+
+    path = tmp_path / "structures.xyz"
+    path.write_text(OPEN_SHELL_XYZ)
+    output = tmp_path / "molecules.jsonl"
+    args = Namespace(
+        filename=str(path),
+        format=None,
+        functional="hf",
+        basis="sto-3g",
+        ecp="none",
+        charge=0,
+        multiplicity=1,
+        fields=["energy", "orbitals"],
+        workers=1,
+        output=str(output),
+        validate_only=False,
+    )
+    ingest(args)
+    assert [json.loads(line) for line in output.read_text().splitlines()] == lines
+
+
+@pytest.mark.parametrize(
+    "query, headers, status",
+    [
+        ("format=pdb&functional=hf&basis_set=sto-3g", {}, 400),
+        ("format=xyz&functional=hf", {}, 400),
+        ("format=xyz&functional=hf&basis_set=sto-3g&fields=hessian", {}, 400),
+        ("format=xyz&functional=hf&basis_set=sto-3g", {"Content-Encoding": "br"}, 415),
+    ],
+)
+def test_invalid_ingest_request(client, query, headers, status):
+    response = client.post(f"/ingest?{query}", data=WATER_XYZ, headers=HEADERS | headers)
+    assert response.status_code == status
+
+
+def test_ingest_command(tmp_path):
+    path = tmp_path / "library.sdf"
+    path.write_text(SDF)
+    output = tmp_path / "molecules.jsonl"
+    args = Namespace(
+        filename=str(path),
+        format=None,
+        functional="hf",
+        basis="sto-3g",
+        ecp="none",
+        charge=0,
+        multiplicity=1,
+        fields=["energy"],
+        workers=1,
+        output=str(output),
+        validate_only=True,
+    )
+    ingest(args)
+    results = [IngestResult.from_dict(json.loads(line)) for line in output.read_text().splitlines()]
+    assert [r.title for r in results] == ["water", "hydroxide", "hydroxyl", "broken", "hydroxide again"]
+    assert results[1].molecule.charge == -1 and results[3].error and results[3].molecule is None
+
+    ingest(Namespace(**vars(args) | {"validate_only": False}))
+    results = [IngestResult.from_dict(json.loads(line)) for line in output.read_text().splitlines()]
+    assert results[0].result.energy < 0 and results[3].result is None
+
+
+def test_local_client(local_sdk_client, tmp_path):
+    path = tmp_path / "structures.xyz"
+    path.write_text(XYZ)
+    config = FunctionalConfig("hf", "sto-3g")
+    results = list(local_sdk_client.energies_from_file(str(path), config, fields=("energy",)))
+    assert [r.index for r in results] == list(range(6))
+    assert results[1].result.energy < 0 and results[2].error and results[2].result is None
+
+
+def test_client_streams_the_file(client, tmp_path):
+    path = tmp_path / "structures.xyz"
+    path.write_text(XYZ)
+
+    def post(url, data, headers, params, stream):
+        assert headers["Content-Encoding"] == "gzip"
+        served = client.post("/ingest", query_string=params, data=b"".join(data), headers=headers)
+        resp = requests.Response()
+        resp.status_code, resp._content, resp._content_consumed = served.status_code, served.data, True
+        return resp
+
+    with patch("pysll.Constellation.me", return_value=None), patch("requests.post", side_effect=post):
+        sdk_client = Client(local=False, constellation=Constellation())
+        results = list(sdk_client.energies_from_file(str(path), FunctionalConfig("hf", "sto-3g"), fields=("energy",)))
+    assert [r.index for r in results] == list(range(6))
+    assert results[0].result.energy < 0 and results[2].error
@@ -0,0 +1,26 @@
+from math import isclose
+
+import pytest
+
+from cloudcompchem.loadtest import parse_mix, summarize, water_cluster
+from cloudcompchem.models import Molecule
+
+
+def test_parse_mix():
+    assert parse_mix("small=3,large=1") == {"small": 3.0, "large": 1.0}
+    assert parse_mix("medium") == {"medium": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("huge=1")
+
+
+def test_water_cluster_is_valid():
+    assert len(Molecule.from_dict(water_cluster(4)).atoms) == 12
+
+
+def test_summarize():
+    latencies = [i / 100 for i in range(1, 101)]
+    result = summarize(latencies, errors=5, duration=10, concurrency=4, workers=2, threads=1)
+    assert result.requests == 100
+    assert isclose(result.throughput, 10)
+    assert isclose(result.error_rate, 0.05)
+    assert result.p50 < result.p95 < result.p99 <= 1
@@ -0,0 +1,29 @@
+from cloudcompchem.metrics import basis_label, functional_label, size_bucket
+
+
+def test_size_bucket():
+    assert size_bucket(1) == "1-5"
+    assert size_bucket(5) == "1-5"
+    assert size_bucket(6) == "6-20"
+    assert size_bucket(250) == "101-250"
+    assert size_bucket(10_000) == "251+"
+
+
+def test_labels_are_bounded():
+    """User supplied strings are folded into a known set of label values."""
+    assert functional_label("PBE,PBE") == "pbe,pbe"
+    assert functional_label("cam-b3lyp") == "camb3lyp"
+    assert functional_label("some-made-up-functional") == "other"
+    assert basis_label("cc-pVDZ") == "ccpvdz"
+    assert basis_label("def2_svp") == "def2svp"
+    assert basis_label("cat") == "other"
+
+
+def test_metrics_endpoint(client, req_dict):
+    client.post("/energy", json=req_dict, headers={"Authorization": "Bearer abc123"})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    body = response.data.decode()
+    assert 'cloudcompchem_scf_seconds_count{basis="ccpvdz",converged="true",functional="pbe,pbe",size="1-5"}' in body
+    assert 'cloudcompchem_requests_total{endpoint="energy",status="200"}' in body
+    assert "cloudcompchem_auth_seconds" in body
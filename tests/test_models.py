@@ -1,6 +1,7 @@
 from copy import deepcopy
 from dataclasses import asdict
 
+import numpy as np
 import pytest
 
 from cloudcompchem.exceptions import DFTRequestValidationException
@@ -10,6 +11,7 @@ from cloudcompchem.models import (
     Molecule,
     SinglePointEnergyResponse,
 )
+from cloudcompchem.utils import SYMMETRY_TOLERANCE
 
 
 def test_atom_deserialize():
@@ -62,6 +64,32 @@ def test_invalid_molecule_deserialization():
         )
 
 
+@pytest.mark.parametrize(
+    "atoms",
+    [
+        [{"symbol": "Xx", "position": [0, 0, 0]}],  # unknown element
+        [{"symbol": "H", "position": [0, 0]}],  # too few coordinates
+        [{"symbol": "H", "position": [0, 0, "x"]}],  # not a number
+        [{"symbol": "H", "position": [0, 0, float("nan")]}],
+        [{"symbol": "H", "position": [0, 0, 0], "mass": 2}],  # unexpected key
+    ],
+)
+def test_invalid_atoms_deserialization(atoms):
+    with pytest.raises(ValueError):
+        Molecule.from_dict({"atoms": atoms, "charge": 0, "spin_multiplicity": 2})
+
+
+def test_molecule_arrays(mol):
+    """The fast path fills the array views of the molecule."""
+    np.testing.assert_array_equal(mol.numbers, [8, 1, 1])
+    np.testing.assert_array_equal(mol.positions, [[0, 0, 0], [0, 1, 0], [0, 0, 1]])
+    assert mol.to_pyscf() == [("O", [0, 0, 0]), ("H", [0, 1, 0]), ("H", [0, 0, 1])]
+
+    # molecules built directly compute them on demand
+    direct = Molecule(mol.atoms, spin_multiplicity=1, charge=0)
+    np.testing.assert_array_equal(direct.positions, mol.positions)
+
+
 def test_molecule_serialize(mol):
     """Test whether we can serialize molecules into dicts."""
     assert asdict(mol) == {
@@ -83,9 +111,20 @@ def test_molecule_to_string(mol):
 def test_request_deserialization(req_dict):
     """Test whether we can deserialize entire dft request."""
 
-    # NOTE: need to copy b/c 'from_dict' modifies the input dict inplace
     cpy = deepcopy(req_dict)
     r = EnergyRequest.from_dict(req_dict)
+    # the input is left untouched
+    assert req_dict == cpy
+    cpy["config"] |= {
+        "symmetry": True,
+        "symmetry_tolerance": SYMMETRY_TOLERANCE,
+        "init_guess": "minao",
+        "scf_rescue": True,
+        "ecp": "none",
+    }
+    cpy["fields"] = ("energy", "orbitals")
+    cpy["properties"] = ()
+    cpy["fragmentation"] = None
     assert asdict(r) == cpy
 
 
@@ -102,4 +141,23 @@ def test_invalid_request_deserialization(req_dict):
 
 def test_single_point_energy_deserialization(expected_energy_response):
     resp = SinglePointEnergyResponse.from_dict(expected_energy_response)
-    assert asdict(resp) == expected_energy_response
+    assert resp.to_dict() == expected_energy_response
+
+
+def test_request_fields(req_dict):
+    assert EnergyRequest.from_dict(req_dict | {"fields": ["homo_lumo"]}).fields == ("homo_lumo",)
+    assert EnergyRequest.from_dict(req_dict | {"fields": []}).fields == ()
+
+    with pytest.raises(DFTRequestValidationException):
+        EnergyRequest.from_dict(req_dict | {"fields": ["hessian"]})  # only for optimizations
+    with pytest.raises(DFTRequestValidationException):
+        EnergyRequest.from_dict(req_dict | {"fields": "energy"})
+
+
+def test_partial_energy_response():
+    """Fields that were not requested are left out of the payload and come
+    back as None."""
+    resp = SinglePointEnergyResponse(energy=-1.0, converged=True, point_group="C1", homo=-0.3, lumo=0.1)
+    payload = resp.to_dict()
+    assert payload == {"energy": -1.0, "converged": True, "point_group": "C1", "homo": -0.3, "lumo": 0.1}
+    assert SinglePointEnergyResponse.from_dict(payload) == resp
@@ -0,0 +1,163 @@
+import json
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from pyscf.data.nist import BOHR
+from pysll import Constellation
+from scipy.spatial.transform import Rotation
+
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.models import (
+    FunctionalConfig,
+    Molecule,
+    ReactionPathRequest,
+    ReactionPathResponse,
+)
+from cloudcompchem.neb import align, evaluate_image, idpp, neb_forces, reaction_path
+from cloudcompchem.server import create_app
+
+HEADERS = {"Authorization": "Bearer abc123"}
+
+
+def _ammonia(z: float) -> dict:
+    return {
+        "atoms": [
+            {"symbol": "N", "position": [0, 0, 0]},
+            {"symbol": "H", "position": [0.94, 0, z]},
+            {"symbol": "H", "position": [-0.47, 0.814, z]},
+            {"symbol": "H", "position": [-0.47, -0.814, z]},
+        ],
+        "charge": 0,
+        "spin_multiplicity": 1,
+    }
+
+
+@pytest.fixture()
+def inversion_dict():
+    """The umbrella inversion of ammonia, whose saddle point is the planar
+    molecule halfway."""
+    return {
+        "config": {"functional": "hf", "basis_set": "sto-3g"},
+        "reactant": _ammonia(-0.38),
+        "product": _ammonia(0.38),
+        "images": 3,
+    }
+
+
+def test_align_removes_rigid_motions():
+    positions = Molecule.from_dict(_ammonia(-0.38)).positions
+    moved = Rotation.from_euler("xyz", [30, -50, 80], degrees=True).apply(positions) + [1.0, -2.0, 0.5]
+    assert np.allclose(align(positions, moved), positions)
+
+
+def test_idpp_keeps_atoms_apart():
+    # HCN to HNC: interpolating the positions moves the carbon and nitrogen atoms through each other
+    reactant = np.array([[0.08, 0, -1.07], [0.03, 0, 0], [-0.02, 0, 1.15]]) / BOHR
+    product = align(reactant, np.array([[0.08, 0, 2.17], [-0.02, 0, -0.01], [0.04, 0, 1.16]]) / BOHR)
+    linear = np.linspace(reactant, product, 7)
+    path = idpp(reactant, product, 5)
+
+    def shortest(images):
+        return min(np.linalg.norm(x[i] - x[j]) for x in images for i, j in ((0, 1), (0, 2), (1, 2)))
+
+    assert path.shape == (7, 3, 3)
+    assert np.array_equal(path[0], reactant) and np.array_equal(path[-1], product)
+    assert shortest(linear) < 0.5 < 1.5 < shortest(path)
+
+
+def test_climbing_image_climbs():
+    # a straight, evenly spaced band in a linear potential rising along it
+    path = np.linspace(0, 4, 5)[:, None, None] * np.array([[1.0, 0, 0]])
+    energies = path[:, 0, 0].copy()
+    gradients = np.tile([[1.0, 0, 0]], (3, 1, 1))
+    forces = neb_forces(path, energies, gradients, spring=0.1)
+    assert np.allclose(forces, 0)
+    forces = neb_forces(path, energies, gradients, spring=0.1, climbing=2)
+    assert np.allclose(forces[1], [[1.0, 0, 0]]) and np.allclose(forces[[0, 2]], 0)
+
+
+def test_images_warm_start():
+    config = FunctionalConfig(functional="hf", basis_set="sto-3g")
+    molecule = Molecule.from_dict(_ammonia(-0.38))
+    cold = evaluate_image(config, molecule)
+    warm = evaluate_image(config, molecule, cold.density)
+    assert warm.energy == pytest.approx(cold.energy, abs=1e-8)
+    assert warm.scf_cycles < cold.scf_cycles
+
+
+def test_ammonia_inversion(inversion_dict):
+    request = ReactionPathRequest.from_dict(inversion_dict)
+    calls = []
+
+    def map_images(fn, *iterables):
+        calls.append(len(iterables[1]))
+        return map(fn, *iterables)
+
+    *progress, result = reaction_path(request, map_images)
+    assert isinstance(result, ReactionPathResponse)
+    assert result.converged and result.iterations == len(progress) == len(calls)
+    # the ends are evaluated in the first iteration only
+    assert calls[0] == 5 and set(calls[1:]) == {3}
+    assert [p.iteration for p in progress] == list(range(1, len(progress) + 1))
+
+    assert result.climbing_image == 2 and progress[-1].climbing_image == 2
+    saddle = result.images[2].positions
+    assert np.allclose(saddle[1:, 2], saddle[0, 2], atol=0.01)
+    assert result.barrier == pytest.approx(result.energies[2] - result.energies[0])
+    assert result.energies[1] == pytest.approx(result.energies[3], abs=1e-5)
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"product": _ammonia(0.38) | {"charge": 2}},
+        {"product": _ammonia(0.38) | {"atoms": _ammonia(0.38)["atoms"][:3], "spin_multiplicity": 2}},
+        {"images": 0},
+        {"images": 100},
+        {"fmax": -1},
+        {"climbing": "yes"},
+        {"max_iterations": 1.5},
+    ],
+)
+def test_invalid_reaction_path_request(inversion_dict, change):
+    with pytest.raises(DFTRequestValidationException):
+        ReactionPathRequest.from_dict(inversion_dict | change)
+
+
+def test_reaction_path_streams_progress(client, inversion_dict):
+    response = client.post("/reaction-path", json=inversion_dict | {"max_iterations": 2}, headers=HEADERS)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line["progress"]["iteration"] for line in lines[:-1]] == [1, 2]
+    assert len(lines[0]["progress"]["energies"]) == 5
+
+    result = ReactionPathResponse.from_dict(lines[-1]["result"])
+    assert not result.converged and result.iterations == 2
+    assert len(result.images) == 5
+
+    response = client.post("/reaction-path", json=inversion_dict | {"images": 0}, headers=HEADERS)
+    assert response.status_code == 400
+
+
+def test_draining_worker_refuses_reaction_paths(inversion_dict):
+    with patch("pysll.Constellation.me", return_value=None):
+        app = create_app(constellation=Constellation())
+        app.extensions["dft_controller"].shutdown()
+        response = app.test_client().post("/reaction-path", json=inversion_dict, headers=HEADERS)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_local_client(local_sdk_client, inversion_dict):
+    progress = []
+    result = local_sdk_client.reaction_path(
+        Molecule.from_dict(inversion_dict["reactant"]),
+        Molecule.from_dict(inversion_dict["product"]),
+        FunctionalConfig(**inversion_dict["config"]),
+        images=1,
+        max_iterations=3,
+        on_progress=progress.append,
+    )
+    assert len(result.images) == 3 and result.iterations == len(progress) <= 3
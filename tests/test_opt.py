@@ -1,9 +1,13 @@
+import re
 from math import isclose
 
 import numpy as np
+import pytest
+from pyscf import gto
 
-from cloudcompchem.models import DFTOptRequest
-from cloudcompchem.opt import run_dft_opt
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.models import DFTOptRequest, Molecule, TransitionStateConfig
+from cloudcompchem.opt import TransitionStateSearch, run_dft_opt
 
 water_dict = {
     "atoms": [
@@ -23,36 +27,38 @@ water_input_dict = {
 
 water_expected_response = {
     "converged": True,
-    "energy": -76.471217696,
+    "energy": -76.42062760687676,
     "orbitals": [
-        {"energy": -19.171027052211535, "occupancy": 2.0},
-        {"energy": -0.9909480669966213, "occupancy": 2.0},
-        {"energy": -0.47266274771354133, "occupancy": 2.0},
-        {"energy": -0.3917614837228546, "occupancy": 2.0},
-        {"energy": -0.2894290750128778, "occupancy": 2.0},
-        {"energy": 0.03804360154196448, "occupancy": 0.0},
-        {"energy": 0.11588306314232323, "occupancy": 0.0},
-        {"energy": 0.5065491242360264, "occupancy": 0.0},
-        {"energy": 0.618809332019355, "occupancy": 0.0},
-        {"energy": 0.9129455648075336, "occupancy": 0.0},
-        {"energy": 0.930612531542112, "occupancy": 0.0},
-        {"energy": 1.0052452617860932, "occupancy": 0.0},
-        {"energy": 1.0761800070059897, "occupancy": 0.0},
-        {"energy": 1.2759217403838836, "occupancy": 0.0},
-        {"energy": 1.342250293269888, "occupancy": 0.0},
-        {"energy": 1.575434743289961, "occupancy": 0.0},
-        {"energy": 1.7015414134666735, "occupancy": 0.0},
-        {"energy": 2.0398134470816798, "occupancy": 0.0},
-        {"energy": 2.084252729637172, "occupancy": 0.0},
-        {"energy": 2.8804846548812506, "occupancy": 0.0},
-        {"energy": 2.940459073742362, "occupancy": 0.0},
-        {"energy": 3.031265809644373, "occupancy": 0.0},
-        {"energy": 3.408867404807953, "occupancy": 0.0},
-        {"energy": 3.739660908087108, "occupancy": 0.0},
+        {"energy": -19.12471644827341, "occupancy": 2.0},
+        {"energy": -0.9919161126013888, "occupancy": 2.0},
+        {"energy": -0.5068291381842464, "occupancy": 2.0},
+        {"energy": -0.3674348500210269, "occupancy": 2.0},
+        {"energy": -0.287746857850271, "occupancy": 2.0},
+        {"energy": 0.049226375475311966, "occupancy": 0.0},
+        {"energy": 0.12517939965521005, "occupancy": 0.0},
+        {"energy": 0.5496636660335638, "occupancy": 0.0},
+        {"energy": 0.6116038297784773, "occupancy": 0.0},
+        {"energy": 0.9038623208835506, "occupancy": 0.0},
+        {"energy": 0.9181263141336059, "occupancy": 0.0},
+        {"energy": 0.9961560124969469, "occupancy": 0.0},
+        {"energy": 1.1906395602290614, "occupancy": 0.0},
+        {"energy": 1.236371162252759, "occupancy": 0.0},
+        {"energy": 1.4165206376744475, "occupancy": 0.0},
+        {"energy": 1.5909138163626313, "occupancy": 0.0},
+        {"energy": 1.6697923533892678, "occupancy": 0.0},
+        {"energy": 2.09002332194821, "occupancy": 0.0},
+        {"energy": 2.1316070815983372, "occupancy": 0.0},
+        {"energy": 2.9206712920203515, "occupancy": 0.0},
+        {"energy": 2.9500324366124273, "occupancy": 0.0},
+        {"energy": 3.124294241519501, "occupancy": 0.0},
+        {"energy": 3.4456588924281917, "occupancy": 0.0},
+        {"energy": 3.735267886583471, "occupancy": 0.0},
     ],
+    # Angstrom
     "distance_matrix": np.array(
-        [[0.0, 1.83048552, 1.83048552], [1.83048552, 0.0, 2.85977529], [1.83048552, 2.85977529, 0.0]]
+        [[0.0, 0.96865122, 0.96865122], [0.96865122, 0.0, 1.51332791], [0.96865122, 1.51332791, 0.0]]
     ),
+    "frequencies": np.array([1658.7087, 3751.0419, 3852.4195]),
 }
 
 
@@ -71,6 +77,8 @@ def test_water():
     response = run_dft_opt(request)
     expected_response = water_expected_response
     assert response.converged
+    assert response.point_group == "C2v"
+    assert [stage.name for stage in response.stages] == ["target"]
     assert isclose(response.energy, expected_response["energy"])
     assert all(
         isclose(ex_orb["energy"], t_orb.energy)
@@ -80,3 +88,117 @@ def test_water():
     coords = np.array([atom.position for atom in response.molecule.atoms])
     matrix = calc_distance_matrix(coords=coords)
     assert np.allclose(expected_response["distance_matrix"], matrix)
+    assert np.allclose(expected_response["frequencies"], response.frequencies["freq_wavenumber"], atol=0.1)
+
+
+def test_water_preopt():
+    """A staged optimization ends at the same minimum as a direct one."""
+    request = DFTOptRequest.from_dict(water_input_dict | {"molecule": water_dict, "preopt": True})
+    assert request.preopt is not None and request.preopt.config.basis_set == "3-21g"
+
+    response = run_dft_opt(request)
+    assert response.converged
+    assert [stage.name for stage in response.stages] == ["preopt", "target"]
+    assert all(stage.seconds > 0 and stage.steps > 0 for stage in response.stages)
+    assert isclose(response.energy, water_expected_response["energy"], abs_tol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "conv_params, message",
+    [
+        ([1e-5], "invalid pre-optimization 'conv_params'"),
+        ({"convergence_gmin": 1e-3}, "[convergence_gmin]"),
+        ({"convergence_energy": "1e-5"}, "[convergence_energy] must be positive numbers"),
+        ({"convergence_grms": -1e-4, "convergence_gmax": True}, "[convergence_grms, convergence_gmax]"),
+    ],
+)
+def test_invalid_preopt_conv_params(conv_params, message):
+    preopt = {"functional": "hf", "basis_set": "sto-3g", "conv_params": conv_params}
+    with pytest.raises(DFTRequestValidationException, match=re.escape(message)):
+        DFTOptRequest.from_dict(water_input_dict | {"molecule": water_dict, "preopt": preopt})
+
+
+@pytest.mark.parametrize("scf_conv_tol", ["1e-6", -1e-6, 0, [1e-6]])
+def test_invalid_preopt_scf_conv_tol(scf_conv_tol):
+    preopt = {"functional": "hf", "basis_set": "sto-3g", "scf_conv_tol": scf_conv_tol}
+    with pytest.raises(DFTRequestValidationException, match="'scf_conv_tol' must be a positive number"):
+        DFTOptRequest.from_dict(water_input_dict | {"molecule": water_dict, "preopt": preopt})
+    # null keeps pyscf's default
+    request = DFTOptRequest.from_dict(
+        water_input_dict | {"molecule": water_dict, "preopt": preopt | {"scf_conv_tol": None}}
+    )
+    assert request.preopt is not None and request.preopt.scf_conv_tol is None
+
+
+def test_water_without_frequencies():
+    """The Hessian is skipped unless the Hessian or frequencies are
+    requested."""
+    request = DFTOptRequest.from_dict(water_input_dict | {"fields": ["energy", "homo_lumo"]})
+    response = run_dft_opt(request)
+    assert response.converged
+    assert response.hessian is None and response.frequencies is None and response.orbitals is None
+    assert response.homo is not None and response.lumo is not None and response.homo < response.lumo
+    assert isclose(response.energy, water_expected_response["energy"])
+
+
+def _ammonia(z: float) -> dict:
+    return {
+        "atoms": [
+            {"symbol": "N", "position": [0, 0, 0]},
+            {"symbol": "H", "position": [0.94, 0, z]},
+            {"symbol": "H", "position": [-0.47, 0.814, z]},
+            {"symbol": "H", "position": [-0.47, -0.814, z]},
+        ],
+        "charge": 0,
+        "spin_multiplicity": 1,
+    }
+
+
+# slightly pyramidal ammonia, next to the planar transition state of its umbrella inversion
+ammonia_ts_dict = {
+    "molecule": _ammonia(0.1),
+    "config": {"functional": "hf", "basis_set": "sto-3g"},
+    "solver": "geomeTRIC",
+    "fields": ["energy", "hessian"],
+}
+
+
+def test_ammonia_transition_state():
+    request = DFTOptRequest.from_dict(ammonia_ts_dict | {"transition_state": {"recalc_hessian": 2}})
+    response = run_dft_opt(request)
+    assert response.converged
+    ts = response.transition_state
+    assert ts.verified and len(ts.imaginary_frequencies) == 1
+    # the starting Hessian, at least one recalculation and the verification
+    assert ts.hessians >= 3
+    positions = np.array([atom.position for atom in response.molecule.atoms])
+    assert np.allclose(positions[1:, 2], positions[0, 2], atol=0.1)
+
+    # a Hessian from a previous job replaces the first one, and the last one is the response's Hessian
+    previous = {"molecule": _ammonia(0.05), "transition_state": {"hessian": np.asarray(response.hessian).tolist()}}
+    again = run_dft_opt(DFTOptRequest.from_dict(ammonia_ts_dict | previous))
+    assert again.transition_state.verified and again.transition_state.hessians == 1
+    assert isclose(again.energy, response.energy, abs_tol=1e-6)
+
+
+def test_minimum_is_not_a_transition_state():
+    mol = gto.M(atom=Molecule.from_dict(_ammonia(0.38)).to_pyscf(), basis="sto-3g")
+    hessian = mol.RHF().run().Hessian().kernel()
+    result = TransitionStateSearch(TransitionStateConfig()).verify(mol, hessian)
+    assert not result.verified and result.imaginary_frequencies == []
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"solver": "berny", "transition_state": True},
+        {"transition_state": "yes"},
+        {"transition_state": {"recalc": 2}},
+        {"transition_state": {"recalc_hessian": -1}},
+        {"transition_state": {"max_steps": 0}},
+        {"transition_state": {"hessian": [[0.0] * 12] * 11}},
+    ],
+)
+def test_invalid_transition_state_request(change):
+    with pytest.raises(DFTRequestValidationException):
+        DFTOptRequest.from_dict(ammonia_ts_dict | change)
@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+from pysll import Constellation
+
+from cloudcompchem.profiling import profiled
+from cloudcompchem.server import create_app
+
+
+def _work():
+    return sum(i * i for i in range(200_000))
+
+
+@pytest.mark.parametrize("mode, profile_file", [("cprofile", "profile.pstats"), ("sampling", "stacks.collapsed")])
+def test_profiled_writes_artifacts(tmp_path, mode, profile_file):
+    with profiled(mode, str(tmp_path)) as profile:
+        _work()
+    profile.attach_result({"energy": -1.0})
+
+    assert os.path.dirname(profile.directory) == str(tmp_path)
+    for name in (profile_file, "memory.txt", "result.json"):
+        assert name in profile.files
+        assert os.path.exists(os.path.join(profile.directory, name))
+
+
+def test_concurrent_profiled_calls(tmp_path):
+    def profiled_work(mode):
+        with profiled(mode, str(tmp_path)) as profile:
+            _work()
+        return profile
+
+    with ThreadPoolExecutor(4) as pool:
+        profiles = list(pool.map(profiled_work, ["cprofile", "sampling"] * 4))
+    assert len({profile.directory for profile in profiles}) == 8
+    assert all("memory.txt" in profile.files for profile in profiles)
+
+
+@pytest.fixture()
+def profiling_client(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLOUDCOMPCHEM_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("CLOUDCOMPCHEM_PROFILE_ADMINS", "id:admin")
+    with patch("pysll.Constellation.me", return_value=None):
+        app = create_app(constellation=Constellation())
+    app.config["TESTING"] = True
+    return app.test_client()
+
+
+def test_profile_request_requires_admin(profiling_client, req_dict, tmp_path):
+    headers = {"Authorization": "Bearer abc123"}
+
+    with patch("pysll.Constellation.me", return_value={"ID": "id:someone"}):
+        response = profiling_client.post("/energy?profile=cprofile", json=req_dict, headers=headers)
+    assert response.status_code == 200
+    assert "X-Profile-Id" not in response.headers
+
+    with patch("pysll.Constellation.me", return_value={"ID": "id:admin"}):
+        response = profiling_client.post("/energy?profile=cprofile", json=req_dict, headers=headers)
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+    assert os.path.exists(tmp_path / profile_id / "profile.pstats")
+    assert os.path.exists(tmp_path / profile_id / "result.json")
+
+
+def test_invalid_profile_mode_fails_at_startup(monkeypatch):
+    monkeypatch.setenv("CLOUDCOMPCHEM_PROFILE", "cprofil")
+    with pytest.raises(ValueError, match="CLOUDCOMPCHEM_PROFILE must be one of cprofile, sampling"):
+        create_app(constellation=Constellation())
+
+
+def test_invalid_profile_mode(client, req_dict):
+    response = client.post("/energy?profile=perf", json=req_dict, headers={"Authorization": "Bearer abc123"})
+    assert response.status_code == 400
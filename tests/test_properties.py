@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from pyscf import scf
+
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.models import EnergyRequest
+from cloudcompchem.properties import lowdin_charges, mulliken_charges
+from cloudcompchem.utils import M
+
+ALL_PROPERTIES = ["dipole", "mulliken_charges", "lowdin_charges", "gradient"]
+
+
+def test_properties_from_one_scf(req_dict, expected_energy_response):
+    request = EnergyRequest.from_dict(req_dict | {"properties": ALL_PROPERTIES})
+    with patch("pyscf.scf.hf.kernel", wraps=scf.hf.kernel) as kernel:
+        response = calculate_energy(request)
+    assert kernel.call_count == 1
+
+    assert np.isclose(response.energy, expected_energy_response["energy"])
+    assert len(response.dipole) == 3 and np.linalg.norm(response.dipole) > 1  # pyright: ignore
+    # neutral molecule: partial charges add up to zero, the hydrogens are equivalent
+    for charges in (response.mulliken_charges, response.lowdin_charges):
+        assert np.isclose(sum(charges), 0, atol=1e-6)  # pyright: ignore
+        assert charges[0] < 0 and np.isclose(charges[1], charges[2])  # pyright: ignore
+    # the forces on a molecule cancel
+    assert np.shape(response.gradient) == (3, 3)
+    assert np.allclose(np.sum(response.gradient, axis=0), 0, atol=1e-4)
+
+    payload = response.to_dict()
+    assert set(ALL_PROPERTIES) <= set(payload)
+
+
+@pytest.mark.parametrize("spin", [0, 1])
+def test_charges_match_pyscf(spin):
+    mol = M(atom="O 0 0 0; H 0 1 0; H 0 0 1", basis="sto-3g", charge=spin, spin=spin)
+    calc = (scf.UHF if spin else scf.RHF)(mol).run()
+
+    _, expected = calc.mulliken_pop(verbose=0)
+    assert np.allclose(mulliken_charges(calc), expected)
+    assert np.isclose(sum(lowdin_charges(calc)), spin)
+
+
+def test_unknown_property(req_dict):
+    with pytest.raises(DFTRequestValidationException):
+        EnergyRequest.from_dict(req_dict | {"properties": ["polarizability"]})
@@ -0,0 +1,72 @@
+import copy
+
+import pytest
+from pyscf.dft import RKS
+
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.models import EnergyRequest
+from cloudcompchem.rescue import RESCUE_CYCLES, RESCUE_STEPS, rescue_scf
+from cloudcompchem.utils import M
+
+
+@pytest.fixture()
+def stretched_water_dict():
+    """Water with both bonds stretched far enough that plain DIIS does not converge."""
+    return {
+        "config": {"functional": "pbe,pbe", "basis_set": "6-31g"},
+        "molecule": {
+            "atoms": [
+                {"symbol": "O", "position": [0, 0, 0]},
+                {"symbol": "H", "position": [0, 0, 2.6]},
+                {"symbol": "H", "position": [2.5, 0, -0.6]},
+            ],
+            "charge": 0,
+            "spin_multiplicity": 1,
+        },
+        "fields": ["energy"],
+    }
+
+
+def _water(max_cycle: int):
+    calc = RKS(M(atom="O 0 0 0; H 0 1 0; H 0 0 1", basis="6-31g"))
+    calc.xc = "pbe,pbe"
+    calc.max_cycle = max_cycle
+    calc.kernel()
+    return calc
+
+
+@pytest.mark.parametrize("step", RESCUE_STEPS)
+def test_every_step_finds_the_ground_state(step):
+    reference = _water(max_cycle=50)
+    unconverged = _water(max_cycle=2)
+    assert not unconverged.converged
+
+    calc = RESCUE_STEPS[step](copy.copy(unconverged))
+    calc.max_cycle = RESCUE_CYCLES
+    calc.kernel(dm0=unconverged.make_rdm1())
+    assert calc.converged
+    # the smeared free energy differs slightly, even with a large HOMO-LUMO gap
+    assert calc.e_tot == pytest.approx(reference.e_tot, abs=1e-5 if step == "smearing" else 1e-7)
+
+
+def test_ladder_stops_at_the_first_converged_step():
+    calc, path = rescue_scf(_water(max_cycle=2))
+    assert path == ["level_shift"]
+    assert calc.converged and calc.level_shift > 0
+
+    converged = _water(max_cycle=50)
+    calc, path = rescue_scf(converged)
+    assert path == [] and calc is converged
+
+
+def test_energy_is_rescued(stretched_water_dict):
+    stretched_water_dict["config"]["scf_rescue"] = False
+    failed = calculate_energy(EnergyRequest.from_dict(stretched_water_dict))
+    assert not failed.converged and failed.rescue_path is None
+    assert "rescue_path" not in failed.to_dict()
+
+    stretched_water_dict["config"]["scf_rescue"] = True
+    rescued = calculate_energy(EnergyRequest.from_dict(stretched_water_dict))
+    assert rescued.converged
+    assert rescued.rescue_path and set(rescued.rescue_path) <= set(RESCUE_STEPS)
+    assert rescued.scf_cycles > failed.scf_cycles
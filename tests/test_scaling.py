@@ -0,0 +1,228 @@
+import json
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from argparse import Namespace
+from dataclasses import replace
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+import requests
+from pysll import Constellation
+
+from cloudcompchem.exceptions import ServiceDrainingException
+from cloudcompchem.loadtest import _wait_until_healthy
+from cloudcompchem.metrics import JOB_SLOTS, PUBLISHED_AT_HEADER
+from cloudcompchem.models import (
+    DFTOptRequest,
+    EnergyRequest,
+    GradientRequest,
+    ReactionPathRequest,
+)
+from cloudcompchem.scaling import (
+    Workload,
+    basis_functions,
+    predict_core_seconds,
+    queue_signals,
+    worker_signals,
+)
+from cloudcompchem.server import DrainingWorker, FlaskApp, create_app, serve
+from cloudcompchem.utils import M
+
+HEADERS = {"Authorization": "Bearer abc123"}
+
+
+@pytest.mark.parametrize("basis_set", ["sto-3g", "6-31g*", "ccpvdz", "def2-tzvp"])
+def test_basis_functions(req_dict, basis_set):
+    molecule = EnergyRequest.from_dict(req_dict).molecule
+    assert basis_functions(basis_set, molecule) == M(atom=molecule.to_pyscf(), basis=basis_set).nao
+
+
+def test_predicted_cost(req_dict):
+    energy = predict_core_seconds(EnergyRequest.from_dict(req_dict))
+    assert energy > 0
+    # a single molecule is a single fragment
+    assert predict_core_seconds(EnergyRequest.from_dict(req_dict | {"fragmentation": {"order": 1}})) == energy
+
+    gradient = GradientRequest.from_dict(req_dict)
+    trajectory = GradientRequest.from_dict(req_dict | {"molecules": [req_dict["molecule"]] * 3})
+    assert predict_core_seconds(trajectory) == pytest.approx(3 * predict_core_seconds(gradient))
+    assert predict_core_seconds(gradient) > energy
+
+    opt = DFTOptRequest.from_dict(req_dict | {"solver": "geomeTRIC"})
+    opt_without_hessian = DFTOptRequest.from_dict(req_dict | {"solver": "geomeTRIC", "fields": ["energy"]})
+    assert predict_core_seconds(opt) > predict_core_seconds(opt_without_hessian) > predict_core_seconds(trajectory)
+    ts = DFTOptRequest.from_dict(req_dict | {"solver": "geomeTRIC", "transition_state": {"recalc_hessian": 3}})
+    assert predict_core_seconds(ts) > predict_core_seconds(opt)
+
+    path = {"reactant": req_dict["molecule"], "product": req_dict["molecule"]}
+    short, long = (ReactionPathRequest.from_dict(req_dict | path | {"images": n}) for n in (3, 9))
+    assert predict_core_seconds(long) == pytest.approx(3 * predict_core_seconds(short), rel=0.02)
+
+    # built directly, since parsing rejects unknown basis sets
+    request = EnergyRequest.from_dict(req_dict)
+    unknown_basis = replace(request, config=replace(request.config, basis_set="no-such-basis"))
+    assert predict_core_seconds(unknown_basis) == 0
+
+
+def test_workload_signals():
+    workload = Workload(slots=2)
+    with workload.track("energy", 5.0):
+        (worker,) = worker_signals()
+        assert worker["running"] == 1 and worker["slots"] == 2 and worker["utilization"] == 0.5
+        assert worker["running_core_seconds"] == 5.0
+        assert 0 <= worker["oldest_job_seconds"] < 5
+
+    (worker,) = worker_signals()
+    assert worker["running"] == 0 and worker["oldest_job_seconds"] is None
+
+
+def test_workload_is_published_by_the_worker():
+    # gunicorn creates the workload in its master, which must not count as a worker
+    JOB_SLOTS.set(0)
+    workload = Workload(slots=3)
+    assert worker_signals() == []
+
+    workload.publish()
+    (worker,) = worker_signals()
+    assert worker["slots"] == 3 and worker["running"] == 0 and not worker["draining"]
+
+
+def test_drain_waits_for_running_calculations():
+    workload, started, release = Workload(), threading.Event(), threading.Event()
+
+    def calculation():
+        with workload.track("opt", 1.0):
+            started.set()
+            release.wait()
+
+    thread = threading.Thread(target=calculation)
+    thread.start()
+    started.wait()
+    assert not workload.drain(timeout=0.05)
+    with pytest.raises(ServiceDrainingException):
+        with workload.track("energy", 1.0):
+            pass
+
+    release.set()
+    assert workload.drain(timeout=5)
+    thread.join()
+
+
+def test_queue_signals():
+    fakeredis = pytest.importorskip("fakeredis")
+    redis = fakeredis.FakeRedis()
+    assert queue_signals(redis) == {"celery": {"depth": 0, "oldest_job_seconds": None}}
+
+    # kombu pushes new messages on the left
+    redis.lpush("celery", json.dumps({"headers": {PUBLISHED_AT_HEADER: time.time() - 30}}))
+    redis.lpush("celery", json.dumps({"headers": {PUBLISHED_AT_HEADER: time.time()}}))
+    signals = queue_signals(redis)["celery"]
+    assert signals["depth"] == 2
+    assert 29 < signals["oldest_job_seconds"] < 60
+
+
+def test_scaling_endpoint_and_shutdown(req_dict):
+    with patch("pysll.Constellation.me", return_value=None), patch.dict(
+        "os.environ", {"CLOUDCOMPCHEM_SCALING_QUEUES": "", "CLOUDCOMPCHEM_WORKER_THREADS": "4"}
+    ):
+        app = create_app(constellation=Constellation())
+        client = app.test_client()
+
+        signals = client.get("/scaling").json
+        assert signals["draining"] is False
+        assert signals["slots"] == 4
+        assert signals["queues"] == {}
+        assert {"running", "slots", "utilization", "running_core_seconds", "oldest_job_seconds"} <= set(signals)
+
+        app.extensions["dft_controller"].shutdown()
+        assert client.get("/health-check").status_code == 503
+        response = client.post("/energy", json=req_dict, headers=HEADERS)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert client.get("/scaling").json["draining"] is True
+
+
+# a gunicorn server whose energy calculations only go ahead once the worker drains
+DRAINING_SERVER = """
+import os, sys, time
+from pathlib import Path
+
+os.environ["FLASK_CELERY__broker_url"] = "memory://"
+os.environ["FLASK_CELERY__result_backend"] = "cache+memory://"
+
+from cloudcompchem import controllers
+from cloudcompchem.loadtest import StubConstellation
+from cloudcompchem.server import FlaskApp, create_app
+
+app, calculate_energy = create_app(constellation=StubConstellation()), controllers.calculate_energy
+
+def calculate_energy_once_draining(request):
+    Path(sys.argv[2]).touch()
+    deadline = time.time() + 30
+    while not app.extensions["dft_controller"]._workload.draining:
+        if time.time() > deadline:
+            raise RuntimeError("The worker did not drain")
+        time.sleep(0.05)
+    return calculate_energy(request)
+
+controllers.calculate_energy = calculate_energy_once_draining
+FlaskApp(
+    app,
+    {
+        "bind": sys.argv[1],
+        "workers": 1,
+        "threads": 2,
+        "worker_class": "cloudcompchem.server.DrainingWorker",
+        "graceful_timeout": 30,
+        "loglevel": "WARNING",
+    },
+).run()
+"""
+
+
+def test_sigterm_drains_running_calculations(req_dict, tmp_path):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        bind = f"127.0.0.1:{sock.getsockname()[1]}"
+    started = tmp_path / "started"
+    server = subprocess.Popen(
+        [sys.executable, "-c", DRAINING_SERVER, bind, str(started)], cwd=Path(__file__).parents[1]
+    )
+    try:
+        _wait_until_healthy(f"http://{bind}")
+        responses = []
+        request = threading.Thread(
+            target=lambda: responses.append(requests.post(f"http://{bind}/energy", json=req_dict, headers=HEADERS))
+        )
+        request.start()
+        while not started.exists():
+            time.sleep(0.05)
+
+        # gunicorn passes the SIGTERM on to its workers, which drain before exiting
+        server.send_signal(signal.SIGTERM)
+        request.join(timeout=60)
+        assert server.wait(timeout=60) == 0
+    finally:
+        server.kill()
+
+    (response,) = responses
+    assert response.status_code == 200
+    assert response.json()["converged"]
+
+
+def test_serve_runs_the_draining_worker(monkeypatch):
+    monkeypatch.setenv("CLOUDCOMPCHEM_SHUTDOWN_TIMEOUT", "2.5")
+    servers = []
+    with patch.object(FlaskApp, "run", lambda self: servers.append(self)):
+        serve(Namespace(bind="127.0.0.1:0", workers=2))
+
+    (server,) = servers
+    assert server.cfg.worker_class is DrainingWorker
+    assert server.cfg.workers == 2
+    assert server.cfg.graceful_timeout == 3
+    assert server.cfg.child_exit.__name__ == "_child_exit"
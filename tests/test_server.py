@@ -1,8 +1,12 @@
 import logging
+from math import isclose
+from unittest.mock import patch
 
 import pytest
+from pysll import Constellation
 
 from cloudcompchem.models import SinglePointEnergyResponse
+from cloudcompchem.server import create_app
 
 
 @pytest.fixture()
@@ -42,6 +46,22 @@ def test_simulate_energy(client, req_dict, caplog, match_mol, expected_energy_re
     match_mol(resp, expected_energy_response)
 
 
+def test_simulate_energy_fields(client, req_dict, expected_energy_response):
+    response = client.post(
+        "/energy",
+        json=req_dict | {"fields": ["energy", "homo_lumo"]},
+        headers={"Authorization": "Bearer abc123"},
+    )
+    assert response.status_code == 200
+    assert "orbitals" not in response.json
+    assert isclose(response.json["energy"], expected_energy_response["energy"])
+
+    # the HOMO and LUMO are the frontier orbitals of the full list
+    occupied = [o["energy"] for o in expected_energy_response["orbitals"] if o["occupancy"] > 0]
+    virtual = [o["energy"] for o in expected_energy_response["orbitals"] if o["occupancy"] == 0]
+    assert isclose(response.json["homo"], max(occupied)) and isclose(response.json["lumo"], min(virtual))
+
+
 def test_simulate_energy_spin_error(client, req_dict, caplog):
     caplog.set_level(logging.DEBUG)
     molecule = req_dict["molecule"] | {"spin_multiplicity": 0}
@@ -98,3 +118,20 @@ def test_simulate_energy_functional_error(client, req_dict, caplog):
     )
     assert response.status_code == 400
     assert "LibXCFunctional: name" in str(response.data)
+
+
+def test_simulate_energy_body_too_large(req_dict, monkeypatch):
+    monkeypatch.setenv("CLOUDCOMPCHEM_MAX_BODY_BYTES", "100")
+    with patch("pysll.Constellation.me", return_value=None) as me:
+        client = create_app(constellation=Constellation()).test_client()
+        response = client.post("/energy", json=req_dict, headers={"Authorization": "Bearer abc123"})
+    assert response.status_code == 413
+    # rejected before the token is validated
+    me.assert_not_called()
+
+
+def test_simulate_energy_invalid_json(client):
+    response = client.post(
+        "/energy", data="{not json", content_type="application/json", headers={"Authorization": "Bearer abc123"}
+    )
+    assert response.status_code == 400
@@ -0,0 +1,133 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from flask import request as flask_request
+from pysll import Constellation
+
+from cloudcompchem.client import Client
+from cloudcompchem.dft import calculate_gradients
+from cloudcompchem.exceptions import SessionNotFoundException
+from cloudcompchem.models import (
+    FunctionalConfig,
+    GradientRequest,
+    SessionResponse,
+    SessionStepRequest,
+)
+from cloudcompchem.server import create_app
+from cloudcompchem.sessions import SessionStore
+
+HEADERS = {"Authorization": "Bearer abc123"}
+
+
+@pytest.fixture()
+def gradient_request(req_dict):
+    return GradientRequest.from_dict({"config": req_dict["config"], "molecule": req_dict["molecule"]})
+
+
+def test_session_steps(gradient_request, req_dict):
+    store = SessionStore()
+    created = store.create("id:me", gradient_request)
+    assert created.result is not None and created.result.converged
+
+    moved = gradient_request.molecules[0].positions + [[0, 0, 0], [0, 0.02, 0], [0, 0, -0.02]]
+    step = store.evaluate(created.session_id, "id:me", SessionStepRequest(positions=moved)).result
+    assert step is not None and step.scf_cycles < created.result.scf_cycles
+
+    # same numbers as a fresh calculation at that geometry
+    atoms = [{"symbol": a["symbol"], "position": list(p)} for a, p in zip(req_dict["molecule"]["atoms"], moved)]
+    fresh_request = GradientRequest.from_dict(req_dict | {"molecule": req_dict["molecule"] | {"atoms": atoms}})
+    fresh = calculate_gradients(fresh_request).results[0]
+    assert np.isclose(step.energy, fresh.energy, atol=1e-8)
+    assert np.allclose(step.gradient, fresh.gradient, atol=1e-5)  # pyright: ignore
+
+    energy_only = store.evaluate(created.session_id, "id:me", SessionStepRequest(positions=moved, gradient=False))
+    assert energy_only.result is not None and energy_only.result.gradient is None
+
+    store.close(created.session_id, "id:me")
+    assert len(store) == 0
+
+
+def test_sessions_are_private(gradient_request):
+    store = SessionStore()
+    session_id = store.create("id:me", gradient_request).session_id
+    with pytest.raises(SessionNotFoundException):
+        store.close(session_id, "id:someone-else")
+
+
+def test_session_eviction(gradient_request):
+    store = SessionStore(max_sessions=1)
+    first = store.create(None, gradient_request).session_id
+    store.create(None, gradient_request)
+    assert len(store) == 1
+    with pytest.raises(SessionNotFoundException):
+        store.close(first, None)
+
+    # over the memory budget the least recently used session goes, the newest one stays
+    store = SessionStore(max_bytes=1)
+    store.create(None, gradient_request)
+    store.create(None, gradient_request)
+    assert len(store) == 1
+
+    store = SessionStore(idle_seconds=0)
+    session_id = store.create(None, gradient_request).session_id
+    with pytest.raises(SessionNotFoundException):
+        store.close(session_id, None)
+
+
+def test_session_endpoints(client, req_dict):
+    response = client.post("/sessions", json=req_dict, headers=HEADERS)
+    assert response.status_code == 200
+    session = SessionResponse.from_dict(response.json)
+
+    positions = [atom["position"] for atom in req_dict["molecule"]["atoms"]]
+    response = client.post(f"/sessions/{session.session_id}/evaluate", json={"positions": positions}, headers=HEADERS)
+    assert response.status_code == 200
+    step = SessionResponse.from_dict(response.json).result
+    assert step is not None and np.isclose(step.energy, session.result.energy)  # pyright: ignore
+
+    response = client.post(f"/sessions/{session.session_id}/evaluate", json={"positions": [[0, 0, 0]]}, headers=HEADERS)
+    assert response.status_code == 400
+
+    assert client.delete(f"/sessions/{session.session_id}", headers=HEADERS).status_code == 200
+    response = client.post(f"/sessions/{session.session_id}/evaluate", json={"positions": positions}, headers=HEADERS)
+    assert response.status_code == 404
+
+
+def test_local_client_session(mol):
+    with patch("pysll.Constellation.me", return_value=None):
+        client = Client(local=True, constellation=Constellation())
+        with client.open_session(mol, FunctionalConfig(functional="pbe,pbe", basis_set="sto-3g")) as session:
+            assert session.result is not None
+            result = session.evaluate(mol.positions * 1.01)
+            assert result.converged and np.shape(result.gradient) == (3, 3)
+        assert len(client._local_sessions) == 0
+
+
+def test_configured_session_limits(monkeypatch):
+    monkeypatch.setenv("CLOUDCOMPCHEM_SESSION_MAX", "1")
+    with patch("pysll.Constellation.me", return_value=None):
+        app = create_app(constellation=Constellation())
+    assert app.extensions["dft_controller"]._sessions.max_sessions == 1
+
+
+def test_concurrent_requests_authenticate_their_own_user():
+    class TokenConstellation(Constellation):
+        def me(self):
+            # long enough for the other requests to authenticate meanwhile
+            time.sleep(0.05)
+            return {"ID": f"id:{self._auth_token}"}
+
+    app = create_app(constellation=TokenConstellation())
+    controller = app.extensions["dft_controller"]
+
+    def user(token):
+        with app.test_request_context(headers={"Authorization": f"Bearer {token}"}):
+            controller._authenticate(flask_request, "sessions")
+            return controller._user_id()
+
+    tokens = [f"user{i}" for i in range(8)]
+    with ThreadPoolExecutor(8) as pool:
+        assert list(pool.map(user, tokens)) == [f"id:{token}" for token in tokens]
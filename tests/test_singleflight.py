@@ -0,0 +1,101 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cloudcompchem.models import EnergyRequest, SinglePointEnergyResponse
+from cloudcompchem.singleflight import KEY_PREFIX, SingleFlight, request_key
+
+
+class SlowEnergy:
+    """A stand-in calculation that takes a while and counts its calls."""
+
+    def __init__(self, seconds: float = 0.3):
+        self.seconds = seconds
+        self.calls = 0
+
+    def __call__(self) -> SinglePointEnergyResponse:
+        self.calls += 1
+        time.sleep(self.seconds)
+        return SinglePointEnergyResponse(energy=-76.3, converged=True)
+
+
+def test_request_key(req_dict):
+    key = request_key("energy", EnergyRequest.from_dict(req_dict))
+
+    reordered = {"molecule": req_dict["molecule"], "config": req_dict["config"]}
+    floats = [atom | {"position": [float(x) for x in atom["position"]]} for atom in req_dict["molecule"]["atoms"]]
+    reordered["molecule"] = reordered["molecule"] | {"atoms": floats}
+    assert request_key("energy", EnergyRequest.from_dict(reordered)) == key
+
+    assert request_key("opt", EnergyRequest.from_dict(req_dict)) != key
+    other_basis = req_dict | {"config": req_dict["config"] | {"basis_set": "sto-3g"}}
+    assert request_key("energy", EnergyRequest.from_dict(other_basis)) != key
+
+
+def test_coalesces_within_a_process():
+    single_flight, calculation = SingleFlight(), SlowEnergy()
+    with ThreadPoolExecutor(4) as pool:
+        futures = [
+            pool.submit(single_flight.run, "key", calculation, SinglePointEnergyResponse.from_dict) for _ in range(4)
+        ]
+        results = [future.result() for future in futures]
+    assert calculation.calls == 1
+    assert all(result is results[0] for result in results)
+
+    # finished calculations are not cached
+    single_flight.run("key", calculation, SinglePointEnergyResponse.from_dict)
+    assert calculation.calls == 2
+
+
+def test_failures_reach_every_waiting_request():
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("SCF exploded")
+
+    single_flight = SingleFlight()
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(single_flight.run, "key", fail, SinglePointEnergyResponse.from_dict)
+        started.wait()
+        follower = pool.submit(single_flight.run, "key", fail, SinglePointEnergyResponse.from_dict)
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError, match="SCF exploded"):
+                future.result()
+
+
+# with a short lease the calculation outlives it several times and relies on its renewal
+@pytest.mark.parametrize("lease_seconds", [30, 0.15])
+def test_coalesces_across_workers(lease_seconds):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    workers = [
+        SingleFlight(fakeredis.FakeRedis(server=server), lease_seconds=lease_seconds, poll_seconds=0.01)
+        for _ in range(2)
+    ]
+    calculations = [SlowEnergy(seconds=0.6), SlowEnergy(seconds=0.6)]
+
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(workers[0].run, "key", calculations[0], SinglePointEnergyResponse.from_dict)
+        time.sleep(0.1)
+        second = pool.submit(workers[1].run, "key", calculations[1], SinglePointEnergyResponse.from_dict)
+        assert first.result() == second.result()
+
+    assert [calculation.calls for calculation in calculations] == [1, 0]
+    assert fakeredis.FakeRedis(server=server).get(f"{KEY_PREFIX}:key:lease") is None
+
+
+def test_expired_lease_is_taken_over():
+    fakeredis = pytest.importorskip("fakeredis")
+    redis = fakeredis.FakeRedis()
+    # a worker that crashed while holding the lease
+    redis.set(f"{KEY_PREFIX}:key:lease", "crashed", px=300)
+
+    calculation = SlowEnergy(seconds=0)
+    start = time.perf_counter()
+    SingleFlight(redis, poll_seconds=0.01).run("key", calculation, SinglePointEnergyResponse.from_dict)
+    assert calculation.calls == 1
+    assert time.perf_counter() - start >= 0.25
@@ -0,0 +1,77 @@
+import json
+from math import isclose
+
+import numpy as np
+from pyscf import symm
+
+from cloudcompchem.dft import calculate_energy
+from cloudcompchem.models import DFTOptRequest, EnergyRequest
+from cloudcompchem.opt import run_dft_opt
+from cloudcompchem.utils import M, point_group
+
+NOISY_WATER = "O 0 0 0; H 0 1 0; H 0 0 1.0001"
+
+
+def test_detects_point_group_within_tolerance():
+    mole = M(atom=NOISY_WATER, basis="sto-3g", symmetry=True)
+    assert point_group(mole) == "C2v"
+
+    # the geometry is symmetrized: both O-H bonds have the same length
+    coords = mole.atom_coords()
+    assert isclose(np.linalg.norm(coords[1] - coords[0]), np.linalg.norm(coords[2] - coords[0]))
+    # without changing pyscf's own tolerance, which other threads use
+    assert symm.geom.TOLERANCE == 1e-5
+
+
+def test_falls_back_to_c1():
+    assert point_group(M(atom=NOISY_WATER, basis="sto-3g")) == "C1"
+    assert point_group(M(atom=NOISY_WATER, basis="sto-3g", symmetry=True, symmetry_tolerance=1e-6)) == "Cs"
+    assert point_group(M(atom="N 0 0 0; H 0 1 0.1; H 0.2 0 1; H 1 1 1.3", basis="sto-3g", symmetry=True)) == "C1"
+
+
+def test_symmetric_energy_matches_c1(req_dict):
+    symmetric = calculate_energy(EnergyRequest.from_dict(req_dict))
+    req_dict["config"]["symmetry"] = False
+    c1 = calculate_energy(EnergyRequest.from_dict(req_dict))
+
+    assert symmetric.point_group == "C2v" and c1.point_group == "C1"
+    assert isclose(symmetric.energy, c1.energy, abs_tol=1e-8)
+
+
+def test_linear_molecules_run_in_abelian_subgroup():
+    # D∞h and C∞v are detected, pyscf runs them in D2h and C2v
+    assert point_group(M(atom="H 0 0 0; H 0 0 0.74", basis="sto-3g", symmetry=True)) == "Dooh"
+    assert M(atom="H 0 0 0; H 0 0 0.74", basis="sto-3g", symmetry=True).groupname == "D2h"
+    assert M(atom="O 0 0 0; H 0 0 0.97", basis="sto-3g", spin=1, symmetry=True).groupname == "C2v"
+
+
+def _triplet_oxygen(symmetry: bool) -> dict:
+    """O2, linear and unrestricted."""
+    return {
+        "config": {"functional": "pbe,pbe", "basis_set": "sto-3g", "symmetry": symmetry},
+        "molecule": {
+            "atoms": [{"symbol": "O", "position": [0, 0, 0]}, {"symbol": "O", "position": [0, 0, 1.21]}],
+            "charge": 0,
+            "spin_multiplicity": 3,
+        },
+    }
+
+
+def test_symmetric_open_shell_energy_matches_c1():
+    symmetric = calculate_energy(EnergyRequest.from_dict(_triplet_oxygen(True)))
+    c1 = calculate_energy(EnergyRequest.from_dict(_triplet_oxygen(False)))
+
+    assert symmetric.point_group == "Dooh" and c1.point_group == "C1"
+    assert isclose(symmetric.energy, c1.energy, abs_tol=1e-6)
+    # the 10 alpha, then the 10 beta orbitals of the minimal basis, 9 of them occupied
+    for orbitals in (symmetric.orbitals, c1.orbitals):
+        assert orbitals is not None and len(orbitals) == 20
+        assert all(type(orbital.energy) is float for orbital in orbitals)
+        assert sum(orbital.occupancy for orbital in orbitals[:10]) == 9
+    json.dumps(symmetric.to_dict())
+
+
+def test_open_shell_optimization():
+    response = run_dft_opt(DFTOptRequest.from_dict(_triplet_oxygen(True) | {"solver": "geomeTRIC"}))
+    assert response.converged and response.orbitals is not None and len(response.orbitals) == 20
+    assert all(type(orbital.occupancy) is float for orbital in response.orbitals)
@@ -0,0 +1,134 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from pyscf import gto
+from pyscf.hessian import thermo
+
+from cloudcompchem.exceptions import DFTRequestValidationException
+from cloudcompchem.models import (
+    DFTOptRequest,
+    StructureRelaxationResponse,
+    ThermoRequest,
+)
+from cloudcompchem.opt import run_dft_opt
+from cloudcompchem.thermochemistry import calculate_thermo
+from cloudcompchem.utils import jsonable, point_group
+
+TEMPERATURES = [50.0, 298.15, 1500.0]
+PRESSURES = [1e3, 101325.0, 1e7]
+
+
+@pytest.fixture(scope="module")
+def optimization() -> tuple[dict, gto.Mole]:
+    """An optimized water molecule with its Hessian, as returned by /opt,
+    and the optimized pyscf molecule."""
+    request = DFTOptRequest.from_dict(
+        {
+            "molecule": {
+                "atoms": [
+                    {"symbol": "O", "position": [0, 0, 0]},
+                    {"symbol": "H", "position": [0, 1, 0]},
+                    {"symbol": "H", "position": [0, 0, 1]},
+                ],
+                "charge": 0,
+                "spin_multiplicity": 1,
+            },
+            "config": {"functional": "pbe,pbe", "basis_set": "sto-3g"},
+            "solver": "geomeTRIC",
+            "fields": ["energy", "hessian"],
+        }
+    )
+    with patch("cloudcompchem.opt.point_group", wraps=point_group) as detect:
+        response = run_dft_opt(request)
+    (mol,) = detect.call_args.args
+    return json.loads(json.dumps(response.to_dict(), default=jsonable)), mol
+
+
+@pytest.fixture(scope="module")
+def relaxation(optimization) -> dict:
+    return optimization[0]
+
+
+def test_matches_pyscf_on_every_grid_point(optimization):
+    relaxation, mol = optimization
+    result = calculate_thermo(
+        ThermoRequest.from_dict(relaxation | {"temperatures": TEMPERATURES, "pressures": PRESSURES})
+    )
+    assert result.symmetry_number == 2 and result.imaginary_frequencies == 0
+    assert len(result.frequencies) == 3
+
+    # the response holds the optimized geometry in Angstrom
+    positions = [atom["position"] for atom in relaxation["molecule"]["atoms"]]
+    assert np.allclose(positions, mol.atom_coords(unit="Angstrom"), atol=1e-6)
+    frequencies = thermo.harmonic_analysis(mol, np.array(relaxation["hessian"]))["freq_au"]
+    model = SimpleNamespace(mol=mol, e_tot=relaxation["energy"])
+    for i, temperature in enumerate(TEMPERATURES):
+        for j, pressure in enumerate(PRESSURES):
+            expected = thermo.thermo(model, frequencies, temperature, pressure)
+            assert result.zpe == pytest.approx(expected["ZPE"][0], abs=1e-12)
+            assert result.internal_energy[i] == pytest.approx(expected["E_tot"][0], abs=1e-10)
+            assert result.enthalpy[i] == pytest.approx(expected["H_tot"][0], abs=1e-10)
+            assert result.heat_capacity[i] == pytest.approx(expected["Cp_tot"][0], abs=1e-12)
+            assert result.entropy[i][j] == pytest.approx(expected["S_tot"][0], abs=1e-12)
+            assert result.gibbs_free_energy[i][j] == pytest.approx(expected["G_tot"][0], abs=1e-10)
+
+
+def test_large_grid(relaxation):
+    temperatures, pressures = np.linspace(10, 3000, 1000), np.geomspace(1, 1e8, 1000)
+    result = calculate_thermo(
+        ThermoRequest.from_dict(relaxation | {"temperatures": temperatures, "pressures": pressures})
+    )
+    gibbs = np.array(result.gibbs_free_energy)
+    assert gibbs.shape == (1000, 1000) and np.isfinite(gibbs).all()
+    # G falls with the temperature and rises with the pressure
+    assert (np.diff(gibbs, axis=0) < 0).all() and (np.diff(gibbs, axis=1) > 0).all()
+
+
+def test_flattened_hessian_and_imaginary_modes(relaxation):
+    hessian = np.array(relaxation["hessian"])
+    flat = hessian.transpose(0, 2, 1, 3).reshape(9, 9)
+    assert calculate_thermo(ThermoRequest.from_dict(relaxation | {"hessian": flat})).zpe == pytest.approx(
+        calculate_thermo(ThermoRequest.from_dict(relaxation)).zpe
+    )
+
+    saddle = calculate_thermo(ThermoRequest.from_dict(relaxation | {"hessian": -hessian}))
+    assert saddle.imaginary_frequencies == 3 and saddle.frequencies == [] and saddle.zpe == 0
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"hessian": [[1.0]]},
+        {"hessian": None},
+        {"energy": "low"},
+        {"temperatures": []},
+        {"temperatures": [-1]},
+        {"pressures": [0]},
+        {"pressures": ["high"]},
+        {"temperatures": list(range(1, 2001)), "pressures": list(range(1, 1001))},
+    ],
+)
+def test_invalid_thermo_request(relaxation, change):
+    with pytest.raises(DFTRequestValidationException):
+        ThermoRequest.from_dict(relaxation | change)
+
+
+def test_thermo_endpoint(client, relaxation):
+    response = client.post(
+        "/thermo",
+        json=relaxation | {"temperatures": TEMPERATURES, "pressures": PRESSURES},
+        headers={"Authorization": "Bearer abc123"},
+    )
+    assert response.status_code == 200
+    assert np.shape(response.json["gibbs_free_energy"]) == (3, 3)
+    assert response.json["temperatures"] == TEMPERATURES
+
+
+def test_local_client(local_sdk_client, relaxation):
+    result = local_sdk_client.thermochemistry(
+        StructureRelaxationResponse.from_dict(relaxation), temperatures=TEMPERATURES
+    )
+    assert len(result.enthalpy) == 3 and np.shape(result.entropy) == (3, 1)